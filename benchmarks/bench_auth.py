@@ -0,0 +1,77 @@
+"""
+登录认证吞吐量基准测试
+
+模拟登录高峰：多个线程并发调用 DatabaseManager.authenticate_user，
+分别在“会话线程内直接计算哈希”和“进程池计算哈希”两种方式下统计每秒认证次数。
+
+用法：
+    python benchmarks/bench_auth.py --users 20 --logins 200 --threads 16 --workers 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database_manager import DatabaseManager
+from core.password_hasher import PasswordVerifier, verify_password
+
+
+class InlineVerifier(PasswordVerifier):
+    """在调用线程中直接计算哈希，作为对照组"""
+
+    def _run(self, func, *args):
+        return func(*args)
+
+
+def run(db: DatabaseManager, users: list, logins: int, threads: int) -> float:
+    """返回每秒成功认证次数"""
+    def login(i: int) -> bool:
+        return db.authenticate_user(users[i % len(users)], "bench-password") is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        ok = sum(pool.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+    if ok != logins:
+        raise RuntimeError(f"认证失败 {logins - ok} 次")
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录认证吞吐量基准测试")
+    parser.add_argument("--users", type=int, default=20, help="测试用户数")
+    parser.add_argument("--logins", type=int, default=100, help="每种方式的登录次数")
+    parser.add_argument("--threads", type=int, default=16, help="并发登录线程数（模拟会话线程）")
+    parser.add_argument("--workers", type=int, default=None, help="密码校验进程数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pool_verifier = PasswordVerifier(max_workers=args.workers)
+        db = DatabaseManager(db_path=os.path.join(tmp_dir, "bench.db"), password_verifier=pool_verifier)
+        users = [f"bench_user_{i}" for i in range(args.users)]
+        db.bulk_add_users([
+            {"user_id": f"B{i:05d}", "username": name, "password": "bench-password"}
+            for i, name in enumerate(users)
+        ])
+        assert verify_password("bench-password", db.get_user_by_username(users[0])["password"])
+
+        print(f"CPU核数: {os.cpu_count()}  并发线程: {args.threads}  登录次数: {args.logins}")
+        results = {}
+        for name, verifier in (("inline", InlineVerifier()), ("process_pool", pool_verifier)):
+            db._password_verifier = verifier
+            run(db, users, min(args.threads, args.logins), args.threads)  # 预热（进程池启动）
+            results[name] = run(db, users, args.logins, args.threads)
+            print(f"{name:>12}: {results[name]:8.1f} 次/秒")
+        pool_verifier.shutdown()
+
+        print(f"{'speedup':>12}: {results['process_pool'] / results['inline']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
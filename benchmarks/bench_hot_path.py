@@ -0,0 +1,346 @@
+"""
+每轮对话热路径的微基准测试
+
+覆盖 Chatbot.handle_message 一轮处理中的各个环节：
+- trigger.*   所有流程入口触发器的规则匹配（命中/未命中）
+- interpreter.*  Interpreter.process_with_match（条件转换/兜底转换）
+- executor.*  ActionExecutor 模板渲染与商品选择
+- db.*        DatabaseManager 各查询方法，数据库为合成的大商品目录与订单表
+- e2e.*       使用 MockLLMResponder 的完整多轮对话（不访问网络）
+
+每项先校准单批迭代次数，再重复多批取每次调用耗时的中位数。结果写入 JSON，
+可与之前保存的基线比较，中位数变慢超过阈值时退出码为 1。
+热路径中的控制台日志输出到 os.devnull，格式化日志的开销计入结果。
+
+用法：
+    python benchmarks/bench_hot_path.py --output benchmarks/results/hot_path.json
+    python benchmarks/bench_hot_path.py --baseline benchmarks/results/baseline.json --threshold 0.25
+    python benchmarks/bench_hot_path.py --filter "db\\." --products 50000
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.action_executor import ActionExecutor
+from core.chatbot import Chatbot
+from core.database_manager import DatabaseManager
+from core.session_manager import Session
+from dsl.interpreter import Interpreter
+from tests.mocks import MockLLMResponder
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLOWS_DIR = os.path.join(PROJECT_ROOT, "dsl", "flows")
+
+CATEGORIES = ["数码配件", "智能穿戴", "电脑外设", "家居电器", "户外运动"]
+PRODUCT_NAMES = ["无线蓝牙耳机", "智能手环", "便携充电宝", "机械键盘", "高清摄像头",
+                 "平板电脑", "降噪耳机", "智能手表", "无线鼠标", "运动水壶"]
+ORDER_STATUSES = ["pending", "paid", "shipped", "delivered", "completed"]
+
+
+def measure(func: Callable[[], Any], min_time: float = 0.5, rounds: int = 7) -> Dict[str, Any]:
+    """
+    测量单次调用耗时
+
+    先校准迭代次数使每批至少耗时 min_time / rounds 秒，再重复 rounds 批，
+    计时期间关闭垃圾回收（与 timeit 一致）。
+
+    Returns:
+        {"median_us", "min_us", "mean_us", "stdev_us", "rounds", "iterations"}
+    """
+    func()  # 预热：首次调用的编译、缓存填充不计入
+    batch_time = min_time / rounds
+    number = 1
+    while True:
+        elapsed = _time_batch(func, number)
+        if elapsed >= batch_time:
+            break
+        number = max(number * 2, int(number * batch_time / max(elapsed, 1e-9) * 1.2))
+    samples = [_time_batch(func, number) / number * 1e6 for _ in range(rounds)]
+    return {
+        "median_us": round(statistics.median(samples), 3),
+        "min_us": round(min(samples), 3),
+        "mean_us": round(statistics.mean(samples), 3),
+        "stdev_us": round(statistics.stdev(samples), 3) if len(samples) > 1 else 0.0,
+        "rounds": rounds,
+        "iterations": number,
+    }
+
+
+def _time_batch(func: Callable[[], Any], number: int) -> float:
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def build_catalog(db: DatabaseManager, products: int, orders: int):
+    """写入合成商品目录与订单（订单属于 U001，用于用户订单查询）"""
+    db.bulk_add_products([
+        {
+            "product_id": f"BP{i:06d}",
+            "name": f"{PRODUCT_NAMES[i % len(PRODUCT_NAMES)]} {i}",
+            "category": CATEGORIES[i % len(CATEGORIES)],
+            "price": 99 + i % 900,
+            "stock": i % 200,
+            "description": f"合成商品 {i}",
+            "features": ["基准测试", CATEGORIES[i % len(CATEGORIES)]],
+        }
+        for i in range(products)
+    ])
+    db.bulk_add_orders([
+        {
+            "order_id": f"B{i:010d}",
+            "user_id": "U001" if i % 10 == 0 else f"BU{i % 500:04d}",
+            "product_id": f"BP{i % products:06d}",
+            "product_name": f"{PRODUCT_NAMES[i % len(PRODUCT_NAMES)]} {i % products}",
+            "quantity": 1 + i % 3,
+            "total_price": 99.0 + i % 900,
+            "status": ORDER_STATUSES[i % len(ORDER_STATUSES)],
+        }
+        for i in range(orders)
+    ])
+
+
+class BenchEnvironment:
+    """基准测试共用的临时数据库、聊天机器人与动作执行器"""
+
+    def __init__(self, tmp_dir: str, products: int, orders: int):
+        self.db = DatabaseManager(db_path=os.path.join(tmp_dir, "bench.db"))
+        build_catalog(self.db, products, orders)
+        self.products = products
+        self.orders = orders
+        self.chatbot = Chatbot(flows_dir=FLOWS_DIR, llm_responder=MockLLMResponder(), db_manager=self.db)
+        self.executor = self.chatbot.action_executor
+
+
+def trigger_benchmarks(env: BenchEnvironment) -> List[Tuple[str, Callable[[], Any]]]:
+    chatbot = env.chatbot
+    return [
+        # 命中排在后面的流程 / 扫描全部触发器后未命中
+        ("trigger.rule_match_hit", lambda: chatbot._try_rule_based_trigger("我想开一张增值税发票")),
+        ("trigger.rule_match_miss", lambda: chatbot._try_rule_based_trigger("今天天气怎么样呀")),
+    ]
+
+
+def interpreter_benchmarks(env: BenchEnvironment) -> List[Tuple[str, Callable[[], Any]]]:
+    interpreter: Interpreter = env.chatbot.interpreters["发票服务流程"]
+    session = Session("bench-interpreter")
+
+    def run(state_id: str, user_input: str):
+        def step():
+            session.current_state_id = state_id
+            return interpreter.process_with_match(session, user_input)
+        return step
+
+    return [
+        ("interpreter.condition_match", run("state_collect_order_number", "订单号 A1234567890")),
+        ("interpreter.fallback", run("state_collect_order_number", "我不记得订单号了")),
+    ]
+
+
+def executor_benchmarks(env: BenchEnvironment) -> List[Tuple[str, Callable[[], Any]]]:
+    executor = env.executor
+    results = env.db.search_products("耳机", limit=50)
+
+    session = Session("bench-executor", user_id="U001")
+    session.variables["order_id"] = "A1234567890"
+    session.variables["current_product"] = results[0]
+    session.variables["featured_products"] = results[:10]
+    simple = [{"type": "respond", "text": "您的订单 {{session.order_id}} 中的商品是 "
+                                          "{{session.current_product.name}}，单价 ¥{{session.current_product.price}}。"}]
+    display = [{"type": "respond", "text": "为您推荐：\n{{session.products_list}}"}]
+
+    select_session = Session("bench-select", user_id="U001")
+    select_session.variables["search_results"] = results
+    select = [{"type": "select_product_from_results"}]
+
+    def select_by(user_input: str):
+        def step():
+            select_session.last_user_input = user_input
+            return executor.execute(select, select_session)
+        return step
+
+    return [
+        ("executor.render_template", lambda: executor.execute(simple, session)),
+        ("executor.render_display_variable", lambda: executor.execute(display, session)),
+        ("executor.select_product_ordinal", select_by("第三个")),
+        ("executor.select_product_name", select_by(results[-1]["name"])),
+    ]
+
+
+def db_benchmarks(env: BenchEnvironment) -> List[Tuple[str, Callable[[], Any]]]:
+    db = env.db
+    product_ids = [f"BP{i:06d}" for i in range(0, env.products, max(1, env.products // 50))]
+    order_ids = [f"B{i:010d}" for i in range(0, env.orders, max(1, env.orders // 50))]
+    # 已签收订单（i % 5 == 3），资格检查会走完整条规则
+    order_id = f"B{env.orders // 2 // 10 * 10 + 3:010d}"
+    # 资格检查命中 get_order_eligibility_facts 的缓存，测的是稳态下每轮的开销；
+    # 密码校验（PBKDF2）刻意耗时，见 benchmarks/bench_auth.py
+    return [
+        ("db.get_product", lambda: db.get_product("BP000042")),
+        ("db.get_products", lambda: db.get_products(product_ids)),
+        ("db.get_all_products", lambda: db.get_all_products()),
+        ("db.get_all_products_by_category", lambda: db.get_all_products(category="智能穿戴")),
+        ("db.get_product_count", db.get_product_count),
+        ("db.search_products", lambda: db.search_products("蓝牙耳机")),
+        ("db.search_products_miss", lambda: db.search_products("不存在的商品")),
+        ("db.get_product_vocabulary", db.get_product_vocabulary),
+        ("db.get_user", lambda: db.get_user("U001")),
+        ("db.get_user_by_username", lambda: db.get_user_by_username("张三")),
+        ("db.get_order", lambda: db.get_order(order_id)),
+        ("db.get_orders", lambda: db.get_orders(order_ids)),
+        ("db.get_user_orders", lambda: db.get_user_orders("U001")),
+        ("db.search_user_orders", lambda: db.search_user_orders("U001", "手环")),
+        ("db.get_refund_by_order", lambda: db.get_refund_by_order(order_id)),
+        ("db.check_refund_eligibility", lambda: db.check_refund_eligibility(order_id, "quality")),
+        ("db.get_order_eligibility_facts", lambda: db.get_order_eligibility_facts(order_id)),
+        ("db.check_order_invoice_eligibility", lambda: db.check_order_invoice_eligibility(order_id)),
+    ]
+
+
+def e2e_benchmarks(env: BenchEnvironment) -> List[Tuple[str, Callable[[], Any]]]:
+    chatbot = env.chatbot
+
+    def conversation(turns: List[str]):
+        def run():
+            # 每次使用新会话，结束后清理，避免会话表增长
+            session_id = "bench-e2e"
+            for user_input in turns:
+                chatbot.handle_message(session_id, user_input, user_id="U001")
+            chatbot.session_manager.clear_session(session_id)
+        return run
+
+    # 只包含只读操作的对话，重复执行不会改变数据库
+    return [
+        ("e2e.product_inquiry", conversation(["我想买耳机", "蓝牙耳机", "第一个"])),
+        ("e2e.order_query", conversation(["我的订单", "查询订单A1234567890"])),
+        ("e2e.flow_switch", conversation(["我想开发票", "你好"])),
+        ("e2e.llm_intent_fallback", conversation(["嗯嗯那个"])),
+    ]
+
+
+BENCHMARK_GROUPS = [trigger_benchmarks, interpreter_benchmarks, executor_benchmarks, db_benchmarks, e2e_benchmarks]
+
+
+def run_benchmarks(env: BenchEnvironment, pattern: Optional[str] = None, min_time: float = 0.5,
+                   rounds: int = 7, progress: Callable[[str, Dict[str, Any]], None] = None) -> Dict[str, Dict[str, Any]]:
+    """运行名称匹配 pattern（正则，search）的基准，返回 名称 -> 统计结果"""
+    results = {}
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        for group in BENCHMARK_GROUPS:
+            with contextlib.redirect_stdout(devnull):
+                benchmarks = group(env)
+            for name, func in benchmarks:
+                if pattern and not re.search(pattern, name):
+                    continue
+                with contextlib.redirect_stdout(devnull):
+                    results[name] = measure(func, min_time=min_time, rounds=rounds)
+                if progress:
+                    progress(name, results[name])
+    return results
+
+
+def compare(current: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float = 0.25) -> List[Dict[str, Any]]:
+    """
+    按中位数与基线比较
+
+    Returns:
+        每项一行：{"name", "baseline_us", "current_us", "change", "status"}，
+        status 为 regression（变慢超过阈值）/ improved（变快超过阈值）/ ok / new（基线中没有）
+    """
+    rows = []
+    for name, stats in current.items():
+        row = {"name": name, "baseline_us": None, "current_us": stats["median_us"], "change": None, "status": "new"}
+        base = baseline.get(name)
+        if base and base.get("median_us"):
+            change = stats["median_us"] / base["median_us"] - 1
+            row.update(baseline_us=base["median_us"], change=round(change, 4))
+            row["status"] = "regression" if change > threshold else "improved" if change < -threshold else "ok"
+        rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="每轮对话热路径的微基准测试")
+    parser.add_argument("--output", default="benchmarks/results/hot_path.json", help="结果输出文件（JSON）")
+    parser.add_argument("--baseline", help="基线结果文件（之前保存的输出），与之比较中位数")
+    parser.add_argument("--threshold", type=float, default=0.25, help="判定为性能回退的变慢比例")
+    parser.add_argument("--filter", help="只运行名称匹配该正则的基准，如 'db\\.' 或 'e2e'")
+    parser.add_argument("--products", type=int, default=20000, help="合成商品数")
+    parser.add_argument("--orders", type=int, default=50000, help="合成订单数")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每项基准的最短计时时间（秒）")
+    parser.add_argument("--rounds", type=int, default=7, help="每项基准重复的批数")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["benchmarks"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"[基准] 准备数据：{args.products} 个商品，{args.orders} 个订单")
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            env = BenchEnvironment(tmp_dir, args.products, args.orders)
+        results = run_benchmarks(
+            env, args.filter, min_time=args.min_time, rounds=args.rounds,
+            progress=lambda name, stats: print(f"  {name:<40} {stats['median_us']:>12.1f} us"),
+        )
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "products": args.products,
+            "orders": args.orders,
+            "min_time": args.min_time,
+            "rounds": args.rounds,
+        },
+        "benchmarks": results,
+    }
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[基准] 结果已写入 {args.output}")
+
+    if baseline is None:
+        return 0
+    rows = compare(results, baseline, args.threshold)
+    print(f"\n{'基准':<40} {'基线(us)':>12} {'当前(us)':>12} {'变化':>9}")
+    for row in rows:
+        base = f"{row['baseline_us']:.1f}" if row["baseline_us"] is not None else "-"
+        change = f"{row['change']:+.1%}" if row["change"] is not None else "-"
+        flag = {"regression": "  ← 回退", "improved": "  ↑"}.get(row["status"], "")
+        print(f"{row['name']:<40} {base:>12} {row['current_us']:>12.1f} {change:>9}{flag}")
+    regressions = [row["name"] for row in rows if row["status"] == "regression"]
+    if regressions:
+        print(f"[基准] {len(regressions)} 项变慢超过 {args.threshold:.0%}：{', '.join(regressions)}")
+        return 1
+    print(f"[基准] 没有超过 {args.threshold:.0%} 的回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
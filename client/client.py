@@ -4,11 +4,13 @@ ChatFlow DSL 客户端
 可同时启动多个客户端实例进行并发测试
 """
 
+import codecs
 import socket
 import json
 import sys
 import threading
 import time
+import uuid
 
 
 class ChatClient:
@@ -41,6 +43,10 @@ class ChatClient:
         self.user_id = None
         self.username = None
         self.token = None  # 可选的 JWT 令牌
+        self.last_request_id = None  # 最近一条消息的请求ID，重试时复用
+        # 接收缓冲：服务器消息以换行分隔，流式回复时一次 recv 可能包含多条或半条消息
+        self._recv_buffer = ""
+        self._recv_decoder = codecs.getincrementaldecoder("utf-8")()
 
     def connect(self, auto_auth: bool = True):
         """连接到服务器
@@ -53,6 +59,8 @@ class ChatClient:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
             self.connected = True
+            self._recv_buffer = ""
+            self._recv_decoder.reset()
 
             print(f"[{self.client_name}] 成功连接到服务器 {self.host}:{self.port}")
 
@@ -62,6 +70,10 @@ class ChatClient:
                 print(f"[{self.client_name}] {welcome_msg.get('message', '')}")
                 self.session_id = welcome_msg.get('session_id')
 
+                # 已持有登录时下发的 Token（断线重连）时优先恢复原会话
+                if welcome_msg.get('require_auth', False) and self.token and self.resume():
+                    return True
+
                 # 检查是否需要登录
                 if welcome_msg.get('require_auth', False) and auto_auth:
                     # 执行登录或注册流程（命令行）
@@ -77,6 +89,36 @@ class ChatClient:
             self.connected = False
             return False
 
+    def resume(self):
+        """
+        凭之前登录获得的 Token 恢复对话会话（流程状态与会话变量保留在服务器端）
+
+        Returns:
+            恢复成功返回True；Token 无效或过期返回False，需要重新登录
+        """
+        try:
+            request = {"type": "resume", "token": self.token}
+            self.socket.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8'))
+            result = self._receive_message()
+        except Exception as e:
+            print(f"[{self.client_name}] 恢复会话失败: {e}")
+            return False
+
+        if not result or result.get("type") != "resume_result" or not result.get("success"):
+            self.token = None
+            self.authenticated = False
+            return False
+
+        self.authenticated = True
+        self.user_id = result.get("user_id")
+        self.username = result.get("username") or self.username
+        self.session_id = result.get("session_id")
+        if result.get("resumed"):
+            print(f"[{self.client_name}] 已恢复之前的会话（当前流程: {result.get('active_flow_name') or '无'}）")
+        else:
+            print(f"[{self.client_name}] 之前的会话已过期，已开始新的会话")
+        return True
+
     def login_or_register(self):
         """
         登录或注册选择流程
@@ -162,6 +204,10 @@ class ChatClient:
                         self.token = auth_result.get("token")
                         print(f"[{self.client_name}] {auth_result.get('message')}")
                         return True
+                    elif auth_result.get("code") == "overloaded":
+                        # 服务器过载：按提示等待后用同一凭证重试
+                        print(f"[{self.client_name}] {auth_result.get('message')}")
+                        time.sleep(float(auth_result.get("retry_after") or 1))
                     else:
                         # 登录失败
                         print(f"[{self.client_name}] {auth_result.get('message')}")
@@ -266,15 +312,21 @@ class ChatClient:
             print(f"[{self.client_name}] 注册失败: {e}")
             return False
 
-    def send_message(self, content):
+    def send_message(self, content, request_id=None, on_chunk=None, retries=1):
         """
         发送消息到服务器
 
         Args:
             content: 消息内容
+            request_id: 消息ID，重试同一条消息时传入上次的 last_request_id，
+                        服务器据此避免重复下单/退款；为None时自动生成
+            on_chunk: 流式回复回调 on_chunk(index, delta)。提供时请求服务器流式发送，
+                      每收到一个 response_chunk 帧调用一次，index 为第几条回复
+            retries: 等待回复时连接断开的重试次数。重试时凭 Token 重连并恢复会话，
+                     以同一个 request_id 重发，服务器不会重复执行写操作
 
         Returns:
-            服务器响应内容，失败返回None
+            服务器响应内容（完整回复列表），失败返回None
         """
         if not self.connected:
             print(f"[{self.client_name}] 未连接到服务器")
@@ -284,36 +336,65 @@ class ChatClient:
             print(f"[{self.client_name}] 未登录，请先登录")
             return None
 
-        try:
-            # 构造请求消息
-            request = {
-                "type": "message",
-                "content": content
-            }
-            # 如果已拿到 JWT，则一并发送，服务器可用其进行鉴权
-            if self.token:
-                request["token"] = self.token
-
-            # 发送JSON消息
-            data = json.dumps(request, ensure_ascii=False).encode('utf-8')
-            self.socket.sendall(data)
-
-            # 接收服务器响应
+        self.last_request_id = request_id or uuid.uuid4().hex
+        for attempt in range(retries + 1):
+            if attempt:
+                print(f"[{self.client_name}] 连接已断开，重新连接后重发消息（第 {attempt} 次重试）")
+                if not self._reconnect():
+                    break
+            try:
+                return self._send_request(content, on_chunk)
+            except (OSError, ConnectionError) as e:
+                print(f"[{self.client_name}] 发送消息失败: {e}")
+                self.connected = False
+                if not self.token:
+                    # 没有 Token 无法恢复原会话，重发会落到新会话中
+                    break
+        return None
+
+    def _send_request(self, content, on_chunk=None):
+        """发送一条消息并等待完整回复；连接断开时抛出 ConnectionError"""
+        request = {
+            "type": "message",
+            "content": content,
+            "request_id": self.last_request_id
+        }
+        # 如果已拿到 JWT，则一并发送，服务器可用其进行鉴权
+        if self.token:
+            request["token"] = self.token
+        if on_chunk:
+            request["stream"] = True
+
+        # 发送JSON消息
+        data = json.dumps(request, ensure_ascii=False).encode('utf-8')
+        self.socket.sendall(data)
+
+        # 接收服务器响应；流式回复先收到若干 response_chunk 帧
+        response = self._receive_message()
+        while response and response.get("type") == "response_chunk":
+            on_chunk(response.get("index", 0), response.get("delta", ""))
             response = self._receive_message()
 
-            if response and response.get("type") == "response":
-                return response.get("content")
-            elif response and response.get("type") == "error":
-                print(f"[{self.client_name}] 服务器错误: {response.get('message')}")
-                return None
-            else:
-                print(f"[{self.client_name}] 收到未知响应: {response}")
-                return None
-
-        except Exception as e:
-            print(f"[{self.client_name}] 发送消息失败: {e}")
-            self.connected = False
+        if response is None:
+            raise ConnectionError("等待回复时连接已断开")
+        if response.get("type") == "response":
+            return response.get("content")
+        elif response.get("type") == "error":
+            print(f"[{self.client_name}] 服务器错误: {response.get('message')}")
             return None
+        else:
+            print(f"[{self.client_name}] 收到未知响应: {response}")
+            return None
+
+    def _reconnect(self):
+        """断线后重新连接并凭 Token 恢复会话，成功返回True"""
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.authenticated = False
+        return self.connect(auto_auth=False) and self.authenticated
 
     def _receive_message(self):
         """
@@ -323,17 +404,38 @@ class ChatClient:
             消息字典，失败返回None
         """
         try:
-            data = self.socket.recv(4096)
-            if not data:
-                return None
-
-            message = json.loads(data.decode('utf-8'))
-            return message
+            while True:
+                message = self._pop_buffered_message()
+                if message is not None:
+                    return message
+                data = self.socket.recv(4096)
+                if not data:
+                    return None
+                self._recv_buffer += self._recv_decoder.decode(data)
 
         except Exception as e:
             print(f"[{self.client_name}] 接收消息失败: {e}")
             return None
 
+    def _pop_buffered_message(self):
+        """从接收缓冲中取出一条完整消息，消息不完整时返回None"""
+        buffer = self._recv_buffer.lstrip()
+        if not buffer:
+            self._recv_buffer = ""
+            return None
+        line, newline, rest = buffer.partition("\n")
+        if newline:
+            self._recv_buffer = rest
+            return json.loads(line)
+        # 兼容不以换行结尾的旧版服务器：缓冲区已是一条完整 JSON 时直接返回
+        try:
+            message, end = json.JSONDecoder().raw_decode(buffer)
+        except json.JSONDecodeError:
+            self._recv_buffer = buffer
+            return None
+        self._recv_buffer = buffer[end:]
+        return message
+
     def disconnect(self):
         """断开与服务器的连接"""
         if self.connected:
@@ -378,9 +480,21 @@ class ChatClient:
                     print(f"[{self.client_name}] 再见！")
                     break
 
-                # 发送消息并显示响应
-                response = self.send_message(user_input)
-                if response:
+                # 发送消息，回复边生成边显示
+                shown = []
+
+                def show_chunk(index, delta):
+                    if index not in shown:
+                        if shown:
+                            print()
+                        print(f"[{self.client_name}] 客服: ", end="")
+                        shown.append(index)
+                    print(delta, end="", flush=True)
+
+                response = self.send_message(user_input, on_chunk=show_chunk)
+                if response and shown:
+                    print()
+                elif response:
                     print(f"[{self.client_name}] 客服: {response}")
                 else:
                     print(f"[{self.client_name}] 未收到响应，连接可能已断开")
@@ -50,6 +50,8 @@ class ChatGUI:
 
         # 聊天界面控件占位
         self.chat_text: tk.Text | None = None
+        # 正在流式显示的客服回复序号（None 表示当前没有流式回复）
+        self._bot_stream_index: int | None = None
         self.input_var = tk.StringVar()
         self.send_button: ttk.Button | None = None
 
@@ -272,10 +274,14 @@ class ChatGUI:
         self._append_user_message(content)
         self.input_var.set("")
 
-        # 在后台线程中发送消息并等待服务器响应，避免阻塞界面
+        # 在后台线程中发送消息并等待服务器响应，避免阻塞界面；
+        # 流式回复的片段通过 after 交给界面线程逐段显示
+        def on_chunk(index: int, delta: str):
+            self.root.after(0, lambda: self._append_bot_chunk(index, delta))
+
         def worker(text_to_send: str):
             try:
-                response = self.client.send_message(text_to_send)
+                response = self.client.send_message(text_to_send, on_chunk=on_chunk)
                 if response is None:
                     self.root.after(
                         0, lambda: self._append_system_message("未收到服务器响应，连接可能已断开。")
@@ -288,7 +294,7 @@ class ChatGUI:
                 else:
                     reply_text = str(response)
 
-                self.root.after(0, lambda: self._append_bot_message(reply_text))
+                self.root.after(0, lambda: self._finish_bot_message(reply_text))
             except Exception as e:
                 self.root.after(
                     0,
@@ -451,6 +457,9 @@ class ChatGUI:
     def _append_message(self, text: str, tag: str):
         if not self.chat_text:
             return
+        if self._bot_stream_index is not None:
+            # 流式回复中途断开时先收尾，避免与后续消息连在同一行
+            self._finish_bot_message("")
         self.chat_text.configure(state="normal")
         self.chat_text.insert("end", text + "\n", tag)
         self.chat_text.insert("end", "\n")
@@ -465,6 +474,34 @@ class ChatGUI:
         # 根据客服回复的内容动态调整快捷按钮
         self._update_quick_buttons_for_bot_message(text)
 
+    def _append_bot_chunk(self, index: int, delta: str):
+        """流式回复：把文本片段追加到当前客服消息末尾，多条回复之间换行"""
+        if not self.chat_text:
+            return
+        self.chat_text.configure(state="normal")
+        if self._bot_stream_index is None:
+            self.chat_text.insert("end", "客服: ", "bot")
+        elif index != self._bot_stream_index:
+            self.chat_text.insert("end", "\n", "bot")
+        self._bot_stream_index = index
+        self.chat_text.insert("end", delta, "bot")
+        self.chat_text.see("end")
+        self.chat_text.configure(state="disabled")
+
+    def _finish_bot_message(self, text: str):
+        """一轮回复结束：已流式显示时只收尾，否则整条显示"""
+        if self._bot_stream_index is None:
+            self._append_bot_message(text)
+            return
+        self._bot_stream_index = None
+        if self.chat_text:
+            self.chat_text.configure(state="normal")
+            self.chat_text.insert("end", "\n", "bot")
+            self.chat_text.insert("end", "\n")
+            self.chat_text.see("end")
+            self.chat_text.configure(state="disabled")
+        self._update_quick_buttons_for_bot_message(text)
+
     def _append_system_message(self, text: str):
         self._append_message(f"[系统] {text}", "system")
 
@@ -1,8 +1,77 @@
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Union, Callable, Tuple, Iterable, FrozenSet
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import hashlib
+import json
+import threading
 import re
-import time
 from core.database_manager import DatabaseManager
-from core.session_manager import Session
+from core.id_generator import generate_id
+from core.session_manager import Session, VariableStore
+from core.product_index import ProductSelectionIndex
+from core.vocabulary import KeywordTrie
+from dsl.template import CompiledTemplate, TemplateVariable, compile_template, lookup_variable_path
+
+# 动作参数中的会话变量引用，例如 "{{session.order_id}}"
+_PARAM_TEMPLATE_PATTERN = re.compile(r"\{\{\s*session\.(.*?)\s*\}\}")
+
+
+class ActionPipeline:
+    """
+    编译后的动作流水线
+
+    data_steps 先于 respond_steps 执行，每个步骤都是只接收 session 的可调用对象。
+    """
+    __slots__ = ("actions", "data_steps", "respond_steps")
+
+    def __init__(self, actions: List[Dict[str, Any]]):
+        self.actions = actions
+        self.data_steps: List[Callable[[Any], None]] = []
+        self.respond_steps: List[Callable[[Any], Optional[str]]] = []
+
+
+class ApiCallStep:
+    """
+    编译后的 api_call 步骤
+
+    记录该调用读取和写入的会话变量，供流水线判断相邻调用能否并行执行。
+    parallel_safe 为False（写数据库或读取范围未知的端点）的调用始终单独执行。
+    """
+    __slots__ = ("endpoint", "variable_name", "params", "fetch", "store", "reads", "writes", "parallel_safe")
+
+    def __init__(self, endpoint: str, variable_name: str,
+                 params: List[Tuple[str, Any, Optional[Tuple[str, ...]]]],
+                 fetch: Callable[[Dict[str, Any], Any], Any],
+                 store: Callable[[str, Any, Any], None],
+                 implicit_reads: Optional[FrozenSet[str]]):
+        self.endpoint = endpoint
+        self.variable_name = variable_name
+        self.params = params
+        self.fetch = fetch
+        self.store = store
+        self.parallel_safe = implicit_reads is not None
+        self.reads = frozenset(parts[0] for _, _, parts in params if parts) | (implicit_reads or frozenset())
+        writes = {variable_name}
+        if variable_name == "search_results":
+            writes.update(("search_result_count", "current_product"))
+        self.writes = frozenset(writes)
+
+    def resolve_params(self, session: Union[Session, Dict[str, Any]]) -> Dict[str, Any]:
+        print(f"[ActionExecutor] Calling API: {self.endpoint}")
+        variables = ActionExecutor._get_variables(session)
+        return {
+            key: value if parts is None else lookup_variable_path(variables, parts)
+            for key, value, parts in self.params
+        }
+
+    def conflicts_with(self, reads: FrozenSet[str], writes: FrozenSet[str]) -> bool:
+        """与一组已调度调用存在读写依赖时返回True"""
+        return bool(self.reads & writes or self.writes & (reads | writes))
+
+    def __call__(self, session: Union[Session, Dict[str, Any]]) -> None:
+        params = self.resolve_params(session)
+        self.store(self.variable_name, self.fetch(params, session), session)
+
 
 class ActionExecutor:
     """
@@ -10,14 +79,54 @@ class ActionExecutor:
     执行DSL中定义的各种动作，并与数据库集成
     """
 
-    def __init__(self, db_manager: Optional[DatabaseManager] = None):
+    DERIVED_VARIABLES = frozenset({"search_result_count", "current_product", "product_selected"})
+
+    # 常见商品关键词（商品表之外的泛称），与商品表词表合并使用
+    BASE_PRODUCT_VOCABULARY = (
+        "平板电脑", "平板", "笔记本", "轻薄本",
+        "无线蓝牙耳机", "蓝牙耳机", "耳机",
+        "智能手环", "手环",
+        "充电宝", "移动电源",
+        "机械键盘", "键盘",
+        "网络摄像头", "摄像头",
+        "显示器", "电竞显示器",
+        "扩展坞",
+        "智能音箱", "音箱",
+        "游戏鼠标", "鼠标",
+    )
+
+    def __init__(self, db_manager: Optional[DatabaseManager] = None, max_parallel_calls: int = 4):
         """
         初始化动作执行器
 
         Args:
             db_manager: 数据库管理器实例，如果为None则自动创建
+            max_parallel_calls: 同一状态内互不依赖的 api_call 最多并行执行的数量，1 表示全部串行
         """
         self.db = db_manager if db_manager else DatabaseManager()
+        self.max_parallel_calls = max(1, int(max_parallel_calls))
+        # 并行 api_call 使用的线程池，首次需要时创建
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+        self._io_pool_lock = threading.Lock()
+        # respond 文本 -> 预编译模板，流程加载时通过 compile_flow 预先填充
+        self._templates: Dict[str, CompiledTemplate] = {}
+        # (流程名, 状态ID) -> 编译后的流水线，由 compile_flow 预先填充或在状态首次执行时编译
+        self._pipelines: Dict[Tuple[str, str], ActionPipeline] = {}
+        self._register_builtin_actions()
+        self._register_builtin_endpoints()
+        # 商品词表自动机，按数据库商品目录版本号惰性重建
+        self._vocabulary: Optional[KeywordTrie] = None
+        self._vocabulary_version: Optional[int] = None
+        # 显示变量路径 -> (源变量名, 格式化函数)，仅在模板引用时惰性计算
+        self._display_providers: Dict[str, Tuple[str, Callable[[Any], Optional[str]]]] = {
+            "session.products_list": ("featured_products", self._format_products_list),
+            "session.featured_products_names": ("featured_products", self._format_featured_products_names),
+            "session.current_product.features": ("current_product", self._format_product_features),
+            "session.order_status_text": ("current_order", self._format_order_status),
+            "session.tracking_info": ("current_order", self._format_tracking_info),
+            "session.order_list_text": ("user_orders", self._format_order_list),
+            "session.search_result_text": ("search_results", self._format_search_results),
+        }
 
         # 保留Mock API作为降级方案
         self._mock_api = {
@@ -41,358 +150,662 @@ class ActionExecutor:
             }
         }
 
-    def execute(self, actions: List[Dict[str, Any]], session: Union[Session, Dict[str, Any]]) -> List[str]:
+    # ==================== 动作与数据库端点注册（插件接口） ====================
+
+    def register_action(self, action_type: str,
+                        handler: Optional[Callable[[Dict[str, Any], Any], Optional[str]]],
+                        produces_response: bool = False):
+        """
+        注册动作类型（插件接口），自定义动作无需修改 ActionExecutor
+
+        Args:
+            action_type: DSL中的动作类型名称
+            handler: 处理函数 handler(action, session)；为None表示该动作无需执行（如 wait_for_input）
+            produces_response: 为True时在回复阶段执行，返回的文本加入回复列表；
+                               否则在数据阶段执行（先于所有回复动作）
+        """
+        self._action_handlers[action_type] = (handler, produces_response)
+        self._action_compilers.pop(action_type, None)
+        self._recompile_pipelines()
+
+    def register_database_endpoint(self, path: str, handler: Callable[[Dict[str, Any], Any], Any],
+                                   reads: Optional[Iterable[str]] = None):
+        """
+        注册 database:// 端点（插件接口）
+
+        Args:
+            path: 端点路径，例如 "products/list"（对应 database://products/list）
+            handler: 处理函数 handler(params, session)，返回值保存到 save_to 指定的变量
+            reads: 只读端点在参数之外读取的会话变量名；提供时该端点可与同一状态内
+                   无依赖的 api_call 并行执行，为None时（默认）始终串行执行
+        """
+        self._db_endpoints[path] = handler
+        if reads is None:
+            self._endpoint_reads.pop(path, None)
+        else:
+            self._endpoint_reads[path] = frozenset(reads)
+        self._recompile_pipelines()
+
+    def _register_builtin_actions(self):
+        self._action_handlers: Dict[str, Tuple[Optional[Callable], bool]] = {
+            "api_call": (self._handle_api_call, False),
+            "extract_variable": (self._handle_extract_variable, False),
+            "set_variable": (self._handle_set_variable, False),
+            "select_product_from_results": (self._handle_select_product_from_results, False),
+            "respond": (self._handle_respond, True),
+            "wait_for_input": (None, False),
+        }
+        # 需要在编译期预解析参数的内置动作
+        self._action_compilers: Dict[str, Callable[[Dict[str, Any]], Callable[[Any], Any]]] = {
+            "api_call": self._compile_api_call,
+            "respond": self._compile_respond,
+        }
+
+    def _register_builtin_endpoints(self):
+        self._db_endpoints: Dict[str, Callable[[Dict[str, Any], Any], Any]] = {
+            "products/list": self._query_products_list,
+            "products/search": self._query_products_search,
+            "products/get": self._query_products_get,
+            "orders/get": self._query_orders_get,
+            "orders/list": self._query_orders_list,
+            "orders/search": self._query_orders_search,
+            "orders/create": self._query_orders_create,
+            "orders/update_status": self._query_orders_update_status,
+            "refunds/check": self._query_refunds_check,
+            "refunds/create": self._query_refunds_create,
+            "invoices/check_eligibility": self._query_invoices_check_eligibility,
+            "invoices/create": self._query_invoices_create,
+        }
+        # 只读端点 -> 参数之外隐式读取的会话变量；写数据库的端点不在此表中，不参与并行
+        self._endpoint_reads: Dict[str, FrozenSet[str]] = {
+            "products/list": frozenset(),
+            "products/search": frozenset({"keyword"}),
+            "products/get": frozenset({"product_id"}),
+            "orders/get": frozenset({"order_id"}),
+            "orders/list": frozenset(),
+            "orders/search": frozenset({"order_keyword"}),
+            "refunds/check": frozenset({"order_id"}),
+            "invoices/check_eligibility": frozenset({"order_id"}),
+        }
+
+    # ==================== 动作流水线 ====================
+
+    def execute(self, actions: List[Dict[str, Any]], session: Union[Session, Dict[str, Any]],
+                state_key: Optional[Tuple[str, str]] = None) -> List[str]:
         """
         Executes a list of actions and returns a list of text responses for the user.
+
+        state_key 为动作列表所属的 (流程名, 状态ID)，给出时复用该状态编译好的流水线；
+        临时构造的动作列表不传，每次即时编译
         """
-        responses = []
+        pipeline = self._get_pipeline(actions, state_key)
+
         # We need to handle data-changing actions first (like api_call)
         # so that subsequent respond actions can use the data.
-        for action in actions:
-            action_type = action.get("type")
-            if action_type == "api_call":
-                self._handle_api_call(action, session)
-            elif action_type == "extract_variable":
-                self._handle_extract_variable(action, session)
-            elif action_type == "set_variable":
-                self._handle_set_variable(action, session)
-            elif action_type == "select_product_from_results":
-                self._handle_select_product_from_results(action, session)
-        
+        for step in pipeline.data_steps:
+            step(session)
+
         # Then, handle actions that generate responses
+        responses = []
+        for step in pipeline.respond_steps:
+            response_text = step(session)
+            if response_text:
+                responses.append(response_text)
+        return responses
+
+    def compile_actions(self, actions: List[Dict[str, Any]]) -> "ActionPipeline":
+        """将状态的动作列表编译为绑定好参数的可调用步骤"""
+        pipeline = ActionPipeline(actions)
         for action in actions:
-            action_type = action.get("type")
-            if action_type == "respond":
-                response_text = self._handle_respond(action, session)
-                if response_text:
-                    responses.append(response_text)
-            elif action_type not in ["api_call", "extract_variable", "set_variable", "wait_for_input"]:
-                print(f"Warning: Unknown action type '{action_type}'")
+            action_type = action.get("type") if isinstance(action, dict) else None
+            spec = self._action_handlers.get(action_type)
+            if spec is None:
+                pipeline.respond_steps.append(functools.partial(self._warn_unknown_action, action_type))
+                continue
 
-        return responses
+            handler, produces_response = spec
+            if handler is None:
+                continue
+            compiler = self._action_compilers.get(action_type)
+            step = compiler(action) if compiler else functools.partial(handler, action)
+            if produces_response:
+                pipeline.respond_steps.append(step)
+            else:
+                pipeline.data_steps.append(step)
+        pipeline.data_steps = self._schedule_data_steps(pipeline.data_steps)
+        return pipeline
 
-    def _handle_api_call(self, action: Dict[str, Any], session: Union[Session, Dict[str, Any]]):
+    def _schedule_data_steps(self, steps: List[Callable[[Any], None]]) -> List[Callable[[Any], None]]:
         """
-        处理API调用动作
-        支持database://协议直接查询数据库，或使用传统HTTP API
+        将相邻且互不依赖的只读 api_call 合并为一个并行批次
+
+        只合并相邻步骤，其余动作（extract_variable、set_variable、写数据库的调用等）
+        作为分隔点保持原有顺序，因此会话变量的最终状态与串行执行一致。
         """
+        if self.max_parallel_calls <= 1:
+            return steps
+
+        scheduled: List[Callable[[Any], None]] = []
+        batch: List[ApiCallStep] = []
+        batch_reads: FrozenSet[str] = frozenset()
+        batch_writes: FrozenSet[str] = frozenset()
+
+        def flush():
+            if len(batch) == 1:
+                scheduled.append(batch[0])
+            elif batch:
+                scheduled.append(functools.partial(self._run_api_batch, tuple(batch)))
+            batch.clear()
+
+        for step in steps:
+            if not isinstance(step, ApiCallStep) or not step.parallel_safe:
+                flush()
+                scheduled.append(step)
+                continue
+            if (batch and step.conflicts_with(batch_reads, batch_writes)) or len(batch) >= self.max_parallel_calls:
+                flush()
+            if not batch:
+                batch_reads, batch_writes = frozenset(), frozenset()
+            batch.append(step)
+            batch_reads |= step.reads
+            batch_writes |= step.writes
+        flush()
+        return scheduled
+
+    def _run_api_batch(self, calls: Tuple[ApiCallStep, ...], session: Union[Session, Dict[str, Any]]) -> None:
+        """并行执行一批互不依赖的 api_call，结果按声明顺序写回会话"""
+        prepared = [call.resolve_params(session) for call in calls]
+        pool = self._get_io_pool()
+        futures = [pool.submit(call.fetch, params, session) for call, params in zip(calls, prepared)]
+        for call, future in zip(calls, futures):
+            call.store(call.variable_name, future.result(), session)
+
+    def _get_io_pool(self) -> ThreadPoolExecutor:
+        if self._io_pool is None:
+            with self._io_pool_lock:
+                if self._io_pool is None:
+                    self._io_pool = ThreadPoolExecutor(max_workers=self.max_parallel_calls,
+                                                       thread_name_prefix="action-io")
+        return self._io_pool
+
+    def _get_pipeline(self, actions: List[Dict[str, Any]],
+                      state_key: Optional[Tuple[str, str]] = None) -> "ActionPipeline":
+        """获取状态的流水线，未缓存时编译并缓存；没有 state_key 的动作列表即时编译"""
+        if state_key is None:
+            return self.compile_actions(actions)
+        pipeline = self._pipelines.get(state_key)
+        if pipeline is None or pipeline.actions is not actions:
+            # 状态首次执行，或流程重新加载后动作列表已被替换
+            pipeline = self.compile_actions(actions)
+            self._pipelines[state_key] = pipeline
+        return pipeline
+
+    def _recompile_pipelines(self):
+        """注册表变化后重新编译已缓存的流水线"""
+        for key, pipeline in list(self._pipelines.items()):
+            self._pipelines[key] = self.compile_actions(pipeline.actions)
+
+    @staticmethod
+    def _warn_unknown_action(action_type: Any, session: Union[Session, Dict[str, Any]]) -> None:
+        print(f"Warning: Unknown action type '{action_type}'")
+        return None
+
+    def _compile_api_call(self, action: Dict[str, Any]) -> Callable[[Any], None]:
+        """预解析 api_call 的端点与参数模板，并记录其读写的会话变量"""
         endpoint = action.get("endpoint", action.get("url", ""))
         save_to = action.get("save_to")
-        params = action.get("params", {})
-
         if not save_to or not save_to.startswith("session."):
-            return
+            return self._noop_step
 
         variable_name = save_to.split('.')[1]
-
-        print(f"[ActionExecutor] Calling API: {endpoint}")
-
-        resolved_params = {k: self._resolve_param_value(v, session) for k, v in params.items()}
+        params = [(key, value, self._compile_param_value(value))
+                  for key, value in (action.get("params", {}) or {}).items()]
 
         # 处理数据库协议
         if endpoint.startswith("database://"):
-            data = self._handle_database_query(endpoint, resolved_params, session)
+            fetch = self._resolve_database_endpoint(endpoint)
+            implicit_reads = self._endpoint_reads.get(endpoint.replace("database://", ""))
         # 处理传统HTTP API (目前使用Mock)
         else:
-            response = self._mock_api.get(endpoint, {})
-            data = response.get("data")
+            def fetch(resolved_params, session):
+                return self._mock_api.get(endpoint, {}).get("data")
+            implicit_reads = frozenset()
+
+        return ApiCallStep(endpoint, variable_name, params, fetch, self._store_api_result, implicit_reads)
 
-        if data is not None:
-            self._get_variables(session)[variable_name] = data
-            print(f"[ActionExecutor] Saved result to 'session.{variable_name}'")
+    def _compile_respond(self, action: Dict[str, Any]) -> Callable[[Any], str]:
+        template = self._get_template(action.get("text", ""))
+        return functools.partial(self._render_template, template)
 
-    def _handle_database_query(self, endpoint: str, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+    @staticmethod
+    def _noop_step(session: Union[Session, Dict[str, Any]]) -> None:
+        return None
+
+    def _handle_api_call(self, action: Dict[str, Any], session: Union[Session, Dict[str, Any]]):
         """
-        处理数据库查询
-        支持的endpoint格式：
-        - database://products/list - 获取商品列表
-        - database://products/search - 搜索商品
-        - database://products/get - 获取商品详情
-        - database://orders/get - 获取订单详情
-        - database://orders/list - 获取用户订单列表
-        - database://refunds/check - 检查退款资格
-        - database://invoices/check_eligibility - 检查发票资格
+        处理API调用动作
+        支持database://协议直接查询数据库，或使用传统HTTP API
         """
-        path = endpoint.replace("database://", "")
+        self._compile_api_call(action)(session)
 
-        try:
-            # 商品相关查询
-            if path == "products/list":
-                category = params.get("category")
-                limit = params.get("limit", 10)
-                return self.db.get_all_products(category=category, limit=limit)
-
-            elif path == "products/search":
-                # 优先从最近一轮用户输入中提取更“干净”的搜索关键词，避免整句查询命中率低
-                raw_keyword = params.get("keyword", "")
-                user_input = self._get_session_value(session, "last_user_input", raw_keyword)
-                keyword = self._extract_product_search_keyword(user_input, raw_keyword)
-
-                # 从session变量中获取已有关键词作为兜底
-                variables = self._get_variables(session)
-                if not keyword and "keyword" in variables:
-                    keyword = variables["keyword"]
-
-                return self.db.search_products(keyword)
-
-            elif path == "products/get":
-                product_id = params.get("product_id")
-                variables = self._get_variables(session)
-                if not product_id and "product_id" in variables:
-                    product_id = variables["product_id"]
-                return self.db.get_product(product_id)
-
-            # 订单相关查询
-            elif path == "orders/get":
-                order_id = params.get("order_id")
-                variables = self._get_variables(session)
-                if not order_id and "order_id" in variables:
-                    order_id = variables["order_id"]
-                return self.db.get_order(order_id)
-
-            elif path == "orders/list":
-                # 优先从session中获取user_id，实现自动查询当前用户的订单
-                user_id = self._get_session_value(session, "user_id")
-                if not user_id:
-                    user_id = params.get("user_id", "U001")  # 降级到参数或默认用户
-                return self.db.get_user_orders(user_id)
-
-            elif path == "orders/search":
-                # 根据用户提供的商品关键词、描述信息模糊查询订单
-                user_id = self._get_session_value(session, "user_id")
-                if not user_id:
-                    user_id = params.get("user_id", "U001")
-
-                keyword = params.get("keyword", "")
-                if not keyword:
-                    variables = self._get_variables(session)
-                    keyword = variables.get("order_keyword", "")
-
-                if not keyword:
-                    return []
-
-                return self.db.search_user_orders(user_id=user_id, keyword=keyword)
-
-            # 退款相关查询
-            elif path == "refunds/check":
-                order_id = params.get("order_id")
-                variables = self._get_variables(session)
-                if not order_id and "order_id" in variables:
-                    order_id = variables["order_id"]
-                reason_type = params.get("reason_type")
-                return self.db.check_refund_eligibility(order_id, reason_type)
-
-            elif path == "refunds/create":
-                refund_data = {
-                    "refund_id": f"R{int(time.time())}",
-                    "order_id": params.get("order_id"),
-                    "user_id": params.get("user_id", ""),
-                    "reason": params.get("reason"),
-                    "reason_type": params.get("reason_type"),
-                    "amount": params.get("amount", 0.0),
-                    "status": "pending",
-                }
-                success = self.db.create_refund(refund_data)
-                if success:
-                    return {"success": True, "message": "退款申请提交成功", "amount": refund_data["amount"]}
-                return {"success": False, "message": "退款申请提交失败"}
-
-            # 发票相关查询
-            elif path == "invoices/check_eligibility":
-                order_id = params.get("order_id")
-                variables = self._get_variables(session)
-                if not order_id and "order_id" in variables:
-                    order_id = variables["order_id"]
-                return self.db.check_order_invoice_eligibility(order_id)
-            elif path == "invoices/create":
-                invoice_data = {
-                    "invoice_id": f"I{int(time.time())}",
-                    "order_id": params.get("order_id"),
-                    "user_id": params.get("user_id", ""),
-                    "invoice_title": params.get("title", "个人发票"),
-                    "tax_id": params.get("tax_id"),
-                    "invoice_type": params.get("invoice_type", "personal"),
-                    "amount": params.get("amount", 0.0),
-                    "status": "pending",
-                }
-                success = self.db.create_invoice(invoice_data)
-                if success:
-                    return {"success": True, "message": "发票申请提交成功", "invoice_id": invoice_data["invoice_id"]}
-                return {"success": False, "message": "发票申请提交失败"}
-
-            # 订单写动作
-            elif path == "orders/create":
-                product_id = params.get("product_id")
-                quantity = int(params.get("quantity", 1))
-                user_id = self._get_session_value(session, "user_id")
-                if not user_id:
-                    user_id = params.get("user_id", "U001")
-                product = self.db.get_product(product_id)
-                if not product:
-                    return {"success": False, "message": "商品不存在"}
-
-                order_data = {
-                    "order_id": f"A{product_id[-4:]}{int(time.time()) % 10000}",
-                    "user_id": user_id,
-                    "product_id": product_id,
-                    "product_name": product["name"],
-                    "quantity": quantity,
-                    "total_price": product["price"] * quantity,
-                    "status": "paid",
-                    "shipping_address": params.get("shipping_address", ""),
-                    "tracking_number": "",
-                }
-                success = self.db.add_order(order_data)
-                if success:
-                    self.db.decrease_product_stock(product_id, quantity)
-                    return {"success": True, "order": order_data}
-                return {"success": False, "message": "订单创建失败"}
-
-            elif path == "orders/update_status":
-                order_id = params.get("order_id")
-                status = params.get("status")
-                success = self.db.update_order_status(order_id, status)
-                return {"success": success}
+    def _store_api_result(self, variable_name: str, data: Any, session: Union[Session, Dict[str, Any]]):
+        """保存API调用结果，并维护依赖搜索结果的派生数据"""
+        if data is None:
+            return
 
-            else:
+        variables = self._get_variables(session)
+        variables[variable_name] = data
+        print(f"[ActionExecutor] Saved result to 'session.{variable_name}'")
+
+        if variable_name == "search_results" and isinstance(data, list):
+            # 记录搜索结果数量，供DSL中的条件判断使用
+            variables["search_result_count"] = len(data)
+            # 如果只有一个结果，自动将其作为当前选中商品，便于后续展示和购买
+            if len(data) == 1:
+                variables["current_product"] = data[0]
+            # 为后续“从结果中选择商品”构建一次索引
+            self._get_search_index(session, data)
+
+    def _resolve_database_endpoint(self, endpoint: str) -> Callable[[Dict[str, Any], Any], Any]:
+        """将 database:// 端点解析为处理函数，未知端点返回仅打印警告的函数"""
+        path = endpoint.replace("database://", "")
+        handler = self._db_endpoints.get(path)
+
+        def query(params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+            if handler is None:
                 print(f"[Database Query] Unknown endpoint: {path}")
                 return None
+            try:
+                return handler(params, session)
+            except Exception as e:
+                print(f"[Database Query Error] {str(e)}")
+                return None
 
-        except Exception as e:
-            print(f"[Database Query Error] {str(e)}")
+        return query
+
+    # ==================== 内置数据库端点 ====================
+
+    # 商品相关查询
+    def _query_products_list(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        category = params.get("category")
+        limit = params.get("limit", 10)
+        return self.db.get_all_products(category=category, limit=limit)
+
+    def _query_products_search(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        # 优先从最近一轮用户输入中提取更“干净”的搜索关键词，避免整句查询命中率低
+        raw_keyword = params.get("keyword", "")
+        user_input = self._get_session_value(session, "last_user_input", raw_keyword)
+        keyword = self._extract_product_search_keyword(user_input, raw_keyword)
+
+        # 从session变量中获取已有关键词作为兜底
+        variables = self._get_variables(session)
+        if not keyword and "keyword" in variables:
+            keyword = variables["keyword"]
+
+        return self.db.search_products(keyword)
+
+    def _query_products_get(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        product_id = params.get("product_id")
+        variables = self._get_variables(session)
+        if not product_id and "product_id" in variables:
+            product_id = variables["product_id"]
+        return self.db.get_product(product_id)
+
+    # 订单相关查询
+    def _query_orders_get(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        order_id = params.get("order_id")
+        variables = self._get_variables(session)
+        if not order_id and "order_id" in variables:
+            order_id = variables["order_id"]
+        return self.db.get_order(order_id)
+
+    def _query_orders_list(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        # 优先从session中获取user_id，实现自动查询当前用户的订单
+        user_id = self._get_session_value(session, "user_id")
+        if not user_id:
+            user_id = params.get("user_id", "U001")  # 降级到参数或默认用户
+        return self.db.get_user_orders(user_id)
+
+    def _query_orders_search(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        # 根据用户提供的商品关键词、描述信息模糊查询订单
+        user_id = self._get_session_value(session, "user_id")
+        if not user_id:
+            user_id = params.get("user_id", "U001")
+
+        keyword = params.get("keyword", "")
+        if not keyword:
+            variables = self._get_variables(session)
+            keyword = variables.get("order_keyword", "")
+
+        if not keyword:
+            return []
+
+        return self.db.search_user_orders(user_id=user_id, keyword=keyword)
+
+    # 订单写动作
+    def _query_orders_create(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        user_id = self._get_session_value(session, "user_id")
+        if not user_id:
+            user_id = params.get("user_id", "U001")
+
+        # 扣减库存与写入订单在同一事务中完成，库存不足时不会生成订单；
+        # 幂等键同样在事务内检查，重复提交返回第一次创建的订单
+        return self.db.create_order({
+            "order_id": generate_id("A"),
+            "user_id": user_id,
+            "product_id": params.get("product_id"),
+            "quantity": int(params.get("quantity", 1)),
+            "status": "paid",
+            "shipping_address": params.get("shipping_address", ""),
+            "request_key": self._get_request_key("orders/create", params, session),
+        })
+
+    def _query_orders_update_status(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        order_id = params.get("order_id")
+        status = params.get("status")
+        success = self.db.update_order_status(order_id, status)
+        return {"success": success}
+
+    # 退款相关查询
+    def _query_refunds_check(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        order_id = params.get("order_id")
+        variables = self._get_variables(session)
+        if not order_id and "order_id" in variables:
+            order_id = variables["order_id"]
+        reason_type = params.get("reason_type")
+        return self.db.check_refund_eligibility(order_id, reason_type)
+
+    def _query_refunds_create(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        request_key = self._get_request_key("refunds/create", params, session)
+        existing = self._find_written_record("refunds", request_key)
+        if existing:
+            return {"success": True, "message": "退款申请提交成功",
+                    "amount": existing["amount"], "refund_id": existing["refund_id"]}
+
+        refund_data = {
+            "refund_id": generate_id("R"),
+            "order_id": params.get("order_id"),
+            "user_id": params.get("user_id", ""),
+            "reason": params.get("reason"),
+            "reason_type": params.get("reason_type"),
+            "amount": params.get("amount", 0.0),
+            "status": "pending",
+            "request_key": request_key,
+        }
+        success = self.db.create_refund(refund_data)
+        if success:
+            return {"success": True, "message": "退款申请提交成功",
+                    "amount": refund_data["amount"], "refund_id": refund_data["refund_id"]}
+        return {"success": False, "message": "退款申请提交失败"}
+
+    # 发票相关查询
+    def _query_invoices_check_eligibility(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        order_id = params.get("order_id")
+        variables = self._get_variables(session)
+        if not order_id and "order_id" in variables:
+            order_id = variables["order_id"]
+        return self.db.check_order_invoice_eligibility(order_id)
+
+    def _query_invoices_create(self, params: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> Any:
+        request_key = self._get_request_key("invoices/create", params, session)
+        existing = self._find_written_record("invoices", request_key)
+        if existing:
+            return {"success": True, "message": "发票申请提交成功", "invoice_id": existing["invoice_id"]}
+
+        invoice_data = {
+            "invoice_id": generate_id("I"),
+            "order_id": params.get("order_id"),
+            "user_id": params.get("user_id", ""),
+            "invoice_title": params.get("title", "个人发票"),
+            "tax_id": params.get("tax_id"),
+            "invoice_type": params.get("invoice_type", "personal"),
+            "amount": params.get("amount", 0.0),
+            "status": "pending",
+            "request_key": request_key,
+        }
+        success = self.db.create_invoice(invoice_data)
+        if success:
+            return {"success": True, "message": "发票申请提交成功", "invoice_id": invoice_data["invoice_id"]}
+        return {"success": False, "message": "发票申请提交失败"}
+
+    def _get_request_key(self, path: str, params: Dict[str, Any],
+                         session: Union[Session, Dict[str, Any]]) -> Optional[str]:
+        """
+        计算写动作的幂等键
+
+        优先使用动作参数中的 request_key；否则由客户端消息的 request_id、用户与参数派生，
+        客户端重发同一条消息时得到相同的键。两者都没有时返回None（不做幂等控制）。
+        """
+        explicit = params.get("request_key")
+        if explicit:
+            return str(explicit)
+        request_id = self._get_session_value(session, "request_id")
+        if not request_id:
             return None
+        user_id = self._get_session_value(session, "user_id") or ""
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(f"{user_id}|{request_id}|{path}|{payload}".encode("utf-8")).hexdigest()
+
+    def _find_written_record(self, table: str, request_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """查询幂等键对应的已写入记录，数据库不支持幂等键时返回None"""
+        finder = getattr(self.db, "get_by_request_key", None)
+        if not request_key or finder is None:
+            return None
+        return finder(table, request_key)
+
+    def compile_flow(self, flow) -> List[str]:
+        """
+        预编译流程中每个状态的动作流水线与 respond 模板，
+        并检查未知动作类型、未知数据库端点以及模板引用的变量
+
+        Args:
+            flow: ChatFlow实例
 
+        Returns:
+            DSL警告信息列表（同时打印到控制台）
+        """
+        # 格式错误的状态、动作列表与动作（如误写成字符串）由 dsl.check 报告为错误，这里跳过
+        states = [state for state in flow.states if isinstance(state, dict)]
+        known_variables = set(self.DERIVED_VARIABLES)
+        for state in states:
+            for action in self._state_actions(state):
+                known_variables.update(self._collect_written_variables(action))
+
+        warnings = []
+        for state in states:
+            location = f"流程 '{flow.name}' 状态 '{state.get('id')}'"
+            actions = state.get("actions")
+            if isinstance(actions, list) and state.get("id"):
+                self._pipelines[(flow.name, state["id"])] = self.compile_actions(actions)
+
+            for action in self._state_actions(state):
+                action_type = action.get("type")
+                if action_type not in self._action_handlers:
+                    warnings.append(f"{location} 使用了未注册的动作类型 '{action_type}'")
+                    continue
+                if action_type == "api_call":
+                    endpoint = action.get("endpoint", action.get("url", ""))
+                    if endpoint.startswith("database://") and endpoint.replace("database://", "") not in self._db_endpoints:
+                        warnings.append(f"{location} 调用了未注册的数据库端点 '{endpoint}'")
+                    continue
+                if action_type != "respond":
+                    continue
+                template = self._get_template(action.get("text", ""))
+                for literal in template.segments:
+                    if isinstance(literal, str) and "{{" in literal:
+                        warnings.append(f"{location} 的模板包含无法解析的占位符，将按原文输出")
+                        break
+                for variable in template.variables:
+                    if not variable.is_valid:
+                        warnings.append(f"{location} 的模板表达式 '{variable.path}' 不是合法的变量路径，将渲染为空")
+                    elif variable.path not in self._display_providers and variable.root not in known_variables:
+                        warnings.append(f"{location} 的模板引用了未知变量 '{variable.path}'")
+
+        for warning in warnings:
+            print(f"警告：{warning}")
+        return warnings
+
+    @staticmethod
+    def _state_actions(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """状态中格式正确（是映射）的动作"""
+        actions = state.get("actions")
+        if not isinstance(actions, list):
+            return []
+        return [action for action in actions if isinstance(action, dict)]
+
+    def _collect_written_variables(self, action: Dict[str, Any]) -> List[str]:
+        """返回动作可能写入的会话变量名"""
+        action_type = action.get("type")
+        if action_type in ("api_call", "extract_variable"):
+            target = action.get("save_to") if action_type == "api_call" else action.get("target")
+            if isinstance(target, str) and target.startswith("session."):
+                return [target.split('.')[1]]
+        elif action_type == "set_variable" and action.get("scope") == "session" and action.get("key"):
+            return [action["key"]]
+        return []
+
+    def _get_template(self, text: str) -> CompiledTemplate:
+        """获取预编译模板，未命中时即时编译并缓存"""
+        template = self._templates.get(text)
+        if template is None:
+            template = compile_template(text)
+            self._templates[text] = template
+        return template
 
     def _handle_respond(self, action: Dict[str, Any], session: Union[Session, Dict[str, Any]]) -> str:
         """
         处理响应动作，支持复杂的模板渲染
         """
-        text = action.get("text", "")
-        import re
-
-        # 预处理特殊变量
-        self._prepare_display_variables(session)
-        display_vars = self._get_display_vars(session)
-        variables = self._get_variables(session)
+        return self._render_template(self._get_template(action.get("text", "")), session)
 
-        def repl(match):
-            full_match = match.group(0)
-            parts_str = match.group(1)  # e.g., "session.product_details.description"
-            parts = parts_str.split('.')
+    def _render_template(self, template: CompiledTemplate, session: Union[Session, Dict[str, Any]]) -> str:
+        """使用会话变量渲染预编译模板"""
+        if not template.variables:
+            return template.source
 
-            if len(parts) < 2 or parts[0] != 'session':
-                return full_match
+        variables = self._get_variables(session)
 
-            # 处理特殊显示变量
-            if parts_str in display_vars:
-                return display_vars[parts_str]
+        def resolve(variable: TemplateVariable) -> str:
+            # 处理特殊显示变量（仅在被引用时计算）
+            if variable.path in self._display_providers:
+                display_text = self._resolve_display_variable(variable.path, session)
+                if display_text is not None:
+                    return display_text
 
             # 通用变量访问
-            current_data = variables
-            for part in parts[1:]:
-                if isinstance(current_data, dict):
-                    current_data = current_data.get(part)
-                else:
-                    current_data = None
-                    break
-
-            return str(current_data) if current_data is not None else ""
+            value = lookup_variable_path(variables, variable.parts)
+            return str(value) if value is not None else ""
 
-        processed_text = re.sub(r"\{\{\s*(session\..*?)\s*\}\}", repl, text)
-        return processed_text
+        return template.render(resolve)
 
-    def _prepare_display_variables(self, session: Union[Session, Dict[str, Any]]):
+    def _resolve_display_variable(self, path: str, session: Union[Session, Dict[str, Any]]) -> Optional[str]:
         """
-        准备用于显示的特殊变量
-        将复杂数据结构转换为易读的文本格式
+        惰性计算显示变量，并按源变量版本号缓存
+
+        源变量未变化时直接复用上次格式化的文本；源变量不存在或
+        不适合展示时返回None，由调用方回退到普通变量访问。
         """
+        source_name, formatter = self._display_providers[path]
         variables = self._get_variables(session)
-        display_vars = self._get_display_vars(session)
-
-        # 处理产品列表
-        if "featured_products" in variables:
-            products = variables["featured_products"]
-            if isinstance(products, list) and products:
-                product_lines = []
-                for p in products:
-                    name = p.get("name", "未知商品")
-                    price = p.get("price", 0)
-                    stock = p.get("stock", 0)
-                    product_lines.append(f"• {name} - ¥{price} (库存: {stock})")
-                display_vars["session.products_list"] = "\n".join(product_lines)
-                display_vars["session.featured_products_names"] = "、".join([p.get("name", "") for p in products])
-
-        # 处理当前产品
-        if "current_product" in variables:
-            product = variables["current_product"]
-            if isinstance(product, dict):
-                # 格式化特性列表
-                features = product.get("features")
-                if isinstance(features, list):
-                    display_vars["session.current_product.features"] = "\n".join([f"• {f}" for f in features])
-
-        # 处理订单状态
-        if "current_order" in variables:
-            order = variables["current_order"]
-            if isinstance(order, dict):
-                status = order.get("status", "unknown")
-                status_map = {
-                    "pending": "待付款",
-                    "paid": "已付款，待发货",
-                    "shipped": "已发货",
-                    "delivered": "已送达",
-                    "cancelled": "已取消"
-                }
-                display_vars["session.order_status_text"] = status_map.get(status, status)
-
-                # 物流信息
-                tracking = order.get("tracking_number", "")
-                if tracking:
-                    display_vars["session.tracking_info"] = f"物流单号：{tracking}"
-                else:
-                    display_vars["session.tracking_info"] = ""
-
-        # 处理订单列表
-        if "user_orders" in variables:
-            orders = variables["user_orders"]
-            if isinstance(orders, list) and orders:
-                order_lines = []
-                for order in orders:
-                    order_id = order.get("order_id", "")
-                    product_name = order.get("product_name", "")
-                    status = order.get("status", "")
-                    status_map = {
-                        "pending": "待付款",
-                        "paid": "已付款",
-                        "shipped": "已发货",
-                        "delivered": "已送达",
-                        "cancelled": "已取消"
-                    }
-                    status_text = status_map.get(status, status)
-                    order_lines.append(f"• {order_id} - {product_name} [{status_text}]")
-                display_vars["session.order_list_text"] = "\n".join(order_lines)
-            else:
-                display_vars["session.order_list_text"] = "暂无订单记录"
-
-        # 处理搜索结果
-        if "search_results" in variables:
-            results = variables["search_results"]
-            if isinstance(results, list):
-                # 记录搜索结果数量，供DSL中的条件判断使用
-                variables["search_result_count"] = len(results)
-
-                # 如果只有一个结果，自动将其作为当前选中商品，便于后续展示和购买
-                if len(results) == 1:
-                    variables["current_product"] = results[0]
-
-                if results:
-                    result_lines = []
-                    for p in results:
-                        result_lines.append(f"• {p.get('name')} - ¥{p.get('price')}")
-                    display_vars["session.search_result_text"] = f"找到以下商品：\n" + "\n".join(result_lines)
-                else:
-                    display_vars["session.search_result_text"] = "抱歉，没有找到相关商品。"
-    
+        if source_name not in variables:
+            return None
+
+        source = variables[source_name]
+        version = variables.version(source_name) if isinstance(variables, VariableStore) else None
+        cache = self._get_display_vars(session)
+        cached = cache.get(path)
+        # 同时比较版本号与对象身份：普通字典会话没有版本号，仅依赖身份判断
+        if cached is not None and cached[0] == version and cached[1] is source:
+            return cached[2]
+
+        display_text = formatter(source)
+        cache[path] = (version, source, display_text)
+        return display_text
+
+    # ==================== 显示变量格式化 ====================
+    # 将复杂数据结构转换为易读的文本格式
+
+    _ORDER_DETAIL_STATUS_TEXT = {
+        "pending": "待付款",
+        "paid": "已付款，待发货",
+        "shipped": "已发货",
+        "delivered": "已送达",
+        "cancelled": "已取消"
+    }
+
+    _ORDER_LIST_STATUS_TEXT = {
+        "pending": "待付款",
+        "paid": "已付款",
+        "shipped": "已发货",
+        "delivered": "已送达",
+        "cancelled": "已取消"
+    }
+
+    @staticmethod
+    def _format_products_list(products: Any) -> Optional[str]:
+        if not isinstance(products, list) or not products:
+            return None
+        product_lines = []
+        for p in products:
+            name = p.get("name", "未知商品")
+            price = p.get("price", 0)
+            stock = p.get("stock", 0)
+            product_lines.append(f"• {name} - ¥{price} (库存: {stock})")
+        return "\n".join(product_lines)
+
+    @staticmethod
+    def _format_featured_products_names(products: Any) -> Optional[str]:
+        if not isinstance(products, list) or not products:
+            return None
+        return "、".join([p.get("name", "") for p in products])
+
+    @staticmethod
+    def _format_product_features(product: Any) -> Optional[str]:
+        if not isinstance(product, dict):
+            return None
+        features = product.get("features")
+        if not isinstance(features, list):
+            return None
+        return "\n".join([f"• {f}" for f in features])
+
+    @classmethod
+    def _format_order_status(cls, order: Any) -> Optional[str]:
+        if not isinstance(order, dict):
+            return None
+        status = order.get("status", "unknown")
+        return cls._ORDER_DETAIL_STATUS_TEXT.get(status, status)
+
+    @staticmethod
+    def _format_tracking_info(order: Any) -> Optional[str]:
+        if not isinstance(order, dict):
+            return None
+        tracking = order.get("tracking_number", "")
+        return f"物流单号：{tracking}" if tracking else ""
+
+    @classmethod
+    def _format_order_list(cls, orders: Any) -> Optional[str]:
+        if not isinstance(orders, list) or not orders:
+            return "暂无订单记录"
+        order_lines = []
+        for order in orders:
+            order_id = order.get("order_id", "")
+            product_name = order.get("product_name", "")
+            status = order.get("status", "")
+            status_text = cls._ORDER_LIST_STATUS_TEXT.get(status, status)
+            order_lines.append(f"• {order_id} - {product_name} [{status_text}]")
+        return "\n".join(order_lines)
+
+    @staticmethod
+    def _format_search_results(results: Any) -> Optional[str]:
+        if not isinstance(results, list):
+            return None
+        if not results:
+            return "抱歉，没有找到相关商品。"
+        result_lines = []
+        for p in results:
+            result_lines.append(f"• {p.get('name')} - ¥{p.get('price')}")
+        return f"找到以下商品：\n" + "\n".join(result_lines)
+
     # ... _handle_extract_variable and _handle_set_variable remain unchanged
     def _handle_extract_variable(self, action: Dict[str, Any], session: Union[Session, Dict[str, Any]]):
         """Handles the 'extract_variable' action."""
@@ -424,20 +837,35 @@ class ActionExecutor:
             self._get_variables(session)[key] = value
             print(f"[ActionExecutor] Set variable '{key}' = '{value}'")
 
-    def _get_variables(self, session: Union[Session, Dict[str, Any]]) -> Dict[str, Any]:
+    @staticmethod
+    def _get_variables(session: Union[Session, Dict[str, Any]]) -> Dict[str, Any]:
         """Access session variables with write-through semantics."""
         if isinstance(session, Session):
             return session.variables
         return session.setdefault("variables", {})
 
     def _get_display_vars(self, session: Union[Session, Dict[str, Any]]) -> Dict[str, Any]:
-        """Access display variables, creating storage when missing."""
+        """Access the display variable cache, creating storage when missing."""
         if isinstance(session, Session):
             if not hasattr(session, "_display_vars"):
                 session._display_vars = {}
             return session._display_vars
         return session.setdefault("_display_vars", {})
 
+    def _get_search_index(self, session: Union[Session, Dict[str, Any]], results: List[Dict[str, Any]]) -> ProductSelectionIndex:
+        """获取搜索结果对应的选择索引，结果列表变化时重建"""
+        if isinstance(session, Session):
+            index = getattr(session, "_search_index", None)
+        else:
+            index = session.get("_search_index")
+        if index is None or index.results is not results:
+            index = ProductSelectionIndex(results)
+            if isinstance(session, Session):
+                session._search_index = index
+            else:
+                session["_search_index"] = index
+        return index
+
     def _get_session_value(self, session: Union[Session, Dict[str, Any]], key: str, default: Any = None) -> Any:
         if isinstance(session, Session):
             return getattr(session, key, default)
@@ -461,93 +889,7 @@ class ActionExecutor:
         if not results or not user_input.strip():
             return
 
-        text = user_input.strip()
-        text_lower = text.lower()
-
-        chosen = None
-
-        # 0) 优先尝试根据价格精确匹配，避免“小数点后的 0”干扰编号匹配
-        #    例如：“价格是2419.0的这一款”应优先选中价格为 2419.0 的商品
-        price_tokens = re.findall(r"\d+(?:\.\d+)?", text)
-        for token in price_tokens:
-            try:
-                price_val = float(token)
-            except ValueError:
-                continue
-            for p in results:
-                price = p.get("price")
-                try:
-                    if price is not None and float(price) == price_val:
-                        chosen = p
-                        break
-                except Exception:
-                    continue
-            if chosen:
-                break
-
-        # 1) 若仍未选中，再尝试根据数字编号或价格选择
-        # 1.1 提取所有连续数字
-        num_match = re.findall(r"\d+", text)
-
-        if not chosen and num_match:
-            # 优先尝试数字是否出现在商品名称中（如“平板电脑 12”）
-            for num in num_match:
-                for p in results:
-                    name = str(p.get("name", "") or "")
-                    if num in name:
-                        chosen = p
-                        break
-                if chosen:
-                    break
-
-            # 其次尝试按“第 N 个”或“编号 N”理解为索引
-            if not chosen:
-                for num in num_match:
-                    try:
-                        idx = int(num) - 1
-                    except ValueError:
-                        continue
-                    if 0 <= idx < len(results):
-                        chosen = results[idx]
-                        break
-
-            # 再次尝试根据价格匹配
-            if not chosen:
-                for num in num_match:
-                    try:
-                        price_val = float(num)
-                    except ValueError:
-                        continue
-                    for p in results:
-                        price = p.get("price")
-                        try:
-                            if price is not None and float(price) == price_val:
-                                chosen = p
-                                break
-                        except Exception:
-                            continue
-                    if chosen:
-                        break
-
-        # 2) 根据商品名称关键字进行模糊匹配
-        if not chosen:
-            tokens = re.findall(r"[\u4e00-\u9fa5A-Za-z0-9]+", text_lower)
-            # 去掉明显是数字的 token，避免与索引逻辑重复
-            tokens = [t for t in tokens if not t.isdigit()]
-
-            if tokens:
-                def score_product(p: Dict[str, Any]) -> int:
-                    name = str(p.get("name", "") or "").lower()
-                    s = 0
-                    for t in tokens:
-                        if t and t in name:
-                            s += len(t)
-                    return s
-
-                scored = [(score_product(p), p) for p in results]
-                scored.sort(key=lambda x: x[0], reverse=True)
-                if scored and scored[0][0] > 0:
-                    chosen = scored[0][1]
+        chosen = self._get_search_index(session, results).select(user_input.strip())
 
         if chosen is not None:
             variables["current_product"] = chosen
@@ -556,35 +898,40 @@ class ActionExecutor:
         else:
             print("[ActionExecutor] No product matched from search_results using user input")
 
+    def _get_product_vocabulary(self) -> KeywordTrie:
+        """
+        获取商品词表自动机
+
+        词表由内置常见商品词与商品表中的名称、分类、特性组成，
+        数据库的商品目录版本号变化时自动重建。
+        """
+        version = getattr(self.db, "catalog_version", None)
+        if self._vocabulary is None or self._vocabulary_version != version:
+            terms = set(self.BASE_PRODUCT_VOCABULARY)
+            if hasattr(self.db, "get_product_vocabulary"):
+                try:
+                    terms.update(self.db.get_product_vocabulary())
+                except Exception as e:
+                    print(f"[ActionExecutor] 加载商品词表失败，仅使用内置词表: {e}")
+            self._vocabulary = KeywordTrie(terms)
+            self._vocabulary_version = version
+        return self._vocabulary
+
     def _extract_product_search_keyword(self, user_input: str, fallback: str = "") -> str:
         """
         从用户原始输入中尽量提取出用于商品搜索的简短关键词。
 
-        优先匹配常见商品词，其次根据中文/英文 token 做简单启发式截取。
+        优先匹配商品词表（内置常见词 + 商品表中的名称、分类、特性）中的最长词，
+        其次根据中文/英文 token 做简单启发式截取。
         """
         text = (user_input or "").strip()
         if not text:
             return fallback
 
-        # 常见商品关键词词表（可根据需要扩充）
-        vocab = [
-            "平板电脑", "平板", "笔记本", "轻薄本",
-            "无线蓝牙耳机", "蓝牙耳机", "耳机",
-            "智能手环", "手环",
-            "充电宝", "移动电源",
-            "机械键盘", "键盘",
-            "网络摄像头", "摄像头",
-            "显示器", "电竞显示器",
-            "扩展坞",
-            "智能音箱", "音箱",
-            "游戏鼠标", "鼠标",
-        ]
-
-        hits = [w for w in vocab if w in text]
-        if hits:
+        keyword = self._get_product_vocabulary().longest_match(text)
+        if keyword:
             # 命中多个时优先选择最长的词
-            hits.sort(key=len, reverse=True)
-            return hits[0]
+            return keyword
 
         # 否则按中英文/数字切分，取最后一个 token 作为候选
         tokens = re.findall(r"[\u4e00-\u9fa5A-Za-z0-9]+", text)
@@ -599,17 +946,12 @@ class ActionExecutor:
 
         return candidate or fallback or text
 
-    def _resolve_param_value(self, value: Any, session: Union[Session, Dict[str, Any]]) -> Any:
-        """Resolve templated parameter values using session variables."""
+    @staticmethod
+    def _compile_param_value(value: Any) -> Optional[Tuple[str, ...]]:
+        """预解析参数模板，返回会话变量路径；非模板参数返回None"""
         if isinstance(value, str):
-            match = re.match(r"\{\{\s*session\.(.*?)\s*\}\}", value)
+            match = _PARAM_TEMPLATE_PATTERN.match(value)
             if match:
-                current = self._get_variables(session)
-                for part in match.group(1).split('.'):
-                    if isinstance(current, dict):
-                        current = current.get(part)
-                    else:
-                        current = None
-                        break
-                return current
-        return value
+                return tuple(match.group(1).split('.'))
+        return None
+
@@ -1,27 +1,61 @@
 import os
 import re
-from typing import Dict, List, Optional, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import yaml
 
-from dsl.dsl_parser import DslParser, ChatFlow
+from dsl.dsl_parser import DslParser, ChatFlow, Transition
+from dsl.check import ERROR, check_flow
+from dsl.flow_table import FlowTable, load_flow_table
 from dsl.interpreter import Interpreter
 from core.action_executor import ActionExecutor
 from core.session_manager import SessionManager, Session
 
 class Chatbot:
     """聊天机器人编排器，支持混合模式：规则优先 + LLM语义理解兜底"""
-    def __init__(self, flows_dir: str = "dsl/flows", llm_responder=None):
-        self.flows: Dict[str, ChatFlow] = self._load_flows(flows_dir)
+    def __init__(self, flows_dir: str = "dsl/flows", llm_responder=None,
+                 speculative_intent: bool = False, flow_table: Optional[str] = None,
+                 db_manager=None):
+        """
+        Args:
+            speculative_intent: 推测执行模式。规则与当前流程都无法确定结果的轮次，
+                LLM意图识别与当前流程的转换判断（可能包含LLM语义匹配）并行执行，
+                省去一次LLM往返
+            flow_table: 预编译流程表路径。设置后从只读 mmap 的流程表加载流程
+                （多个服务器进程共享同一份），流程脚本变化时自动重新编译；
+                状态体与动作流水线在状态首次执行时才解码、编译
+            db_manager: 动作执行器使用的数据库管理器，为None时使用默认数据库
+        """
+        self.flow_table: Optional[FlowTable] = None
+        if flow_table:
+            self.flow_table, self.flows = load_flow_table(flows_dir, flow_table)
+            print(f"  - Loaded {len(self.flows)} flows from table '{flow_table}'")
+        else:
+            self.flows: Dict[str, ChatFlow] = self._load_flows(flows_dir)
         self.llm_responder = llm_responder
+        self.speculative_intent = speculative_intent
+        # 推测执行的LLM意图识别线程池，首次使用时创建
+        self._intent_pool: Optional[ThreadPoolExecutor] = None
+        self._intent_pool_lock = threading.Lock()
 
         self.interpreters: Dict[str, Interpreter] = {
             name: Interpreter(flow, llm_responder=llm_responder)
             for name, flow in self.flows.items()
         }
         self.session_manager = SessionManager()
-        self.action_executor = ActionExecutor()
+        self.action_executor = ActionExecutor(db_manager=db_manager)
+        # 从 YAML 加载时预编译所有回复模板，并报告模板中的未知变量；
+        # 流程表模式下不逐个解码状态，流水线在状态首次执行时按 (流程名, 状态ID) 编译
+        if self.flow_table is None:
+            for flow in self.flows.values():
+                self.action_executor.compile_flow(flow)
 
         self.flow_intents = self._build_flow_intent_map()
+        # LLM意图识别用的流程描述列表，随流程集合固定，只构造一次
+        self.flow_descriptions: Tuple[str, ...] = tuple(
+            f"{flow_name}: {flow_intent}" for flow_name, flow_intent in self.flow_intents.items()
+        )
 
         print(f"Chatbot initialized with {len(self.flows)} flows.")
         if llm_responder:
@@ -51,7 +85,8 @@ class Chatbot:
 
         return intent_map
 
-    def _load_flows(self, flows_dir: str) -> Dict[str, ChatFlow]:
+    @staticmethod
+    def _load_flows(flows_dir: str) -> Dict[str, ChatFlow]:
         """从目录加载所有DSL流程文件"""
         flows = {}
         if not os.path.exists(flows_dir):
@@ -67,6 +102,10 @@ class Chatbot:
                     if flow:
                         flows[flow.name] = flow
                         print(f"  - Loaded flow: '{flow.name}' from {filename}")
+                        # 目标状态缺失、正则错误等会在对话中途才暴露，加载时先提示
+                        for issue in check_flow(flow, source=filename):
+                            if issue.severity == ERROR:
+                                print(f"    {issue}")
         return flows
 
     def _try_rule_based_trigger(self, user_input: str) -> Optional[str]:
@@ -76,8 +115,8 @@ class Chatbot:
         for flow_name, flow in self.flows.items():
             entry_state = flow.get_entry_state()
             if entry_state:
-                for trigger in entry_state.get("triggers", []):
-                    if trigger.get("type") == "regex":
+                for trigger in entry_state.get("triggers") or []:
+                    if isinstance(trigger, dict) and trigger.get("type") == "regex":
                         pattern = trigger.get("value", "")
                         if re.search(pattern, user_input, re.IGNORECASE):
                             print(f"  [OK] [规则匹配成功] 触发流程: '{flow_name}' (regex: '{pattern}')")
@@ -95,11 +134,6 @@ class Chatbot:
         print(f"[步骤2: LLM语义匹配] 调用LLM分析意图...")
 
         try:
-            # 准备流程映射信息（流程名称 -> 描述）
-            flow_descriptions = []
-            for flow_name, flow_intent in self.flow_intents.items():
-                flow_descriptions.append(f"- {flow_name}: {flow_intent}")
-
             # 构建会话上下文，帮助LLM结合历史判断意图
             session_context = None
             if session is not None:
@@ -111,7 +145,7 @@ class Chatbot:
             # 调用LLM识别意图，传入流程描述列表
             result = self.llm_responder.recognize_intent(
                 user_input=user_input,
-                available_intents=flow_descriptions,
+                available_intents=self.flow_descriptions,
                 session_context=session_context,
             )
 
@@ -186,8 +220,52 @@ class Chatbot:
 
         return None, None
 
-    def _generate_fallback_response(self, user_input: str) -> str:
-        """生成兜底回复，优先使用LLM，失败时使用固定模板"""
+    def _get_intent_pool(self) -> ThreadPoolExecutor:
+        with self._intent_pool_lock:
+            if self._intent_pool is None:
+                self._intent_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="intent")
+            return self._intent_pool
+
+    def _detect_intent_speculatively(self, user_input: str, session: Session,
+                                     active_flow_name: str) -> Tuple[Optional[str], Optional[str], Optional[Transition]]:
+        """
+        推测执行的意图识别，返回(flow_name, source, in_flow_transition)
+
+        1. 全局规则命中：直接采用，不调用LLM
+        2. 当前流程中不依赖LLM的条件（正则/变量）先于任何LLM条件命中：由当前流程处理，不调用LLM
+        3. 否则为歧义输入：在后台线程发起LLM意图识别，同时在当前线程完成当前流程的转换判断
+           （可能包含LLM语义匹配），两次LLM调用并行。LLM意图识别结果优先级不变，
+           转换判断结果在未切换流程时直接使用，无需重复判断
+
+        source 为 "rule" 时未判断当前流程的转换；其他情况下 in_flow_transition 为已判断出的
+        当前流程转换，为None表示当前流程无法处理
+        """
+        rule_flow = self._try_rule_based_trigger(user_input)
+        if rule_flow:
+            return rule_flow, "rule", None
+
+        interpreter = self.interpreters[active_flow_name]
+        transition = interpreter.find_transition(session, user_input, deterministic_only=True)
+        if transition:
+            print(f"  [推测执行] 当前流程规则已命中，跳过LLM意图识别")
+            return None, None, transition
+
+        print(f"  [推测执行] 歧义输入，LLM意图识别与当前流程判断并行")
+        future = self._get_intent_pool().submit(self._try_llm_based_trigger, user_input, session)
+        try:
+            transition = interpreter.find_transition(session, user_input)
+            llm_flow = future.result()
+        finally:
+            # 当前流程判断出错时不再等待LLM结果；尚未开始的请求直接取消
+            future.cancel()
+        return llm_flow, "llm" if llm_flow else None, transition
+
+    def _generate_fallback_response(self, user_input: str, stream: bool = False) -> Union[str, Iterator[str]]:
+        """
+        生成兜底回复，优先使用LLM，失败时使用固定模板
+
+        stream 为True时返回LLM的文本片段迭代器（固定模板仍为字符串）
+        """
         if self.llm_responder:
             try:
                 print(f"[兜底回复] 使用LLM生成友好回复...")
@@ -200,6 +278,10 @@ class Chatbot:
 - 申请发票
 - 解决设备故障问题"""
 
+                if stream:
+                    response = self.llm_responder.generate_response(context, user_input, stream=True)
+                    print(f"  ✓ LLM开始流式生成回复")
+                    return response
                 response = self.llm_responder.generate_response(context, user_input)
                 print(f"  ✓ LLM生成回复成功")
                 return response
@@ -210,12 +292,18 @@ class Chatbot:
         # 固定模板（兜底的兜底）
         return "抱歉，我暂时无法理解您的意思。您可以尝试：\n- 咨询产品信息\n- 查询订单状态\n- 申请退款退货\n- 开具发票\n- 反馈故障问题"
 
-    def handle_message(self, session_id: str, user_input: str, user_id: Optional[str] = None) -> List[str]:
+    def handle_message(self, session_id: str, user_input: str, user_id: Optional[str] = None,
+                       request_id: Optional[str] = None,
+                       stream: bool = False) -> List[Union[str, Iterator[str]]]:
         """
         处理用户消息，路由到正确的流程并返回回复
         支持全局流程切换：规则优先 + LLM兜底，允许用户随时切换业务流程
+
+        request_id 为客户端生成的消息ID，客户端重试时复用，使下单、退款等写动作不会重复执行
+        stream 为True时，LLM兜底回复以文本片段迭代器的形式放在返回列表中，由调用方边迭代边发送
         """
         session = self.session_manager.get_session(session_id, user_id)
+        session.request_id = request_id
 
         # 维护简单的用户输入历史，供LLM进行上下文感知的意图识别
         if session.last_user_input:
@@ -238,7 +326,15 @@ class Chatbot:
         print(f"{'='*70}")
 
         # 综合使用规则 + LLM 识别本轮意图所属流程
-        intent_flow_name, intent_source = self._detect_intent_flow(user_input, session)
+        in_flow_transition = None
+        transition_evaluated = False
+        if self.speculative_intent and self.llm_responder and active_flow_name:
+            intent_flow_name, intent_source, in_flow_transition = self._detect_intent_speculatively(
+                user_input, session, active_flow_name
+            )
+            transition_evaluated = intent_source != "rule"
+        else:
+            intent_flow_name, intent_source = self._detect_intent_flow(user_input, session)
 
         actions: List[Dict] = []
         handled_in_current_flow = False
@@ -257,7 +353,11 @@ class Chatbot:
         if not handled_in_current_flow and active_flow_name:
             print(f"[流程继续] 尝试在当前流程 '{active_flow_name}' 内处理输入")
             interpreter = self.interpreters[active_flow_name]
-            actions_in_flow, matched = interpreter.process_with_match(session, user_input)
+            if transition_evaluated:
+                # 推测执行时已判断过当前流程的转换，直接执行
+                actions_in_flow, matched = interpreter.apply_transition(session, in_flow_transition)
+            else:
+                actions_in_flow, matched = interpreter.process_with_match(session, user_input)
             if matched:
                 handled_in_current_flow = True
                 actions = actions_in_flow
@@ -275,7 +375,10 @@ class Chatbot:
                 else:
                     print(f"[流程继续] 继续流程: '{active_flow_name}'（由全局匹配触发，来源: {intent_source or 'unknown'}）")
                     interpreter = self.interpreters[active_flow_name]
-                    actions, _ = interpreter.process_with_match(session, user_input)
+                    if transition_evaluated:
+                        actions, _ = interpreter.apply_transition(session, in_flow_transition)
+                    else:
+                        actions, _ = interpreter.process_with_match(session, user_input)
             else:
                 print(f"[流程匹配失败] 无法理解用户意图")
                 actions = []
@@ -284,20 +387,29 @@ class Chatbot:
 
         # 如果没有任何动作，使用LLM生成友好的兜底回复
         if not actions:
-            fallback_response = self._generate_fallback_response(user_input)
+            fallback_response = self._generate_fallback_response(user_input, stream=stream)
             return [fallback_response]
 
         # 执行动作
-        responses = self.action_executor.execute(actions, session)
+        responses = self.action_executor.execute(actions, session, self._state_key(session, actions))
 
         # 如果执行后没有任何响应（例如只有wait_for_input），也使用兜底回复
         if not responses:
             print(f"[WARN] 动作执行后无响应，使用兜底回复")
-            fallback_response = self._generate_fallback_response(user_input)
+            fallback_response = self._generate_fallback_response(user_input, stream=stream)
             return [fallback_response]
 
         return responses
 
+    def _state_key(self, session: Session, actions: List[Dict]) -> Optional[Tuple[str, str]]:
+        """动作列表正是会话当前状态的动作时返回 (流程名, 状态ID)，供动作执行器缓存流水线"""
+        flow_name = session.get("active_flow_name")
+        flow = self.flows.get(flow_name) if flow_name else None
+        state = flow.get_state(session.current_state_id) if flow else None
+        if state is not None and state.get("actions") is actions:
+            return flow_name, session.current_state_id
+        return None
+
     def _activate_flow(self, session: Session, flow_name: str) -> Tuple[List[Dict], Interpreter]:
         """激活指定流程并返回入口动作和解释器"""
         session.set("active_flow_name", flow_name)
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from typing import Optional
+
+# 自定义纪元：2024-01-01 00:00:00 UTC（毫秒）
+_EPOCH_MS = 1704067200000
+_TIMESTAMP_BITS = 41
+_WORKER_BITS = 5
+_SEQUENCE_BITS = 10
+_WORKER_MASK = (1 << _WORKER_BITS) - 1
+_SEQUENCE_MASK = (1 << _SEQUENCE_BITS) - 1
+_TIMESTAMP_MASK = (1 << _TIMESTAMP_BITS) - 1
+# 可分配的 worker 号数量（0 ~ MAX_WORKERS - 1）
+MAX_WORKERS = 1 << _WORKER_BITS
+
+_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# 56 位整数用 11 位 36 进制即可表示（36^11 > 2^56），定长保证字典序与生成顺序一致
+ID_WIDTH = 11
+
+
+def _to_base36(value: int, width: int) -> str:
+    chars = []
+    while value:
+        value, rem = divmod(value, 36)
+        chars.append(_ALPHABET[rem])
+    return "".join(reversed(chars)).rjust(width, "0")
+
+
+class IdGenerator:
+    """
+    单调递增的业务ID生成器（Snowflake 风格）
+
+    ID 由毫秒时间戳、worker 号和毫秒内序列号组成，编码为定长 36 进制字符串。
+    同一进程内严格递增、不会重复；同一毫秒内序列号用尽或系统时钟回拨时，
+    沿用上一时间戳继续递增，而不是等待时钟。
+
+    多个进程同时写同一个数据库时，各进程必须使用不同的 worker 号：
+    服务器启动时通过 DatabaseManager.claim_id_worker 租用后调用 set_worker_id。
+    未指定时由进程号推导，只适用于单进程（测试、命令行脚本）。
+    """
+
+    def __init__(self, worker_id: Optional[int] = None):
+        """
+        Args:
+            worker_id: 0~31 的 worker 号，为None时由进程号推导
+        """
+        self._fixed_worker_id = self._check_worker_id(worker_id)
+        self._pid = os.getpid()
+        self.worker_id = self._resolve_worker_id()
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    @staticmethod
+    def _check_worker_id(worker_id: Optional[int]) -> Optional[int]:
+        if worker_id is not None and not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError(f"worker_id 必须在 0~{MAX_WORKERS - 1} 之间，实际为 {worker_id}")
+        return worker_id
+
+    def _resolve_worker_id(self) -> int:
+        if self._fixed_worker_id is not None:
+            return self._fixed_worker_id
+        return os.getpid() & _WORKER_MASK
+
+    def set_worker_id(self, worker_id: int):
+        """使用分配到的 worker 号（之后生成的ID仍保持递增）"""
+        worker_id = self._check_worker_id(worker_id)
+        with self._lock:
+            self._fixed_worker_id = worker_id
+            if worker_id != self.worker_id and self._last_ms >= 0:
+                # worker 号变小时同一毫秒内的ID会倒退，改从下一毫秒开始
+                self._last_ms += 1
+                self._sequence = -1
+            self.worker_id = worker_id
+
+    def next_int(self) -> int:
+        """生成下一个整数ID"""
+        with self._lock:
+            if os.getpid() != self._pid:
+                # fork 出的子进程继承了父进程状态；分配给父进程的 worker 号不能沿用，
+                # 子进程需要自行租用，在此之前按进程号推导
+                self._pid = os.getpid()
+                self._fixed_worker_id = None
+                self.worker_id = self._resolve_worker_id()
+                self._last_ms = -1
+                self._sequence = 0
+
+            now_ms = int(time.time() * 1000) - _EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                self._sequence += 1
+                if self._sequence > _SEQUENCE_MASK:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (((self._last_ms & _TIMESTAMP_MASK) << (_WORKER_BITS + _SEQUENCE_BITS))
+                    | (self.worker_id << _SEQUENCE_BITS)
+                    | self._sequence)
+
+    def next_id(self, prefix: str = "") -> str:
+        """生成带前缀的字符串ID，例如 next_id("R") -> "R0C2HQ3Z81K0" """
+        return prefix + _to_base36(self.next_int(), ID_WIDTH)
+
+
+_default_generator = IdGenerator()
+
+
+def generate_id(prefix: str = "") -> str:
+    """使用进程内默认生成器生成ID"""
+    return _default_generator.next_id(prefix)
+
+
+def set_worker_id(worker_id: int):
+    """设置进程内默认生成器的 worker 号"""
+    _default_generator.set_worker_id(worker_id)
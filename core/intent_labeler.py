@@ -0,0 +1,417 @@
+"""
+离线批量意图标注：从对话日志中挖掘规则未命中的用户输入
+
+流式读取 JSONL 对话语料，在进程池中对每条用户输入依次执行
+Chatbot._try_rule_based_trigger（流程入口的 regex 触发器）和本地降级分类器
+（LLMResponder._fallback_intent_recognition）。规则未命中的输入按分类器给出的流程分组，
+组内按字符 bigram 相似度聚类，并为每个簇给出可直接加入 DSL triggers 的 regex 建议，
+这类输入加上触发器后就不再需要调用 LLM。
+
+内存占用与语料大小无关：
+- 主进程逐行读取，按批提交，同时在途的批数有上限
+- 工作进程只返回规则未命中的输入
+- 每个流程只保留出现次数最多的 max_utterances 条不同输入（近似 Top-K）
+
+用法：
+    python -m core.intent_labeler logs/conversations.jsonl --workers 8 --output report.json
+
+语料每行一个 JSON 对象，支持以下格式：
+    {"content": "..."}                                  客户端发送的 message 请求
+    {"user_input": "..."} 或 {"text": "..."}
+    {"messages": [{"role": "user", "content": "..."}]}  整段对话，只取用户消息
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from core.chatbot import Chatbot
+from dsl.dsl_parser import ChatFlow
+from llm.llm_responder import LLMResponder
+
+# 降级分类器的意图 -> 流程（与 Chatbot._try_llm_based_trigger 的关键词映射一致）
+FALLBACK_INTENT_FLOWS = {
+    "产品咨询": "售前产品咨询流程",
+    "订单查询": "售中订单管理流程",
+    "退款退货": "标准退款流程",
+    "发票申请": "发票服务流程",
+    "故障报修": "设备故障排查流程",
+    "闲聊问候": "通用闲聊流程",
+}
+
+# 分类器也无法判断的输入归入该组
+UNLABELED = "未知"
+
+# 单条输入的最大长度，超出部分截断（日志中偶有粘贴的大段文本）
+MAX_UTTERANCE_CHARS = 200
+
+
+def extract_utterances(record: Any) -> List[str]:
+    """从一行语料中取出用户输入"""
+    if isinstance(record, str):
+        texts = [record]
+    elif not isinstance(record, dict):
+        return []
+    elif isinstance(record.get("messages"), list):
+        texts = [m.get("content") for m in record["messages"]
+                 if isinstance(m, dict) and m.get("role", "user") == "user"]
+    elif record.get("type", "message") != "message":
+        return []
+    else:
+        texts = [record.get("content") or record.get("user_input") or record.get("text")]
+
+    utterances = []
+    for text in texts:
+        if isinstance(text, str):
+            text = " ".join(text.split())[:MAX_UTTERANCE_CHARS]
+            if text:
+                utterances.append(text)
+    return utterances
+
+
+def label_utterance(chatbot: Chatbot, text: str) -> Tuple[str, Optional[str]]:
+    """返回 (来源, 流程名)；来源为 rule / fallback，分类器也无法判断时流程名为None"""
+    flow_name = chatbot._try_rule_based_trigger(text)
+    if flow_name:
+        return "rule", flow_name
+    intent = LLMResponder._fallback_intent_recognition(text).get("intent")
+    flow_name = FALLBACK_INTENT_FLOWS.get(intent)
+    return "fallback", flow_name if flow_name in chatbot.flows else None
+
+
+def label_lines(chatbot: Chatbot, lines: List[str]) -> Dict[str, Any]:
+    """
+    标注一批语料行
+
+    Returns:
+        {"utterances": 总数, "invalid_lines": 无法解析的行数,
+         "rule_matched": {流程: 次数}, "unmatched": [(分组, 输入), ...]}
+    """
+    result = {"utterances": 0, "invalid_lines": 0, "rule_matched": Counter(), "unmatched": []}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            result["invalid_lines"] += 1
+            continue
+        for text in extract_utterances(record):
+            result["utterances"] += 1
+            source, flow_name = label_utterance(chatbot, text)
+            if source == "rule":
+                result["rule_matched"][flow_name] += 1
+            else:
+                result["unmatched"].append((flow_name or UNLABELED, text))
+    return result
+
+
+def rule_matcher(flows: Dict[str, ChatFlow]) -> Chatbot:
+    """
+    只用于 _try_rule_based_trigger 的 Chatbot
+
+    规则匹配只读取流程入口的触发器，不创建解释器和数据库连接
+    （多个工作进程同时初始化数据库会竞争同一个 SQLite 文件的建表/迁移）
+    """
+    chatbot = Chatbot.__new__(Chatbot)
+    chatbot.flows = flows
+    return chatbot
+
+
+# 工作进程内的规则匹配器，由 _init_worker 创建
+_worker_chatbot: Optional[Chatbot] = None
+
+
+def _init_worker(flows: Dict[str, ChatFlow]):
+    global _worker_chatbot
+    # 规则匹配与降级分类器每条输入都会打印调试日志，批处理时丢弃
+    sys.stdout = open(os.devnull, "w")
+    _worker_chatbot = rule_matcher(flows)
+
+
+def _label_lines_in_worker(lines: List[str]) -> Dict[str, Any]:
+    return label_lines(_worker_chatbot, lines)
+
+
+class TopUtterances:
+    """
+    近似 Top-K 计数：不同输入超过 2*capacity 条时只保留计数最高的 capacity 条
+
+    高频输入的计数是准确的；低频输入可能被淘汰，后续再出现时从 1 重新计数。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Counter = Counter()
+        self.total = 0
+
+    def add(self, text: str, count: int = 1):
+        self.total += count
+        self.counts[text] += count
+        if len(self.counts) > 2 * self.capacity:
+            self.counts = Counter(dict(self.counts.most_common(self.capacity)))
+
+    def most_common(self) -> List[Tuple[str, int]]:
+        return self.counts.most_common(self.capacity)
+
+
+def _shingles(text: str) -> Set[str]:
+    """字符 bigram 集合（单字输入退化为字符集合）"""
+    text = text.lower()
+    return {text[i:i + 2] for i in range(len(text) - 1)} or set(text)
+
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    """重叠系数 |A∩B| / min(|A|,|B|)：短句加了语气词、主语时仍能与原句归为一类"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def cluster_utterances(items: List[Tuple[str, int]], threshold: float = 0.5) -> List[List[Tuple[str, int]]]:
+    """
+    按相似度贪心聚类：按出现次数从高到低，加入第一个与簇首相似度达到阈值的簇，否则新建簇
+
+    Returns:
+        簇列表（按总次数降序），每个簇为 [(输入, 次数), ...]，首项为簇首
+    """
+    clusters: List[Tuple[Set[str], List[Tuple[str, int]]]] = []
+    for text, count in sorted(items, key=lambda item: -item[1]):
+        shingles = _shingles(text)
+        for leader, members in clusters:
+            if _similarity(shingles, leader) >= threshold:
+                members.append((text, count))
+                break
+        else:
+            clusters.append((shingles, [(text, count)]))
+    return sorted((members for _, members in clusters), key=lambda members: -sum(c for _, c in members))
+
+
+# 建议触发词中不应出现的字符：标点、空白与纯数字（订单号等）
+_NOISE_PATTERN = re.compile(r"[\s\d\W_]")
+
+
+def _grams(text: str) -> Set[str]:
+    """候选触发片段：2~4 个字符、不含标点/空白/数字的子串"""
+    lowered = text.lower()
+    return {
+        lowered[i:i + n]
+        for n in (2, 3, 4) for i in range(len(lowered) - n + 1)
+        if not _NOISE_PATTERN.search(lowered[i:i + n])
+    }
+
+
+def suggest_pattern(members: List[Tuple[str, int]], group_grams: Optional[Counter] = None,
+                    background: Optional[Counter] = None, min_coverage: float = 0.5,
+                    max_alternatives: int = 4) -> Optional[Tuple[str, float]]:
+    """
+    为一个簇建议 regex 触发器
+
+    贪心选择覆盖未覆盖成员（按次数加权）最多的字符片段，直到覆盖率达到 80%
+    或达到 max_alternatives 个候选，生成 ".*(片段1|片段2).*"。覆盖相同时优先选择
+    在本分组（group_grams）中常见、在其他分组（background）中少见的片段，再优先更长的片段。
+
+    Returns:
+        (pattern, 覆盖率)；覆盖率低于 min_coverage 时返回None
+    """
+    group_grams = group_grams or Counter()
+    background = background or Counter()
+    total = sum(count for _, count in members)
+    grams: Dict[str, Set[int]] = {}
+    for index, (text, _) in enumerate(members):
+        for gram in _grams(text):
+            grams.setdefault(gram, set()).add(index)
+
+    chosen: List[str] = []
+    covered: Set[int] = set()
+    while grams and len(chosen) < max_alternatives and \
+            sum(members[i][1] for i in covered) < 0.8 * total:
+        def gain(item):
+            gram, indexes = item
+            return (sum(members[i][1] for i in indexes - covered),
+                    group_grams[gram] - background[gram], len(gram))
+
+        gram, indexes = max(grams.items(), key=gain)
+        if gain((gram, indexes))[0] == 0:
+            break
+        chosen.append(gram)
+        covered |= indexes
+        del grams[gram]
+
+    coverage = sum(members[i][1] for i in covered) / total if total else 0.0
+    if not chosen or coverage < min_coverage:
+        return None
+    return ".*(" + "|".join(re.escape(gram) for gram in chosen) + ").*", round(coverage, 3)
+
+
+class IntentMiningReport:
+    """汇总各批次的标注结果，生成按流程分组的聚类报告"""
+
+    def __init__(self, max_utterances: int = 2000, max_clusters: int = 20, examples: int = 5):
+        self.max_utterances = max_utterances
+        self.max_clusters = max_clusters
+        self.examples = examples
+        self.utterances = 0
+        self.invalid_lines = 0
+        self.rule_matched: Counter = Counter()
+        self.unmatched: Dict[str, TopUtterances] = {}
+
+    def add(self, result: Dict[str, Any]):
+        self.utterances += result["utterances"]
+        self.invalid_lines += result["invalid_lines"]
+        self.rule_matched.update(result["rule_matched"])
+        for group, text in result["unmatched"]:
+            if group not in self.unmatched:
+                self.unmatched[group] = TopUtterances(self.max_utterances)
+            self.unmatched[group].add(text)
+
+    def to_dict(self) -> Dict[str, Any]:
+        retained = {group: top.most_common() for group, top in self.unmatched.items()}
+        # 各分组的候选片段出现次数，用于优先选择只在本分组出现的片段
+        group_grams = {group: Counter() for group in retained}
+        for group, items in retained.items():
+            for text, count in items:
+                for gram in _grams(text):
+                    group_grams[group][gram] += count
+        all_grams = sum(group_grams.values(), Counter())
+
+        flows = {}
+        for group, items in sorted(retained.items(), key=lambda kv: -self.unmatched[kv[0]].total):
+            background = all_grams - group_grams[group]
+            clusters = []
+            for members in cluster_utterances(items)[:self.max_clusters]:
+                suggestion = suggest_pattern(members, group_grams[group], background)
+                cluster = {
+                    "size": sum(count for _, count in members),
+                    "distinct": len(members),
+                    "examples": [text for text, _ in members[:self.examples]],
+                    "suggested_trigger": None,
+                }
+                if suggestion:
+                    pattern, coverage = suggestion
+                    cluster["suggested_trigger"] = {
+                        "type": "regex",
+                        "value": pattern,
+                        "coverage": coverage,
+                        # 建议的触发器在其他分组的输入中的命中次数，过高说明过于宽泛
+                        "conflicts": self._count_conflicts(pattern, group, retained),
+                    }
+                clusters.append(cluster)
+            flows[group] = {"unmatched": self.unmatched[group].total, "clusters": clusters}
+
+        unmatched_total = sum(top.total for top in self.unmatched.values())
+        return {
+            "utterances": self.utterances,
+            "invalid_lines": self.invalid_lines,
+            "rule_matched": sum(self.rule_matched.values()),
+            "rule_hit_rate": round(sum(self.rule_matched.values()) / self.utterances, 4) if self.utterances else 0.0,
+            "rule_matched_by_flow": dict(self.rule_matched.most_common()),
+            "unmatched": unmatched_total,
+            "flows": flows,
+        }
+
+    @staticmethod
+    def _count_conflicts(pattern: str, group: str, retained: Dict[str, List[Tuple[str, int]]]) -> int:
+        regex = re.compile(pattern, re.IGNORECASE)
+        return sum(count for other, items in retained.items() if other != group
+                   for text, count in items if regex.search(text))
+
+
+def _read_batches(corpus_path: str, batch_size: int) -> Iterator[List[str]]:
+    with open(corpus_path, "r", encoding="utf-8-sig") as f:
+        batch: List[str] = []
+        for line in f:
+            if line.strip():
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def label_corpus(corpus_path: str, flows_dir: str = "dsl/flows", workers: Optional[int] = None,
+                 batch_size: int = 1000, max_utterances: int = 2000) -> IntentMiningReport:
+    """
+    标注整个语料文件
+
+    Args:
+        workers: 工作进程数，默认 CPU 核数；0 表示在当前进程中处理
+        batch_size: 每批提交的语料行数
+        max_utterances: 每个流程保留的不同输入条数上限
+    """
+    report = IntentMiningReport(max_utterances=max_utterances)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        flows = Chatbot._load_flows(flows_dir)
+    if not flows:
+        raise ValueError(f"未找到任何流程: {flows_dir}")
+    batches = _read_batches(corpus_path, batch_size)
+
+    pool = None
+    if workers > 0:
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(flows,))
+        except (OSError, NotImplementedError) as e:
+            print(f"[意图挖掘] 无法创建进程池，改为当前进程处理: {e}")
+
+    if pool is None:
+        chatbot = rule_matcher(flows)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for batch in batches:
+                report.add(label_lines(chatbot, batch))
+        return report
+
+    # 同时在途的批数有上限，读取速度不会超过处理速度
+    max_pending = workers * 2
+    pending: Dict[Future, List[str]] = {}
+    try:
+        for batch in batches:
+            pending[pool.submit(_label_lines_in_worker, batch)] = batch
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    report.add(future.result())
+        for future in list(pending):
+            report.add(future.result())
+    except BrokenProcessPool:
+        raise RuntimeError("意图挖掘工作进程异常退出") from None
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量意图标注：挖掘规则未命中的用户输入并建议触发器")
+    parser.add_argument("corpus", help="JSONL 对话语料")
+    parser.add_argument("--flows", default="dsl/flows", help="DSL 流程目录")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认 CPU 核数，0 表示不使用进程池")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每批提交的语料行数")
+    parser.add_argument("--max-utterances", type=int, default=2000, help="每个流程保留的不同输入条数上限")
+    parser.add_argument("--output", help="报告输出文件（JSON），默认输出到标准输出")
+    args = parser.parse_args()
+
+    report = label_corpus(args.corpus, flows_dir=args.flows, workers=args.workers,
+                          batch_size=args.batch_size, max_utterances=args.max_utterances).to_dict()
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if not args.output:
+        print(text)
+        return
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(text)
+    print(f"[意图挖掘] 共 {report['utterances']} 条输入，规则命中率 {report['rule_hit_rate']:.1%}，"
+          f"未命中 {report['unmatched']} 条")
+    for group, info in report["flows"].items():
+        print(f"  - {group}: 未命中 {info['unmatched']} 条，{len(info['clusters'])} 个簇")
+    print(f"[意图挖掘] 报告已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+一次性迁移：将旧版本数据库中以明文存储的密码替换为加盐哈希
+
+每个明文密码都要计算一次 PBKDF2（约 0.1 秒 CPU），因此不在打开数据库时执行，
+而是在升级部署时运行一次。未迁移的明文密码仍可登录，并在登录成功时被升级。
+
+用法：
+    python -m core.migrate_passwords --db data/chatbot.db
+"""
+
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.database_manager import DatabaseManager
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="将明文密码迁移为加盐哈希")
+    parser.add_argument("--db", default="data/chatbot.db", help="SQLite 数据库文件")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"[密码迁移] 数据库文件不存在: {args.db}")
+        return 1
+    migrated = DatabaseManager(db_path=args.db).migrate_plaintext_passwords()
+    print(f"[密码迁移] {args.db}: 迁移 {migrated} 个明文密码")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
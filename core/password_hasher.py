@@ -0,0 +1,162 @@
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+ALGORITHM = "pbkdf2_sha256"
+# PBKDF2-SHA256 迭代次数（OWASP 推荐值），单次计算约 0.1 秒 CPU
+DEFAULT_ITERATIONS = 310000
+_SALT_BYTES = 16
+# 用户不存在时参与校验的占位哈希（迭代次数与真实哈希相同，任何密码都不匹配），
+# 使"用户名不存在"与"密码错误"耗时一致，无法通过响应时间枚举用户名
+DUMMY_PASSWORD_HASH = "$".join((
+    ALGORITHM,
+    str(DEFAULT_ITERATIONS),
+    base64.b64encode(bytes(_SALT_BYTES)).decode("ascii"),
+    base64.b64encode(bytes(32)).decode("ascii"),
+))
+
+
+def hash_password(password: str, iterations: int = DEFAULT_ITERATIONS, salt: Optional[bytes] = None) -> str:
+    """
+    计算加盐密码哈希
+
+    Returns:
+        "pbkdf2_sha256$<迭代次数>$<盐>$<哈希>" 格式的字符串（盐与哈希为 base64）
+    """
+    salt = salt or os.urandom(_SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "$".join((
+        ALGORITHM,
+        str(iterations),
+        base64.b64encode(salt).decode("ascii"),
+        base64.b64encode(digest).decode("ascii"),
+    ))
+
+
+def is_password_hash(stored: Optional[str]) -> bool:
+    """判断数据库中的密码字段是否已经是哈希（否则为迁移前的明文）"""
+    return bool(stored) and stored.startswith(ALGORITHM + "$")
+
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    """校验密码，兼容迁移前的明文密码；比较均为常量时间"""
+    if not stored:
+        return False
+    if not is_password_hash(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    try:
+        _, iterations, salt, expected = stored.split("$")
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"),
+                                     base64.b64decode(salt), int(iterations))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+def needs_rehash(stored: Optional[str], iterations: int = DEFAULT_ITERATIONS) -> bool:
+    """明文密码或迭代次数低于当前设置的哈希需要重新计算"""
+    if not is_password_hash(stored):
+        return True
+    try:
+        return int(stored.split("$")[1]) < iterations
+    except (IndexError, ValueError):
+        return True
+
+
+class PasswordVerifier:
+    """
+    密码哈希计算器
+
+    PBKDF2 刻意消耗大量 CPU，登录高峰时若在会话线程中直接计算会拖慢所有聊天线程。
+    这里把计算交给固定大小的进程池，可利用多核；同时用信号量限制排队中的任务数，
+    超出时调用方阻塞等待，避免无限堆积。进程池不可用时退回当前线程计算。
+
+    服务器是多线程进程，fork 会把其他线程持有的锁一并复制到子进程中造成死锁，
+    因此工作进程用 forkserver（不支持时用 spawn）启动。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        """
+        Args:
+            max_workers: 进程数，默认 min(4, CPU核数)
+            max_pending: 同时提交（含执行中）的最大任务数，默认 max_workers * 4
+        """
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._slots = threading.BoundedSemaphore(max_pending or self.max_workers * 4)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        with self._pool_lock:
+            if self._pool is None:
+                try:
+                    self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context())
+                except (OSError, NotImplementedError) as e:
+                    print(f"[PasswordVerifier] 无法创建进程池，改为线程内计算: {e}")
+                    return None
+            return self._pool
+
+    def _run(self, func, *args):
+        with self._slots:
+            pool = self._get_pool()
+            if pool is None:
+                return func(*args)
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                # 工作进程异常退出：丢弃进程池，下次调用时重建
+                with self._pool_lock:
+                    self._pool = None
+                return func(*args)
+
+    def verify(self, password: str, stored: Optional[str]) -> bool:
+        """校验密码；迁移前的明文密码比较很廉价，不经过进程池"""
+        if not is_password_hash(stored):
+            return verify_password(password, stored)
+        return self._run(verify_password, password, stored)
+
+    def hash(self, password: str) -> str:
+        """在进程池中计算新密码哈希"""
+        return self._run(hash_password, password)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+
+
+def _pool_context():
+    """不使用 fork 的进程启动方式"""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+_default_verifier: Optional[PasswordVerifier] = None
+_default_lock = threading.Lock()
+
+
+def get_password_verifier() -> PasswordVerifier:
+    """进程内共享的密码计算器"""
+    global _default_verifier
+    with _default_lock:
+        if _default_verifier is None:
+            _default_verifier = PasswordVerifier()
+        return _default_verifier
+
+
+def configure_password_verifier(max_workers: Optional[int] = None,
+                                max_pending: Optional[int] = None) -> PasswordVerifier:
+    """按配置替换共享的密码计算器（服务器启动时调用）"""
+    global _default_verifier
+    with _default_lock:
+        if _default_verifier is not None:
+            _default_verifier.shutdown()
+        _default_verifier = PasswordVerifier(max_workers=max_workers, max_pending=max_pending)
+        return _default_verifier
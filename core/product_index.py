@@ -0,0 +1,93 @@
+import re
+from typing import Any, Dict, List, Optional
+
+_PRICE_TOKEN_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+_NUMBER_PATTERN = re.compile(r"\d+")
+_WORD_PATTERN = re.compile(r"[\u4e00-\u9fa5A-Za-z0-9]+")
+
+
+class ProductSelectionIndex:
+    """
+    搜索结果选择索引
+
+    在搜索结果写入会话时构建一次，之后根据用户的自然语言描述
+    （价格、名称中的编号、序号、名称关键字）选择商品只需几次字典查找。
+
+    选择顺序与平局规则与逐条扫描的实现保持一致：
+    1. 价格精确匹配（如“2419.0 的那款”）
+    2. 数字出现在商品名称中（如“平板电脑 12”）
+    3. 数字作为序号（如“第 2 个”）
+    4. 整数价格匹配
+    5. 名称关键字得分最高者，同分时取排在前面的商品
+    """
+
+    def __init__(self, results: List[Dict[str, Any]]):
+        self.results = results
+        # 价格 -> 第一个该价格商品的下标
+        self._by_price: Dict[float, int] = {}
+        # 名称中数字串的任意子串 -> 第一个包含它的商品下标
+        self._by_name_number: Dict[str, int] = {}
+        # 小写名称的任意子串 -> 包含它的商品下标列表（升序）
+        self._by_name_substring: Dict[str, List[int]] = {}
+
+        for idx, product in enumerate(results):
+            price = product.get("price")
+            if price is not None:
+                try:
+                    self._by_price.setdefault(float(price), idx)
+                except (TypeError, ValueError):
+                    pass
+
+            name = str(product.get("name", "") or "")
+            for run in _NUMBER_PATTERN.findall(name):
+                for start in range(len(run)):
+                    for end in range(start + 1, len(run) + 1):
+                        self._by_name_number.setdefault(run[start:end], idx)
+
+            name_lower = name.lower()
+            seen = set()
+            for start in range(len(name_lower)):
+                for end in range(start + 1, len(name_lower) + 1):
+                    substring = name_lower[start:end]
+                    if substring not in seen:
+                        seen.add(substring)
+                        self._by_name_substring.setdefault(substring, []).append(idx)
+
+    def select(self, text: str) -> Optional[Dict[str, Any]]:
+        """根据用户输入选择商品，未命中时返回None"""
+        # 0) 优先尝试根据价格精确匹配，避免“小数点后的 0”干扰编号匹配
+        for token in _PRICE_TOKEN_PATTERN.findall(text):
+            idx = self._by_price.get(float(token))
+            if idx is not None:
+                return self.results[idx]
+
+        numbers = _NUMBER_PATTERN.findall(text)
+        if numbers:
+            # 1.1 数字出现在商品名称中
+            for num in numbers:
+                idx = self._by_name_number.get(num)
+                if idx is not None:
+                    return self.results[idx]
+
+            # 1.2 “第 N 个”/“编号 N” 理解为序号
+            for num in numbers:
+                idx = int(num) - 1
+                if 0 <= idx < len(self.results):
+                    return self.results[idx]
+
+            # 1.3 整数价格匹配
+            for num in numbers:
+                idx = self._by_price.get(float(num))
+                if idx is not None:
+                    return self.results[idx]
+
+        # 2) 根据商品名称关键字打分，去掉纯数字 token 避免与序号逻辑重复
+        tokens = [t for t in _WORD_PATTERN.findall(text.lower()) if not t.isdigit()]
+        scores: Dict[int, int] = {}
+        for token in tokens:
+            for idx in self._by_name_substring.get(token, ()):
+                scores[idx] = scores.get(idx, 0) + len(token)
+        if scores:
+            best = min(scores, key=lambda i: (-scores[i], i))
+            return self.results[best]
+        return None
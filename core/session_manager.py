@@ -1,23 +1,109 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, Optional
 import uuid
 import threading
 import time
 
+
+class VariableStore(dict):
+    """
+    带版本号的会话变量字典
+
+    每次写入或删除某个键时递增该键的版本号，
+    供派生数据（如显示文本）判断源变量是否发生变化。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._versions: Dict[str, int] = {}
+
+    def version(self, key: str) -> int:
+        """返回变量的当前版本号，从未写入过的变量为0"""
+        return self._versions.get(key, 0)
+
+    def _bump(self, key: str):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def __setitem__(self, key: str, value: Any):
+        super().__setitem__(key, value)
+        self._bump(key)
+
+    def __delitem__(self, key: str):
+        super().__delitem__(key)
+        self._bump(key)
+
+    def pop(self, key: str, *args):
+        if key in self:
+            self._bump(key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._bump(key)
+        return key, value
+
+    def setdefault(self, key: str, default: Any = None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self.keys()):
+            self._bump(key)
+        super().clear()
+
+
 class Session:
     """Represents a single conversation session."""
     def __init__(self, session_id: str, user_id: Optional[str] = None):
         self.session_id = session_id
         self.user_id = user_id  # 关联的用户ID
-        self.current_state_id: Optional[str] = None
-        self.variables: Dict[str, Any] = {}
+        self._current_state_id: Optional[str] = None
+        # 当前状态在所属流程中的编号（由 Interpreter 维护），仅对 _state_flow 有效
+        self._state_flow: Any = None
+        self._state_index: int = -1
+        self.variables: VariableStore = VariableStore()
         self.last_user_input: Optional[str] = None
+        # 客户端为当前消息生成的请求ID，重发同一消息时保持不变，用于写动作幂等
+        self.request_id: Optional[str] = None
         # 保存最近若干轮用户输入，用于LLM意图识别的上下文
         self.user_history: list[str] = []
         self.created_at: float = time.time()  # 会话创建时间
         self.last_active: float = time.time()  # 最后活跃时间
 
+    @property
+    def current_state_id(self) -> Optional[str]:
+        return self._current_state_id
+
+    @current_state_id.setter
+    def current_state_id(self, state_id: Optional[str]):
+        # 外部按ID设置状态（切换流程、恢复会话等）时，编号在下次使用时重新解析
+        self._current_state_id = state_id
+        self._state_flow = None
+
+    def get_state_index(self, flow) -> int:
+        """当前状态在 flow 中的编号，状态不存在时返回 -1"""
+        if self._state_flow is not flow:
+            self._state_index = flow.state_index(self._current_state_id)
+            self._state_flow = flow
+        return self._state_index
+
+    def set_state_index(self, flow, index: int):
+        """按编号设置当前状态（index 必须是 flow 中存在的状态）"""
+        self._current_state_id = flow.state_id_at(index)
+        self._state_flow = flow
+        self._state_index = index
+
     def get(self, key: str, default: Any = None) -> Any:
-        return self.__dict__.get(key, default)
+        if key in self.__dict__:
+            return self.__dict__[key]
+        # current_state_id 等属性不在实例字典中
+        if isinstance(getattr(type(self), key, None), property):
+            return getattr(self, key)
+        return default
 
     def set(self, key: str, value: Any):
         self.__setattr__(key, value)
@@ -92,6 +178,36 @@ class SessionManager:
                     session.user_id = user_id
             return self._sessions[session_id]
 
+    def find_session(self, session_id: str) -> Optional[Session]:
+        """
+        查找已有会话（线程安全），不存在时返回None而不是新建
+
+        Args:
+            session_id: 会话ID
+        """
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def clear_user_sessions(self, user_id: str, session_ids: Iterable[str]) -> int:
+        """
+        删除属于指定用户的指定会话（线程安全），用于断线重连时立即回收被替换的会话
+
+        Args:
+            user_id: 用户ID，不属于该用户的会话不会被删除
+            session_ids: 要删除的会话ID
+
+        Returns:
+            删除的会话数量
+        """
+        with self._lock:
+            stale_ids = [
+                sid for sid in set(session_ids)
+                if sid in self._sessions and self._sessions[sid].user_id == user_id
+            ]
+            for sid in stale_ids:
+                del self._sessions[sid]
+            return len(stale_ids)
+
     def create_session(self) -> Session:
         """
         创建新会话（线程安全）
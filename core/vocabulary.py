@@ -0,0 +1,70 @@
+from typing import Dict, Iterable, List, Optional
+
+
+class KeywordTrie:
+    """
+    关键词自动机（Aho-Corasick）
+
+    一次扫描文本即可找出其中出现的最长词表词，扫描耗时只与文本长度相关，
+    与词表大小无关。匹配不区分英文大小写，返回词表中的原始写法。
+    """
+
+    def __init__(self, terms: Iterable[str] = ()):
+        self._children: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 以该节点结尾的最长词（含失败链上的后缀词）
+        self._output: List[Optional[str]] = [None]
+        self._size = 0
+        for term in terms:
+            self._add(term)
+        self._build()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _add(self, term: str):
+        term = (term or "").strip()
+        if not term:
+            return
+        node = 0
+        for ch in term.lower():
+            next_node = self._children[node].get(ch)
+            if next_node is None:
+                next_node = len(self._children)
+                self._children.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._children[node][ch] = next_node
+            node = next_node
+        if self._output[node] is None:
+            self._size += 1
+        self._output[node] = term
+
+    def _build(self):
+        """按广度优先构建失败指针，并沿失败链继承最长输出"""
+        queue = list(self._children[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._children[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._children[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._children[fail].get(ch, 0)
+                if self._output[child] is None:
+                    self._output[child] = self._output[self._fail[child]]
+                queue.append(child)
+
+    def longest_match(self, text: str) -> Optional[str]:
+        """返回文本中出现的最长词表词，长度相同时取最先出现的"""
+        best: Optional[str] = None
+        node = 0
+        for ch in (text or "").lower():
+            while node and ch not in self._children[node]:
+                node = self._fail[node]
+            node = self._children[node].get(ch, 0)
+            term = self._output[node]
+            if term is not None and (best is None or len(term) > len(best)):
+                best = term
+        return best
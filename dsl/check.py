@@ -0,0 +1,257 @@
+"""
+DSL 流程静态检查
+
+为每个 ChatFlow 构建状态图，在部署前发现只会在线上对话中暴露的问题：
+- 错误：入口状态不存在、状态ID缺失或重复、转换目标不存在、正则语法错误、未知条件类型
+- 警告：从入口不可达的状态、有转换但没有兜底转换的状态（条件都不满足时只能回复
+  "抱歉，我不知道如何回应。"）
+
+用法：
+    python -m dsl.check dsl/flows
+    python -m dsl.check dsl/flows/after_sales/refund.yaml --strict
+
+存在错误时退出码为 1（--strict 时警告也算失败），可直接放进部署脚本。
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from dsl.dsl_parser import ChatFlow, DslParser
+
+ERROR = "error"
+WARNING = "warning"
+
+# Interpreter._check_single_rule 支持的条件类型
+KNOWN_RULE_TYPES = {"regex", "variable_equals", "variable_exists", "llm_semantic"}
+
+
+class FlowIssue:
+    """一条检查结果"""
+
+    def __init__(self, severity: str, source: str, message: str, state_id: Optional[str] = None):
+        self.severity = severity
+        self.source = source
+        self.message = message
+        self.state_id = state_id
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"severity": self.severity, "source": self.source,
+                "state": self.state_id, "message": self.message}
+
+    def __str__(self) -> str:
+        label = "错误" if self.severity == ERROR else "警告"
+        location = f" 状态 '{self.state_id}'" if self.state_id else ""
+        return f"{label}：{self.source}{location} {self.message}"
+
+
+def build_state_graph(flow: ChatFlow) -> Dict[str, List[str]]:
+    """状态ID -> 按转换顺序排列的目标状态ID（去重，不含缺失的 target）"""
+    graph = {}
+    for state_id in flow.state_ids():
+        targets = []
+        for transition in flow.get_transitions(state_id):
+            target = transition.get("target")
+            if isinstance(target, str) and target not in targets:
+                targets.append(target)
+        graph[state_id] = targets
+    return graph
+
+
+def reachable_states(flow: ChatFlow, graph: Optional[Dict[str, List[str]]] = None) -> Set[str]:
+    """从入口状态出发沿转换可达的状态ID（入口不存在时为空集）"""
+    graph = graph if graph is not None else build_state_graph(flow)
+    if flow.entry_point not in graph:
+        return set()
+    reached = {flow.entry_point}
+    pending = deque([flow.entry_point])
+    while pending:
+        for target in graph[pending.popleft()]:
+            if target in graph and target not in reached:
+                reached.add(target)
+                pending.append(target)
+    return reached
+
+
+def _iter_rules(condition: Any) -> Iterator[Any]:
+    """展开 all/any 组合条件中的单个规则"""
+    if not isinstance(condition, dict):
+        yield condition
+        return
+    for key in ("all", "any"):
+        if key in condition:
+            rules = condition[key]
+            yield from rules if isinstance(rules, list) else [rules]
+            return
+    yield condition
+
+
+def _regex_error(pattern: Any) -> Optional[str]:
+    """正则无法编译时返回错误描述（与运行时一致使用 IGNORECASE）"""
+    if not isinstance(pattern, str):
+        return f"正则必须是字符串，实际为 {type(pattern).__name__}"
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        return f"正则 '{pattern}' 语法错误：{e}"
+    return None
+
+
+def _iter_entries(state: Dict[str, Any], key: str, label: str, report: Callable[..., None],
+                  state_id: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    产出状态中 triggers/actions/transitions 列表的 (序号, 条目)
+
+    字段不是列表或条目不是映射（如 YAML 中误写成字符串）时报告错误并跳过，
+    加载流程时不会因为一个写错的条目而中断
+    """
+    entries = state.get(key)
+    if entries is None:
+        return
+    if not isinstance(entries, list):
+        report(ERROR, f"'{key}' 必须是列表，实际为 {type(entries).__name__}", state_id)
+        return
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            report(ERROR, f"{label} #{number} 必须是映射，实际为 {type(entry).__name__} {entry!r}", state_id)
+            continue
+        yield number, entry
+
+
+def check_flow(flow: ChatFlow, source: Optional[str] = None) -> List[FlowIssue]:
+    """
+    检查单个流程
+
+    Args:
+        flow: ChatFlow实例
+        source: 报告中标识流程的名称，默认使用流程名
+
+    Returns:
+        检查结果列表，错误在前
+    """
+    source = source or f"流程 '{flow.name}'"
+    issues: List[FlowIssue] = []
+
+    def report(severity, message, state_id=None):
+        issues.append(FlowIssue(severity, source, message, state_id))
+
+    seen = set()
+    for index, state in enumerate(flow.states):
+        state_id = state.get("id") if isinstance(state, dict) else None
+        if not isinstance(state_id, str) or not state_id:
+            report(ERROR, f"第 {index + 1} 个状态缺少 'id'")
+        elif state_id in seen:
+            report(ERROR, "状态ID重复，后定义的状态会覆盖前面的", state_id)
+        else:
+            seen.add(state_id)
+
+    if not flow.get_entry_state():
+        report(ERROR, f"入口状态 '{flow.entry_point}' 不存在")
+
+    for state_id in flow.state_ids():
+        state = flow.get_state(state_id)
+
+        for number, trigger in _iter_entries(state, "triggers", "触发器", report, state_id):
+            if trigger.get("type") != "regex":
+                report(WARNING, f"触发器类型 '{trigger.get('type')}' 不受支持，将被忽略", state_id)
+                continue
+            error = _regex_error(trigger.get("value", ""))
+            if error:
+                report(ERROR, f"触发器{error}", state_id)
+        if state.get("triggers") and state_id != flow.entry_point:
+            report(WARNING, "只有入口状态的触发器会生效", state_id)
+
+        for number, action in _iter_entries(state, "actions", "动作", report, state_id):
+            if action.get("type") == "extract_variable" and "regex" in action:
+                error = _regex_error(action["regex"])
+                if error:
+                    report(ERROR, f"extract_variable {error}", state_id)
+
+        transitions = flow.get_transitions(state_id)
+        for number, transition in _iter_entries(state, "transitions", "转换", report, state_id):
+            target = transition.get("target")
+            if not target:
+                report(ERROR, f"转换 #{number} 缺少 'target'", state_id)
+            elif flow.get_state(target) is None:
+                report(ERROR, f"转换 #{number} 的目标状态 '{target}' 不存在", state_id)
+
+            if "condition" not in transition:
+                continue
+            for rule in _iter_rules(transition["condition"]):
+                rule_type = rule.get("type") if isinstance(rule, dict) else None
+                if rule_type not in KNOWN_RULE_TYPES:
+                    report(ERROR, f"转换 #{number} 使用了未知条件类型 '{rule_type}'", state_id)
+                elif rule_type == "regex":
+                    error = _regex_error(rule.get("value", ""))
+                    if error:
+                        report(ERROR, f"转换 #{number} 的{error}", state_id)
+
+        if transitions and flow.get_fallback_transition(state_id) is None:
+            report(WARNING, "没有兜底转换，条件都不满足时无法回应", state_id)
+
+    reached = reachable_states(flow)
+    if reached:
+        for state_id in flow.state_ids():
+            if state_id not in reached:
+                report(WARNING, "从入口状态不可达", state_id)
+
+    issues.sort(key=lambda issue: issue.severity != ERROR)
+    return issues
+
+
+def iter_flow_files(paths: List[str]) -> Iterator[str]:
+    """展开目录中的 .yaml 流程文件（按路径排序）"""
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, name) for name in files if name.endswith((".yaml", ".yml")))
+            yield from sorted(found)
+        else:
+            yield path
+
+
+def check_paths(paths: List[str]) -> List[FlowIssue]:
+    """检查文件或目录中的所有流程，包括无法解析的文件与跨文件的重名流程"""
+    issues = []
+    names: Dict[str, str] = {}
+    for file_path in iter_flow_files(paths):
+        # 不用 get_flow：转换目标缺失时它直接拒绝加载，这里要逐条报告
+        data = DslParser(file_path).flow_data
+        if data is None:
+            issues.append(FlowIssue(ERROR, file_path, "无法加载（见上方解析错误）"))
+            continue
+        flow = ChatFlow(data)
+        if flow.name in names:
+            issues.append(FlowIssue(ERROR, file_path,
+                                    f"流程名 '{flow.name}' 与 {names[flow.name]} 重复，加载时会被覆盖"))
+        names.setdefault(flow.name, file_path)
+        issues.extend(check_flow(flow, source=file_path))
+    return issues
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="DSL 流程静态检查")
+    parser.add_argument("paths", nargs="+", help="流程文件或目录")
+    parser.add_argument("--strict", action="store_true", help="警告也视为失败")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    files = list(iter_flow_files(args.paths))
+    issues = check_paths(args.paths)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    for issue in issues:
+        print(issue)
+    errors = sum(1 for issue in issues if issue.severity == ERROR)
+    warnings = len(issues) - errors
+    print(f"[流程检查] {len(files)} 个文件，{errors} 个错误，{warnings} 个警告，耗时 {elapsed_ms:.1f}ms")
+    return 1 if errors or (args.strict and warnings) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,115 @@
 import yaml
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+
+# 状态编号：不存在的状态
+NO_STATE = -1
+
+
+class Transition(NamedTuple):
+    """预解析的转换记录"""
+    target_index: int                      # 目标状态编号，NO_STATE 表示目标不存在
+    has_condition: bool                    # 是否带 condition 字段（不带的是兜底转换）
+    condition: Optional[Dict[str, Any]]
+    data: Dict[str, Any]                   # YAML 中的原始转换
+
+    @property
+    def target(self) -> Optional[str]:
+        return self.data.get("target")
+
+
+def state_transitions(state: Any) -> List[Dict[str, Any]]:
+    """状态中格式正确（是映射）的转换，按定义顺序"""
+    transitions = state.get("transitions") if isinstance(state, dict) else None
+    if not isinstance(transitions, list):
+        return []
+    return [transition for transition in transitions if isinstance(transition, dict)]
+
 
 class ChatFlow:
-    """存储解析后的流程数据"""
+    """
+    存储解析后的流程数据
+
+    加载时编译成按整数编号索引的状态机：状态按定义顺序编号，每个状态的转换是
+    Transition 元组，目标状态编号与兜底转换都预先解析好。对话过程中只做列表下标访问，
+    状态ID字符串只在进出（会话恢复、日志等）时转换。
+    """
     def __init__(self, data: Dict[str, Any]):
         self._data = data
         self.name: str = data.get("name", "Untitled Flow")
         self.entry_point: str = data.get("entry_point")
         self.states: List[Dict[str, Any]] = data.get("states", [])
-        self._states_by_id: Dict[str, Dict[str, Any]] = {state['id']: state for state in self.states if 'id' in state}
+        self._ids: List[Optional[str]] = [state.get("id") if isinstance(state, dict) else None
+                                          for state in self.states]
+        # 状态ID -> 编号（重复ID时后定义的生效）
+        self._index_by_id: Dict[str, int] = {state_id: index for index, state_id in enumerate(self._ids)
+                                             if state_id is not None}
+        # 找不到的转换目标：(所在状态ID, 目标)
+        self.unresolved_targets: List[Tuple[Optional[str], Any]] = []
+        self._transitions: List[Tuple[Transition, ...]] = []
+        self._fallbacks: List[Optional[Transition]] = []
+        for state_id, state in zip(self._ids, self.states):
+            # 不是映射的转换（如误写成字符串）无法匹配，由 dsl.check 报告
+            records = tuple(self._compile_transition(state_id, transition)
+                            for transition in state_transitions(state))
+            self._transitions.append(records)
+            self._fallbacks.append(next((t for t in records if not t.has_condition), None))
+        self.entry_index: int = self.state_index(self.entry_point)
+
+    def _compile_transition(self, state_id: Optional[str], transition: Dict[str, Any]) -> Transition:
+        target = transition.get("target")
+        target_index = self._index_by_id.get(target, NO_STATE) if isinstance(target, str) else NO_STATE
+        if target_index == NO_STATE:
+            self.unresolved_targets.append((state_id, target))
+        return Transition(target_index, "condition" in transition, transition.get("condition"), transition)
+
+    @property
+    def _states_by_id(self) -> Dict[str, Dict[str, Any]]:
+        """状态ID -> 状态（兼容旧接口，对话过程中不使用）"""
+        return {state_id: self.state_at(index) for state_id, index in self._index_by_id.items()}
+
+    def state_index(self, state_id: Optional[str]) -> int:
+        """状态ID对应的编号，不存在时返回 NO_STATE"""
+        return self._index_by_id.get(state_id, NO_STATE) if isinstance(state_id, str) else NO_STATE
+
+    def state_id_at(self, index: int) -> Optional[str]:
+        return self._ids[index]
+
+    def state_at(self, index: int) -> Dict[str, Any]:
+        return self.states[index]
+
+    def transitions_at(self, index: int) -> Tuple[Transition, ...]:
+        """状态的转换记录（按定义顺序）"""
+        return self._transitions[index]
+
+    def fallback_at(self, index: int) -> Optional[Transition]:
+        """状态的兜底转换（第一个不带 condition 的转换）"""
+        return self._fallbacks[index]
 
     def get_state(self, state_id: str) -> Optional[Dict[str, Any]]:
         """根据状态ID获取状态"""
-        return self._states_by_id.get(state_id)
+        index = self.state_index(state_id)
+        return self.state_at(index) if index != NO_STATE else None
+
+    def state_ids(self) -> List[str]:
+        """按定义顺序返回所有状态ID"""
+        return list(self._index_by_id)
+
+    def get_transitions(self, state_id: str) -> List[Dict[str, Any]]:
+        """状态的转换规则（按定义顺序），状态不存在时返回空列表"""
+        index = self.state_index(state_id)
+        return [t.data for t in self.transitions_at(index)] if index != NO_STATE else []
+
+    def get_fallback_transition(self, state_id: str) -> Optional[Dict[str, Any]]:
+        """状态的兜底转换（第一个不带 condition 的转换）"""
+        index = self.state_index(state_id)
+        fallback = self.fallback_at(index) if index != NO_STATE else None
+        return fallback.data if fallback else None
 
     def get_entry_state(self) -> Optional[Dict[str, Any]]:
         """获取流程入口状态"""
-        if not self.entry_point:
+        if self.entry_index == NO_STATE:
             return None
-        return self.get_state(self.entry_point)
+        return self.state_at(self.entry_index)
 
     def __repr__(self) -> str:
         return f"<ChatFlow name='{self.name}' entry='{self.entry_point}' state_count={len(self.states)}>"
@@ -57,10 +148,15 @@ class DslParser:
         return data
 
     def get_flow(self) -> Optional[ChatFlow]:
-        """返回解析后的流程对象"""
-        if self.flow_data:
-            return ChatFlow(self.flow_data)
-        return None
+        """返回解析后的流程对象，转换目标不存在时报错并返回None（避免在对话中途才暴露）"""
+        if not self.flow_data:
+            return None
+        flow = ChatFlow(self.flow_data)
+        if flow.unresolved_targets:
+            for state_id, target in flow.unresolved_targets:
+                print(f"错误：流程 '{flow.name}' 状态 '{state_id}' 的转换目标 '{target}' 不存在")
+            return None
+        return flow
 
 if __name__ == '__main__':
     # 示例用法
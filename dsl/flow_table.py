@@ -0,0 +1,378 @@
+"""
+预编译的只读流程表（多进程 mmap 共享）
+
+多个服务器进程各自解析全部 YAML 流程，启动慢且每个进程一份流程数据。这里把流程目录编译成
+一个紧凑的二进制文件，各进程用只读 mmap 打开，同一文件在操作系统页缓存中只有一份：
+- 字符串池：所有状态ID、流程名，以及状态体/转换的 JSON 文本去重后只存一次
+- 整数状态编号：转换的目标状态在编译时解析成全局状态编号（-1 表示目标不存在），
+  与 ChatFlow 的编号一致（流程内编号 = 全局编号 - 流程首个状态编号）
+- 转换数组：每个状态的转换是连续的一段定长记录，兜底转换的编号也预先算好
+
+启动时只需 mmap 和读取文件头；状态体在首次访问时从 JSON 解码并缓存在当前进程。
+文件头记录流程目录的指纹（文件路径、修改时间与大小的 SHA-1，启动时只 stat 不读取 YAML），
+流程脚本变化后自动重新编译；部署时也可以用下面的命令提前编译。
+
+用法：
+    python -m dsl.flow_table dsl/flows -o data/flows.cft
+
+文件布局（小端序）：
+    文件头 | 字符串偏移[n+1] | 字符串数据 | 流程记录 | 状态记录 | 转换记录
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from dsl.check import ERROR, check_flow
+from dsl.dsl_parser import ChatFlow, DslParser, Transition, state_transitions
+
+MAGIC = b"CFTB"
+FORMAT_VERSION = 1
+
+# magic, 版本, 保留, 指纹, 字符串数, 流程数, 状态数, 转换数, 各段偏移 x5
+HEADER = struct.Struct("<4sHH20sIIIIIIIII")
+# 流程名, 入口状态ID(-1: 无), 首个状态编号, 状态数, 来源文件
+FLOW_RECORD = struct.Struct("<IiIII")
+# 状态ID(-1: 无), 状态体JSON（不含 transitions）, 首个转换编号, 转换数, 兜底转换编号(-1: 无), 是否有 transitions 字段
+STATE_RECORD = struct.Struct("<iIIIiB")
+# 目标状态编号(-1: 不存在), 转换JSON, 是否带 condition 字段
+TRANSITION_RECORD = struct.Struct("<iIB")
+OFFSET = struct.Struct("<I")
+
+NO_INDEX = -1
+
+
+def find_flow_files(flows_dir: str) -> List[str]:
+    """与 Chatbot._load_flows 相同的遍历顺序（决定规则触发时流程的优先级）"""
+    found = []
+    for root, _, files in os.walk(flows_dir):
+        for filename in files:
+            if filename.endswith(".yaml"):
+                found.append(os.path.join(root, filename))
+    return found
+
+
+def flows_fingerprint(flows_dir: str) -> bytes:
+    """流程目录指纹：文件相对路径（按遍历顺序）、修改时间与大小的 SHA-1，只 stat 不读取文件内容"""
+    digest = hashlib.sha1()
+    for file_path in find_flow_files(flows_dir):
+        stat = os.stat(file_path)
+        digest.update(os.path.relpath(file_path, flows_dir).encode("utf-8") + b"\0")
+        digest.update(struct.pack("<qq", stat.st_mtime_ns, stat.st_size))
+    return digest.digest()
+
+
+def _dump(value: Any) -> str:
+    """紧凑且可往返的 JSON；YAML 中的日期等非 JSON 类型直接报错，避免静默改变语义"""
+    text = json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    if json.loads(text) != value:
+        raise ValueError(f"流程数据无法无损编码为JSON: {text[:80]}")
+    return text
+
+
+class _StringPool:
+    """编译时的字符串驻留表"""
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def add(self, text: Optional[str]) -> int:
+        if text is None:
+            return NO_INDEX
+        position = self.index.get(text)
+        if position is None:
+            position = self.index[text] = len(self.strings)
+            self.strings.append(text)
+        return position
+
+
+def build_flow_table(flows: List[Tuple[str, ChatFlow]], fingerprint: bytes = b"") -> bytes:
+    """
+    把流程编译成二进制流程表
+
+    Args:
+        flows: (来源文件, 流程) 列表，按加载顺序排列；同名流程与 Chatbot 一致，后加载的覆盖前面的
+        fingerprint: 流程目录指纹（20字节），用于判断流程表是否过期
+
+    Returns:
+        流程表文件内容
+    """
+    by_name: Dict[str, Tuple[str, ChatFlow]] = {}
+    for source, flow in flows:
+        by_name[flow.name] = (source, flow)
+
+    pool = _StringPool()
+    flow_records, state_records, transition_records = [], [], []
+    for source, flow in by_name.values():
+        first_state = len(state_records)
+        # 状态ID -> 全局状态编号（重复ID与 ChatFlow 一致，后定义的生效）
+        state_index = {}
+        for offset, state in enumerate(flow.states):
+            if isinstance(state, dict) and "id" in state:
+                state_index[state["id"]] = first_state + offset
+
+        for state in flow.states:
+            transitions = state_transitions(state)
+            first_transition = len(transition_records)
+            fallback = NO_INDEX
+            for offset, transition in enumerate(transitions):
+                has_condition = "condition" in transition
+                if not has_condition and fallback == NO_INDEX:
+                    fallback = first_transition + offset
+                target = transition.get("target")
+                transition_records.append(TRANSITION_RECORD.pack(
+                    state_index.get(target, NO_INDEX) if isinstance(target, str) else NO_INDEX,
+                    pool.add(_dump(transition)), has_condition,
+                ))
+            # 不是映射的状态由 dsl.check 报告，这里按空状态编码
+            state = state if isinstance(state, dict) else {}
+            body = {key: value for key, value in state.items() if key != "transitions"}
+            state_id = state.get("id")
+            state_records.append(STATE_RECORD.pack(
+                pool.add(state_id) if isinstance(state_id, str) else NO_INDEX,
+                pool.add(_dump(body)), first_transition, len(transitions), fallback, "transitions" in state,
+            ))
+
+        entry_point = flow.entry_point if isinstance(flow.entry_point, str) else None
+        flow_records.append(FLOW_RECORD.pack(
+            pool.add(flow.name), pool.add(entry_point), first_state, len(flow.states), pool.add(source),
+        ))
+
+    encoded = [text.encode("utf-8") for text in pool.strings]
+    offsets, position = [], 0
+    for data in encoded:
+        offsets.append(position)
+        position += len(data)
+    offsets.append(position)
+    string_index = b"".join(OFFSET.pack(offset) for offset in offsets)
+    string_data = b"".join(encoded)
+
+    sections = [string_index, string_data, b"".join(flow_records), b"".join(state_records),
+                b"".join(transition_records)]
+    section_offsets, position = [], HEADER.size
+    for section in sections:
+        section_offsets.append(position)
+        position += len(section)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, fingerprint.ljust(20, b"\0")[:20],
+                         len(pool.strings), len(flow_records), len(state_records), len(transition_records),
+                         *section_offsets)
+    return header + b"".join(sections)
+
+
+def compile_flow_table(flows_dir: str, output_path: str) -> int:
+    """
+    解析流程目录并写出流程表（先写临时文件再原子替换，正在读旧文件的进程不受影响）
+
+    Returns:
+        编译的流程文件数
+    """
+    fingerprint = flows_fingerprint(flows_dir)
+    flows = []
+    for file_path in find_flow_files(flows_dir):
+        flow = DslParser(file_path).get_flow()
+        if flow:
+            source = os.path.relpath(file_path, flows_dir)
+            flows.append((source, flow))
+            for issue in check_flow(flow, source=source):
+                if issue.severity == ERROR:
+                    print(f"    {issue}")
+    data = build_flow_table(flows, fingerprint)
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return len(flows)
+
+
+class FlowTable:
+    """只读 mmap 打开的流程表"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"流程表为空: {path}")
+        if len(self._buffer) < HEADER.size:
+            self.close()
+            raise ValueError(f"流程表文件头不完整: {path}")
+        (magic, version, _, self.fingerprint, self.string_count, self.flow_count, self.state_count,
+         self.transition_count, self._string_index, self._string_data, self._flows, self._states,
+         self._transitions) = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"不是受支持的流程表文件: {path}")
+
+    def close(self):
+        if getattr(self, "_buffer", None) is not None:
+            self._buffer.close()
+            self._buffer = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def string(self, index: int) -> Optional[str]:
+        """字符串池中的第 index 个字符串，index 为 -1 时返回None"""
+        if index == NO_INDEX:
+            return None
+        start, end = struct.unpack_from("<II", self._buffer, self._string_index + index * OFFSET.size)
+        return self._buffer[self._string_data + start:self._string_data + end].decode("utf-8")
+
+    def flow_record(self, index: int) -> Tuple[int, int, int, int, int]:
+        return FLOW_RECORD.unpack_from(self._buffer, self._flows + index * FLOW_RECORD.size)
+
+    def state_record(self, index: int) -> Tuple[int, int, int, int, int, int]:
+        return STATE_RECORD.unpack_from(self._buffer, self._states + index * STATE_RECORD.size)
+
+    def transition_record(self, index: int) -> Tuple[int, int, int]:
+        return TRANSITION_RECORD.unpack_from(self._buffer, self._transitions + index * TRANSITION_RECORD.size)
+
+    def load_flows(self) -> Dict[str, "TableChatFlow"]:
+        """按编译时的顺序返回 流程名 -> 流程"""
+        flows = {}
+        for index in range(self.flow_count):
+            flow = TableChatFlow(self, index)
+            flows[flow.name] = flow
+        return flows
+
+
+class TableChatFlow(ChatFlow):
+    """
+    由流程表支撑的 ChatFlow
+
+    状态编号、转换目标编号与兜底转换直接读流程表；状态体在首次访问时解码并缓存，
+    同一状态始终返回同一个字典（ActionExecutor 按 (流程名, 状态ID) 缓存流水线，
+    并以动作列表是否为同一对象判断流水线是否仍然有效）。
+    """
+
+    def __init__(self, table: FlowTable, index: int):
+        self._table = table
+        name, entry_point, self._first_state, self._state_count, source = table.flow_record(index)
+        self._data = None
+        self.name = table.string(name)
+        self.entry_point = table.string(entry_point)
+        self.source = table.string(source)
+        self._decoded: List[Optional[Dict[str, Any]]] = [None] * self._state_count
+        self._compiled: List[Optional[Tuple[Tuple[Transition, ...], Optional[Transition]]]] = \
+            [None] * self._state_count
+        self._lock = threading.Lock()
+        self._ids = [table.string(table.state_record(self._first_state + i)[0]) for i in range(self._state_count)]
+        self._index_by_id = {state_id: i for i, state_id in enumerate(self._ids) if state_id is not None}
+        self.entry_index = self.state_index(self.entry_point)
+        self.unresolved_targets = []
+        for i, state_id in enumerate(self._ids):
+            _, _, first, count, _, _ = table.state_record(self._first_state + i)
+            for t in range(first, first + count):
+                target_index, data, _ = table.transition_record(t)
+                if target_index == NO_INDEX:
+                    self.unresolved_targets.append((state_id, json.loads(table.string(data)).get("target")))
+
+    @property
+    def states(self) -> List[Dict[str, Any]]:
+        return [self.state_at(i) for i in range(self._state_count)]
+
+    def state_at(self, index: int) -> Dict[str, Any]:
+        state = self._decoded[index]
+        if state is not None:
+            return state
+        with self._lock:
+            state = self._decoded[index]
+            if state is None:
+                _, body, first, count, _, has_transitions = self._table.state_record(self._first_state + index)
+                state = json.loads(self._table.string(body))
+                if has_transitions:
+                    state["transitions"] = [
+                        json.loads(self._table.string(self._table.transition_record(t)[1]))
+                        for t in range(first, first + count)
+                    ]
+                self._decoded[index] = state
+        return state
+
+    def _compiled_at(self, index: int) -> Tuple[Tuple[Transition, ...], Optional[Transition]]:
+        """由转换记录与已解码的转换字典组装 Transition 元组"""
+        compiled = self._compiled[index]
+        if compiled is not None:
+            return compiled
+        state = self.state_at(index)
+        _, _, first, count, fallback, _ = self._table.state_record(self._first_state + index)
+        records = []
+        for offset, data in enumerate(state_transitions(state)):
+            target_index, _, has_condition = self._table.transition_record(first + offset)
+            if target_index != NO_INDEX:
+                target_index -= self._first_state
+            records.append(Transition(target_index, bool(has_condition), data.get("condition"), data))
+        records = tuple(records)
+        compiled = (records, records[fallback - first] if fallback != NO_INDEX else None)
+        self._compiled[index] = compiled
+        return compiled
+
+    def transitions_at(self, index: int) -> Tuple[Transition, ...]:
+        return self._compiled_at(index)[0]
+
+    def fallback_at(self, index: int) -> Optional[Transition]:
+        return self._compiled_at(index)[1]
+
+    def __repr__(self) -> str:
+        return f"<ChatFlow name='{self.name}' entry='{self.entry_point}' state_count={self._state_count}>"
+
+
+def load_flow_table(flows_dir: str, table_path: str) -> Tuple[FlowTable, Dict[str, TableChatFlow]]:
+    """
+    打开流程表，文件不存在、格式不符或与流程目录指纹不一致时重新编译
+
+    Returns:
+        (流程表, 流程名 -> 流程)；流程表需在不再使用流程时关闭
+    """
+    fingerprint = flows_fingerprint(flows_dir)
+    table = None
+    if os.path.exists(table_path):
+        try:
+            table = FlowTable(table_path)
+        except ValueError as e:
+            print(f"[流程表] {e}，重新编译")
+    if table is not None and table.fingerprint != fingerprint:
+        print(f"[流程表] 流程脚本已变化，重新编译 {table_path}")
+        table.close()
+        table = None
+    if table is None:
+        count = compile_flow_table(flows_dir, table_path)
+        print(f"[流程表] 已编译 {count} 个流程文件 -> {table_path}")
+        table = FlowTable(table_path)
+    return table, table.load_flows()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把 DSL 流程目录编译成可 mmap 共享的流程表")
+    parser.add_argument("flows_dir", help="流程目录")
+    parser.add_argument("-o", "--output", default="data/flows.cft", help="流程表输出路径")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.flows_dir):
+        print(f"错误：流程目录不存在 {args.flows_dir}")
+        return 1
+    count = compile_flow_table(args.flows_dir, args.output)
+    with FlowTable(args.output) as table:
+        print(f"[流程表] {count} 个文件，{table.flow_count} 个流程，{table.state_count} 个状态，"
+              f"{table.transition_count} 个转换，{table.string_count} 个字符串，"
+              f"{os.path.getsize(args.output)} 字节 -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 from typing import List, Dict, Any, Optional, Tuple
 import re
-from dsl.dsl_parser import DslParser, ChatFlow
+from dsl.dsl_parser import NO_STATE, DslParser, ChatFlow, Transition
 from core.session_manager import Session
 
 class Interpreter:
@@ -24,54 +24,91 @@ class Interpreter:
         if not session.current_state_id:
             session.current_state_id = self.chat_flow.entry_point
 
-        current_state_id = session.current_state_id
-        current_state = self.chat_flow.get_state(current_state_id)
-        if not current_state:
-            return [{"type": "respond", "text": f"错误：找不到状态 {current_state_id}。"}], False
+        if session.get_state_index(self.chat_flow) == NO_STATE:
+            return [{"type": "respond", "text": f"错误：找不到状态 {session.current_state_id}。"}], False
 
-        print(f"[Interpreter] 当前状态: {current_state_id}")
+        return self.apply_transition(session, self.find_transition(session, user_input))
+
+    def find_transition(self, session: Session, user_input: str,
+                        deterministic_only: bool = False) -> Optional[Transition]:
+        """
+        按顺序查找当前状态下匹配的转换规则，不修改会话
+
+        Args:
+            deterministic_only: 只在不调用LLM的情况下判断。遇到依赖LLM语义匹配的条件、
+                或只能落到兜底转换时返回None（结果未定），用于推测执行前的快速判断
+
+        Returns:
+            匹配的转换记录，没有匹配时返回None
+        """
+        flow = self.chat_flow
+        if session.current_state_id:
+            current_index = session.get_state_index(flow)
+        else:
+            current_index = flow.entry_index
+        if current_index == NO_STATE:
+            return None
+
+        print(f"[Interpreter] 当前状态: {flow.state_id_at(current_index)}")
 
         # 寻找匹配的转换规则
-        transitions = current_state.get("transitions", [])
+        transitions = flow.transitions_at(current_index)
         print(f"[Interpreter] 检查 {len(transitions)} 个转换规则")
 
-        matched_transition = None
         for i, transition in enumerate(transitions):
-            condition = transition.get("condition")
+            condition = transition.condition
+            if deterministic_only and self._uses_llm(condition):
+                print(f"[Interpreter] 转换 #{i+1} 需要LLM语义匹配，无法快速判断")
+                return None
             print(f"[Interpreter] 检查转换 #{i+1}, condition={condition is not None}")
             if self._is_condition_met(condition, user_input, session):
-                matched_transition = transition
-                print(f"[Interpreter] ✓ 转换 #{i+1} 匹配成功, target={transition.get('target')}")
-                break
+                print(f"[Interpreter] ✓ 转换 #{i+1} 匹配成功, target={transition.target}")
+                return transition
             else:
                 print(f"[Interpreter] ✗ 转换 #{i+1} 不匹配")
 
+        if deterministic_only:
+            return None
+
         # 如果没有匹配的条件，且存在一个没有条件的"兜底"转换
-        if not matched_transition:
-            print(f"[Interpreter] 未找到条件匹配，查找兜底转换...")
-            for i, transition in enumerate(transitions):
-                if "condition" not in transition:
-                    matched_transition = transition
-                    print(f"[Interpreter] ✓ 找到兜底转换 #{i+1}, target={transition.get('target')}")
-                    break
-
-        if matched_transition:
+        print(f"[Interpreter] 未找到条件匹配，查找兜底转换...")
+        fallback = flow.fallback_at(current_index)
+        if fallback:
+            print(f"[Interpreter] ✓ 找到兜底转换, target={fallback.target}")
+        return fallback
+
+    def apply_transition(self, session: Session, transition: Optional[Transition]) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        执行 find_transition 找到的转换，更新会话状态并返回目标状态的动作
+
+        返回: (actions, matched)
+        """
+        if transition:
             # 转换状态
-            next_state_id = matched_transition.get("target")
-            print(f"[Interpreter] 状态转换: {current_state_id} -> {next_state_id}")
-            session.current_state_id = next_state_id
-            next_state = self.chat_flow.get_state(next_state_id)
-            if next_state:
-                actions = next_state.get("actions", [])
+            next_state_id = transition.target
+            print(f"[Interpreter] 状态转换: {session.current_state_id} -> {next_state_id}")
+            if transition.target_index != NO_STATE:
+                session.set_state_index(self.chat_flow, transition.target_index)
+                actions = self.chat_flow.state_at(transition.target_index).get("actions", [])
                 print(f"[Interpreter] 返回 {len(actions)} 个动作")
                 return actions, True
             else:
+                # DslParser 加载的流程不会出现这种情况，直接构造的 ChatFlow 可能包含未解析的目标
+                session.current_state_id = next_state_id
                 return [{"type": "respond", "text": f"错误：找不到目标状态 {next_state_id}。"}], False
 
         # 如果没有找到任何匹配的转换
         print(f"[Interpreter] 警告：没有找到任何匹配的转换，返回默认响应")
         return [{"type": "respond", "text": "抱歉，我不知道如何回应。"}], False
 
+    @staticmethod
+    def _uses_llm(condition: Optional[Dict[str, Any]]) -> bool:
+        """条件中是否包含需要调用LLM的规则"""
+        if not condition:
+            return False
+        rules = condition.get("all") or condition.get("any") or [condition]
+        return any(rule.get("type") == "llm_semantic" for rule in rules)
+
     def _is_condition_met(self, condition: Optional[Dict[str, Any]], user_input: str, session: Session = None) -> bool:
         """
         检查条件是否满足
@@ -141,12 +178,18 @@ class Interpreter:
             semantic_meaning = rule.get("semantic_meaning", "")
             confidence_threshold = rule.get("confidence_threshold", 0.7)
 
-            # 准备会话上下文
+            # 准备会话上下文：默认带上全部会话变量，由 LLMResponder 按 token 预算截断；
+            # 规则通过 context_variables 声明用到的变量时只带这些变量
             session_context = None
             if session:
+                names = rule.get("context_variables")
                 session_context = {
                     "current_state_id": session.current_state_id,
-                    "variables": session.variables
+                    "variables": dict(session.variables) if names is None else {
+                        name: session.variables[name]
+                        for name in names
+                        if name in session.variables
+                    }
                 }
 
             try:
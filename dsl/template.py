@@ -0,0 +1,83 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# 与运行时旧实现保持一致的占位符语法：{{ session.xxx.yyy }}
+_PLACEHOLDER_PATTERN = re.compile(r"\{\{\s*(session\..*?)\s*\}\}")
+# 合法的变量路径：session.<标识符>(.<标识符>)*
+_VALID_PATH_PATTERN = re.compile(r"^session(\.[A-Za-z_][A-Za-z0-9_]*)+$")
+
+
+class TemplateVariable:
+    """模板中的一个变量引用，例如 session.current_order.order_id"""
+    __slots__ = ("path", "parts")
+
+    def __init__(self, path: str):
+        self.path = path
+        # 去掉开头的 "session"，保留后续逐级访问的键
+        self.parts: Tuple[str, ...] = tuple(path.split('.')[1:])
+
+    @property
+    def root(self) -> str:
+        """变量路径的根变量名（session.<root>...）"""
+        return self.parts[0] if self.parts else ""
+
+    @property
+    def is_valid(self) -> bool:
+        """路径是否为合法的点号变量路径（表达式写法会被视为非法）"""
+        return bool(_VALID_PATH_PATTERN.match(self.path))
+
+    def __repr__(self) -> str:
+        return f"<TemplateVariable {self.path}>"
+
+
+class CompiledTemplate:
+    """
+    预编译的回复模板
+
+    在流程加载时将 respond 文本拆分为 “字面量 / 变量路径” 片段列表，
+    运行时渲染只需逐段拼接，不再使用正则。
+    """
+    __slots__ = ("source", "segments", "variables")
+
+    def __init__(self, source: str, segments: List[Union[str, TemplateVariable]]):
+        self.source = source
+        self.segments = segments
+        self.variables: List[TemplateVariable] = [s for s in segments if isinstance(s, TemplateVariable)]
+
+    def render(self, resolve: Callable[[TemplateVariable], str]) -> str:
+        """使用给定的变量解析函数渲染模板"""
+        if not self.variables:
+            return self.source
+        return "".join(
+            segment if segment.__class__ is str else resolve(segment)
+            for segment in self.segments
+        )
+
+    def __repr__(self) -> str:
+        return f"<CompiledTemplate segments={len(self.segments)} variables={len(self.variables)}>"
+
+
+def compile_template(text: Optional[str]) -> CompiledTemplate:
+    """将模板文本编译为片段列表"""
+    text = text or ""
+    segments: List[Union[str, TemplateVariable]] = []
+    cursor = 0
+    for match in _PLACEHOLDER_PATTERN.finditer(text):
+        if match.start() > cursor:
+            segments.append(text[cursor:match.start()])
+        segments.append(TemplateVariable(match.group(1)))
+        cursor = match.end()
+    if cursor < len(text):
+        segments.append(text[cursor:])
+    return CompiledTemplate(text, segments)
+
+
+def lookup_variable_path(variables: Dict[str, Any], parts: Tuple[str, ...]) -> Any:
+    """按路径逐级访问会话变量，任何一级不是字典时返回None"""
+    current: Any = variables
+    for part in parts:
+        if isinstance(current, dict):
+            current = current.get(part)
+        else:
+            return None
+    return current
@@ -0,0 +1,211 @@
+"""
+从 LLM 输出中提取 JSON 对象
+
+模型经常在 JSON 前后附带说明文字或 ```json 代码块。这里用单次扫描的括号匹配找出
+候选对象（只在括号内部跟踪字符串与转义，花括号出现在字符串里不会打乱深度），
+逐个解析并按预期字段校验，不使用可能回溯的正则。
+
+扫描时用栈记录未闭合 "{" 的位置，每个闭合的括号对都记为候选，候选之间按嵌套关系组成树：
+外层候选解析失败（如外层是伪JSON）或括号不闭合（如前面有孤立的 "{"）时，依次尝试其内部的候选。
+外层解析失败位置之前的内部候选必然合法，包含失败位置的内部候选会在同一处失败而直接跳过，
+因此扫描与解析都只经过每个字符常数次，没有重扫次数上限。开头就不像对象的候选（如 "{{"）
+不交给解析器，避免大量孤立括号时反复构造解析异常。
+"""
+
+import json
+import re
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# 括号匹配需要关注的字符
+_STRUCTURE_CHARS = re.compile(r'[{}"\\]')
+# 合法对象的开头：空对象或 "键":。不符合的候选（如 "{{"、"{伪JSON"）不必交给解析器，
+# 解析失败时构造异常需要统计失败位置之前的行数，代价与失败位置成正比
+_OBJECT_START = re.compile(r'\{\s*(?:\}|"(?:[^"\\]|\\.)*"\s*:)')
+_DECODER = json.JSONDecoder()
+
+# 候选对象：(起始位置, 结束位置, 内部的候选对象)
+_Span = Tuple[int, int, List[Any]]
+
+# 字段类型不符（与合法的 None 区分）
+_INVALID = object()
+
+
+def _to_confidence(value: Any) -> Optional[float]:
+    """数字或数字字符串（可带 %），截断到 [0, 1]"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        text = value.strip()
+        scale = 100.0 if text.endswith("%") else 1.0
+        try:
+            value = float(text.rstrip("%")) / scale
+        except ValueError:
+            return None
+    if not isinstance(value, (int, float)) or value != value:  # value != value: NaN
+        return None
+    return min(max(float(value), 0.0), 1.0)
+
+
+def _to_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+
+def _to_intent(value: Any) -> Optional[str]:
+    return value.strip() if isinstance(value, str) and value.strip() else None
+
+
+def _to_target(value: Any) -> Any:
+    # target 可以为 null（无匹配目标）
+    if value is None or (isinstance(value, str) and value.strip().lower() in ("", "null", "none")):
+        return None
+    return value.strip() if isinstance(value, str) else _INVALID
+
+# 预期字段 -> 规范化函数（返回 None/_INVALID 表示类型不符）
+FIELD_VALIDATORS: Dict[str, Callable[[Any], Any]] = {
+    "intent": _to_intent,
+    "confidence": _to_confidence,
+    "matched": _to_bool,
+    "target": _to_target,
+}
+
+# 允许为 None 的字段
+_NULLABLE = {"target"}
+
+
+def validate_fields(obj: Any, required_keys: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    校验并规范化预期字段
+
+    required_keys 中的字段必须存在；FIELD_VALIDATORS 中的字段只要出现就必须类型正确
+    （confidence 接受数字字符串并截断到 [0, 1]，matched 接受 "true"/"false"）。
+
+    Returns:
+        规范化后的新字典；不是字典或校验失败时返回None
+    """
+    if not isinstance(obj, dict):
+        return None
+    if any(key not in obj for key in required_keys):
+        return None
+    result = dict(obj)
+    for key, validator in FIELD_VALIDATORS.items():
+        if key not in result:
+            continue
+        value = validator(result[key])
+        if value is _INVALID or (value is None and key not in _NULLABLE):
+            return None
+        result[key] = value
+    return result
+
+
+def _scan_spans(text: str) -> List[_Span]:
+    """
+    单次扫描找出所有闭合的括号对
+
+    Returns:
+        最外层的候选对象（按起始位置排列）；所在的外层括号不闭合的候选也提升到这一层
+    """
+    # 父候选尚未确定的候选，按起始位置排列；栈中记录 "{" 的位置与入栈时 pending 的长度
+    pending: List[_Span] = []
+    stack: List[Tuple[int, int]] = []
+    in_string = False
+    escaped = -1
+    for match in _STRUCTURE_CHARS.finditer(text):
+        i = match.start()
+        if i == escaped:
+            continue
+        ch = text[i]
+        if in_string:
+            if ch == "\\":
+                escaped = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == "{":
+            stack.append((i, len(pending)))
+        elif not stack:
+            # 括号外的文字不跟踪字符串
+            continue
+        elif ch == '"':
+            in_string = True
+        elif ch == "}":
+            start, mark = stack.pop()
+            children = pending[mark:]
+            del pending[mark:]
+            pending.append((start, i + 1, children))
+    return pending
+
+
+def iter_json_objects(text: str) -> Iterator[Any]:
+    """按出现顺序产出 text 中能解析的 JSON 对象"""
+    # (待尝试的候选, 外层候选的解析失败位置)
+    frames: List[Tuple[Iterator[_Span], Optional[int]]] = [(iter(_scan_spans(text)), None)]
+    while frames:
+        spans, error = frames[-1]
+        span = next(spans, None)
+        if span is None:
+            frames.pop()
+            continue
+        start, end, children = span
+        if error is not None and start < error < end:
+            # 外层解析在该候选内部失败，从该候选开始解析也会在同一处失败
+            frames.append((iter(children), error))
+            continue
+        if not _OBJECT_START.match(text, start):
+            frames.append((iter(children), start))
+            continue
+        try:
+            obj, _ = _DECODER.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            frames.append((iter(children), e.pos))
+        except RecursionError:
+            # 嵌套过深，不可能是模型的回答
+            continue
+        else:
+            yield obj
+
+
+def extract_json_object(text: Optional[str], required_keys: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    提取第一个满足字段校验的 JSON 对象
+
+    Args:
+        text: LLM 输出
+        required_keys: 必须存在的字段，如 ("intent",)
+
+    Returns:
+        规范化后的字典，找不到时返回None
+    """
+    if not text:
+        return None
+    required_keys = tuple(required_keys)
+    stripped = text.strip()
+    # 快速路径：整段就是 JSON（JSON 模式下的常见情况）
+    if stripped.startswith("{") and stripped.endswith("}"):
+        try:
+            result = _find_valid(json.loads(stripped), required_keys)
+            if result is not None:
+                return result
+        except (json.JSONDecodeError, RecursionError):
+            pass
+    for obj in iter_json_objects(text):
+        result = _find_valid(obj, required_keys)
+        if result is not None:
+            return result
+    return None
+
+
+def _find_valid(obj: Any, required_keys: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """obj 本身或其中嵌套的第一个通过校验的字典（如 {"result": {...}} 的外层包装）"""
+    pending = deque([obj])
+    while pending:
+        current = pending.popleft()
+        result = validate_fields(current, required_keys)
+        if result is not None:
+            return result
+        if isinstance(current, dict):
+            pending.extend(v for v in current.values() if isinstance(v, dict))
+    return None
@@ -1,8 +1,12 @@
-from typing import Dict, Any, Optional, List
+from functools import lru_cache
+from typing import Dict, Any, Iterator, Optional, List, Tuple, Union
 from openai import OpenAI
 import json
 import re
 
+from llm.json_extract import extract_json_object
+from llm.prompt_context import PromptContextBuilder, PromptMetrics
+
 ## LLM意图识别器
 class LLMResponder:
     """
@@ -13,7 +17,122 @@ class LLMResponder:
     3. 智能回复：生成自然语言响应
     """
 
-    def __init__(self, api_key: str, model_name: str, base_url: Optional[str] = None, timeout: float = 10.0):
+    # 回复生成失败时返回给用户的提示
+    RESPONSE_FAILED_MESSAGE = "抱歉，我暂时无法理解您的问题，请您稍后再试或联系人工客服。"
+
+    # 降级意图识别的关键词规则库（按顺序匹配，先命中先返回）
+    FALLBACK_INTENT_RULES = [
+        {
+            "patterns": ["产品", "商品", "介绍", "功能", "价格", "推荐", "有什么"],
+            "intent": "产品咨询",
+            "confidence": 0.8
+        },
+        {
+            "patterns": ["订单", "物流", "快递", "发货", "到哪", "查询订单"],
+            "intent": "订单查询",
+            "confidence": 0.85
+        },
+        {
+            "patterns": ["退款", "退货", "退", "不想要", "质量问题"],
+            "intent": "退款退货",
+            "confidence": 0.9
+        },
+        {
+            "patterns": ["发票", "invoice", "开票", "抬头", "税号"],
+            "intent": "发票申请",
+            "confidence": 0.9
+        },
+        {
+            "patterns": ["坏了", "故障", "问题", "修", "不能用", "没声音", "连不上"],
+            "intent": "故障报修",
+            "confidence": 0.85
+        },
+        {
+            "patterns": ["你好", "您好", "hi", "hello", "在吗"],
+            "intent": "闲聊问候",
+            "confidence": 0.95
+        }
+    ]
+
+    # 静态系统提示词：类加载时构造一次。每次调用的消息都以这些固定内容开头，
+    # 随调用变化的内容（会话上下文、用户输入）放在最后，服务端的前缀缓存可以复用
+    INTENT_SYSTEM_PROMPT = """你是一个智能客服机器人的意图识别系统。
+你的任务是分析用户输入，识别用户的意图类型。
+
+常见意图类型包括：
+- 产品咨询：用户想了解产品信息、功能、价格等
+- 订单查询：用户想查看订单状态、物流信息
+- 退款退货：用户想申请退款或退货
+- 发票申请：用户需要开具发票
+- 故障报修：用户反馈产品问题或故障
+- 闲聊问候：普通的打招呼或闲聊
+
+请以JSON格式返回结果，包含以下字段：
+{
+    "intent": "意图类型",
+    "confidence": 0.0-1.0的置信度,
+    "entities": {"实体类型": "实体值"},
+    "reasoning": "简短的判断理由"
+}
+
+例如：
+用户输入："我想查一下订单A1234567890的物流"
+返回：{"intent": "订单查询", "confidence": 0.95, "entities": {"order_id": "A1234567890"}, "reasoning": "用户明确提到查询订单和物流信息"}
+"""
+
+    ENTITY_SYSTEM_PROMPT = """你是一个实体提取系统。
+从用户输入中提取指定类型的实体。
+
+以JSON格式返回结果，格式为：
+{"实体类型": "实体值", ...}
+
+如果某个实体不存在，则不包含在结果中。
+"""
+
+    SEMANTIC_MATCH_SYSTEM_PROMPT = """你是一个语义理解系统。
+你的任务是判断用户输入是否符合指定的语义含义。
+
+请以JSON格式返回结果：
+{
+    "matched": true/false,
+    "confidence": 0.0-1.0的置信度,
+    "reasoning": "简短的判断理由"
+}
+
+判断标准：
+- matched为true表示用户输入符合语义含义
+- confidence表示判断的置信度（0-1之间）
+- 置信度>=0.7才认为是明确匹配
+"""
+
+    CONDITION_MATCH_SYSTEM_PROMPT = """你是一个对话流程路由系统。
+你的任务是根据用户输入和当前状态，判断应该转换到哪个目标状态。
+
+请以JSON格式返回结果：
+{
+    "target": "目标状态名称",
+    "confidence": 0.0-1.0的置信度,
+    "reasoning": "选择理由"
+}
+
+如果没有合适的目标，返回：
+{
+    "target": null,
+    "confidence": 0.0,
+    "reasoning": "无匹配目标"
+}
+"""
+
+    RESPONSE_SYSTEM_PROMPT = """你是一个智能客服机器人。
+请根据对话上下文和用户输入，生成友好、专业的回复。
+回复要求：
+- 简洁明了，不超过100字
+- 语气友好、礼貌
+- 针对用户问题给出具体建议
+"""
+
+    def __init__(self, api_key: str, model_name: str, base_url: Optional[str] = None, timeout: float = 10.0,
+                 context_token_budget: int = 300, json_mode: bool = True):
         """
         初始化LLM响应器
 
@@ -22,11 +141,19 @@ class LLMResponder:
             model_name: 模型名称（如 gpt-3.5-turbo）
             base_url: 自定义API基础URL（用于兼容其他OpenAI格式API）
             timeout: API调用超时时间（秒），默认10秒
+            context_token_budget: 提示词中会话上下文的 token 预算（本地估算），默认300
+            json_mode: 需要JSON结果的调用是否请求 JSON 模式（response_format），
+                       服务端不支持时自动关闭
         """
         self.api_key = api_key
         self.model_name = model_name
         self.base_url = base_url
         self.timeout = timeout
+        self.json_mode = json_mode
+
+        # 会话上下文压缩与每次调用的提示词体积统计
+        self.context_builder = PromptContextBuilder(max_tokens=context_token_budget)
+        self.prompt_metrics = PromptMetrics()
 
         # 配置OpenAI客户端（使用新版API）
         self.client = OpenAI(
@@ -35,6 +162,15 @@ class LLMResponder:
             timeout=self.timeout
         )
 
+    @classmethod
+    @lru_cache(maxsize=32)
+    def _intent_system_prompt(cls, available_intents: Tuple[str, ...]) -> str:
+        """意图识别系统提示词（静态说明 + 可选意图列表），同一流程集合只构造一次"""
+        if not available_intents:
+            return cls.INTENT_SYSTEM_PROMPT
+        intent_list = "\n".join(f"- {intent}" for intent in available_intents)
+        return f"{cls.INTENT_SYSTEM_PROMPT}\n可选意图列表：\n{intent_list}\n"
+
     def recognize_intent(
         self,
         user_input: str,
@@ -56,10 +192,11 @@ class LLMResponder:
                 "entities": {"order_id": "A1234567890"}
             }
         """
-        # 构建提示词
-        intent_list = "\n".join([f"- {intent}" for intent in (available_intents or [])])
+        # 系统提示词只依赖可选意图列表（每个流程集合固定），放在最前面以便服务端复用前缀缓存
+        system_prompt = self._intent_system_prompt(tuple(available_intents or ()))
 
         context_info = ""
+        context_text, context_truncated = "", False
         if session_context:
             # 只保留与意图识别强相关的简要上下文，避免提示过长
             slim_context: Dict[str, Any] = {}
@@ -72,34 +209,16 @@ class LLMResponder:
                 # 只取最近3条，避免过长
                 slim_context["recent_user_inputs"] = history[-3:]
 
-            if slim_context:
-                context_info = f"\n\n对话上下文（最近几轮）：\n{json.dumps(slim_context, ensure_ascii=False, indent=2)}"
-
-        system_prompt = """你是一个智能客服机器人的意图识别系统。
-你的任务是分析用户输入，识别用户的意图类型。
+            context_text, context_truncated = self.context_builder.build(slim_context)
+            if context_text:
+                context_info = f"对话上下文（最近几轮）：\n{context_text}\n\n"
 
-常见意图类型包括：
-- 产品咨询：用户想了解产品信息、功能、价格等
-- 订单查询：用户想查看订单状态、物流信息
-- 退款退货：用户想申请退款或退货
-- 发票申请：用户需要开具发票
-- 故障报修：用户反馈产品问题或故障
-- 闲聊问候：普通的打招呼或闲聊
-
-请以JSON格式返回结果，包含以下字段：
-{
-    "intent": "意图类型",
-    "confidence": 0.0-1.0的置信度,
-    "entities": {"实体类型": "实体值"},
-    "reasoning": "简短的判断理由"
-}
-
-例如：
-用户输入："我想查一下订单A1234567890的物流"
-返回：{"intent": "订单查询", "confidence": 0.95, "entities": {"order_id": "A1234567890"}, "reasoning": "用户明确提到查询订单和物流信息"}
-"""
-
-        user_prompt = f"用户当前输入：{user_input}{context_info}\n\n可选意图列表：\n{intent_list}\n\n请分析用户意图。"
+        user_prompt = f"{context_info}用户当前输入：{user_input}\n\n请分析用户意图。"
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        prompt_tokens = self.prompt_metrics.record("recognize_intent", messages, context_text, context_truncated)
 
         try:
             # 调用OpenAI API（使用新版客户端）
@@ -111,17 +230,15 @@ class LLMResponder:
             print(f"  API Key: {self.api_key[:15]}...{self.api_key[-5:] if len(self.api_key) > 20 else '(too short)'}")
             print(f"  Timeout: {self.timeout}秒")
             print(f"  User Input: {user_input}")
+            print(f"  Prompt Tokens(估算): {prompt_tokens}")
             print(f"  正在调用 API...")
 
             import time
             start_time = time.time()
 
-            response = self.client.chat.completions.create(
+            response = self._create_json_completion(
                 model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.3,  # 较低的温度以获得更确定的结果
                 max_tokens=200,
                 timeout=self.timeout
@@ -135,7 +252,7 @@ class LLMResponder:
             content = response.choices[0].message.content.strip()
 
             # 尝试提取JSON
-            result = self._extract_json(content)
+            result = self._extract_json(content, ("intent",))
 
             if result:
                 return result
@@ -173,71 +290,37 @@ class LLMResponder:
             # 降级到规则匹配
             return self._fallback_intent_recognition(user_input)
 
-    def _extract_json(self, text: str) -> Optional[Dict]:
-        """从文本中提取JSON对象"""
+    def _extract_json(self, text: str, required_keys: Tuple[str, ...] = ()) -> Optional[Dict]:
+        """从文本中提取第一个包含 required_keys 且字段类型正确的JSON对象（耗时与文本长度成线性）"""
+        return extract_json_object(text, required_keys)
+
+    def _create_json_completion(self, **kwargs):
+        """
+        请求返回JSON的补全
+
+        json_mode 开启时附带 response_format={"type": "json_object"}。服务端不支持该参数时
+        返回 400：去掉参数重试一次，重试成功说明是该参数导致的，之后不再发送。
+        """
+        if not self.json_mode:
+            return self.client.chat.completions.create(**kwargs)
         try:
-            # 尝试直接解析
-            return json.loads(text)
-        except:
-            # 尝试查找JSON代码块
-            json_match = re.search(r'```json\s*(\{.*?\})\s*```', text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(1))
-                except:
-                    pass
-
-            # 尝试查找任何JSON对象
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group(0))
-                except:
-                    pass
-
-        return None
-
-    def _fallback_intent_recognition(self, user_input: str) -> Dict[str, Any]:
+            return self.client.chat.completions.create(response_format={"type": "json_object"}, **kwargs)
+        except Exception as e:
+            if getattr(e, "status_code", None) != 400:
+                raise
+            response = self.client.chat.completions.create(**kwargs)
+            print(f"[LLM] 服务端不支持 JSON 模式，已关闭: {e}")
+            self.json_mode = False
+            return response
+
+    @classmethod
+    def _fallback_intent_recognition(cls, user_input: str) -> Dict[str, Any]:
         """
         降级方案：基于规则的意图识别
         当API调用失败时使用
         """
         print(f"[使用降级规则匹配] 输入: '{user_input}'")
 
-        # 规则库
-        rules = [
-            {
-                "patterns": ["产品", "商品", "介绍", "功能", "价格", "推荐", "有什么"],
-                "intent": "产品咨询",
-                "confidence": 0.8
-            },
-            {
-                "patterns": ["订单", "物流", "快递", "发货", "到哪", "查询订单"],
-                "intent": "订单查询",
-                "confidence": 0.85
-            },
-            {
-                "patterns": ["退款", "退货", "退", "不想要", "质量问题"],
-                "intent": "退款退货",
-                "confidence": 0.9
-            },
-            {
-                "patterns": ["发票", "invoice", "开票", "抬头", "税号"],
-                "intent": "发票申请",
-                "confidence": 0.9
-            },
-            {
-                "patterns": ["坏了", "故障", "问题", "修", "不能用", "没声音", "连不上"],
-                "intent": "故障报修",
-                "confidence": 0.85
-            },
-            {
-                "patterns": ["你好", "您好", "hi", "hello", "在吗"],
-                "intent": "闲聊问候",
-                "confidence": 0.95
-            }
-        ]
-
         # 提取订单号
         order_id_match = re.search(r'[A-Z]\d{10}', user_input)
         entities = {}
@@ -245,7 +328,7 @@ class LLMResponder:
             entities["order_id"] = order_id_match.group(0)
 
         # 匹配规则
-        for rule in rules:
+        for rule in cls.FALLBACK_INTENT_RULES:
             for pattern in rule["patterns"]:
                 if pattern in user_input:
                     return {
@@ -274,24 +357,18 @@ class LLMResponder:
         Returns:
             提取的实体字典
         """
-        system_prompt = f"""你是一个实体提取系统。
-从用户输入中提取以下类型的实体：{', '.join(entity_types)}
-
-以JSON格式返回结果，格式为：
-{{"实体类型": "实体值", ...}}
-
-如果某个实体不存在，则不包含在结果中。
-"""
-
-        user_prompt = f"用户输入：{user_input}"
+        system_prompt = self.ENTITY_SYSTEM_PROMPT
+        user_prompt = f"需要提取的实体类型：{', '.join(entity_types)}\n\n用户输入：{user_input}"
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        self.prompt_metrics.record("extract_entities", messages)
 
         try:
-            response = self.client.chat.completions.create(
+            response = self._create_json_completion(
                 model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.1,
                 max_tokens=100,
                 timeout=self.timeout
@@ -324,47 +401,32 @@ class LLMResponder:
         """
         # 构建上下文信息
         context_info = ""
-        if session_context:
-            context_info = f"\n\n当前会话上下文：{json.dumps(session_context, ensure_ascii=False, indent=2)}"
-
-        system_prompt = f"""你是一个语义理解系统。
-你的任务是判断用户输入是否符合指定的语义含义。
-
-请以JSON格式返回结果：
-{{
-    "matched": true/false,
-    "confidence": 0.0-1.0的置信度,
-    "reasoning": "简短的判断理由"
-}}
-
-判断标准：
-- matched为true表示用户输入符合语义含义
-- confidence表示判断的置信度（0-1之间）
-- 置信度>=0.7才认为是明确匹配
-"""
+        context_text, context_truncated = self.context_builder.build(session_context)
+        if context_text:
+            context_info = f"\n\n当前会话上下文：{context_text}"
 
-        user_prompt = f"""用户输入：{user_input}
-
-期望的语义含义：{semantic_meaning}{context_info}
-
-请判断用户输入是否符合这个语义含义。"""
+        system_prompt = self.SEMANTIC_MATCH_SYSTEM_PROMPT
+        # 语义含义随规则固定，放在用户输入之前
+        user_prompt = f"期望的语义含义：{semantic_meaning}{context_info}\n\n用户输入：{user_input}\n\n请判断用户输入是否符合这个语义含义。"
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        self.prompt_metrics.record("check_semantic_match", messages, context_text, context_truncated)
 
         try:
             print(f"[LLM语义匹配] 输入: '{user_input}' | 期望语义: '{semantic_meaning}'")
 
-            response = self.client.chat.completions.create(
+            response = self._create_json_completion(
                 model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.2,  # 低温度以获得更一致的判断
                 max_tokens=150,
                 timeout=self.timeout
             )
 
             content = response.choices[0].message.content.strip()
-            result = self._extract_json(content)
+            result = self._extract_json(content, ("matched",))
 
             if result and "matched" in result:
                 print(f"  ✓ LLM判断: {'匹配' if result['matched'] else '不匹配'} (置信度: {result.get('confidence', 0):.2f})")
@@ -405,55 +467,40 @@ class LLMResponder:
             }
         """
         context_info = ""
+        context_text, context_truncated = "", False
         if session_context:
             # 只包含关键上下文信息，避免过长
             key_context = {
                 "current_state": session_context.get("current_state_id"),
                 "variables": session_context.get("variables", {})
             }
-            context_info = f"\n\n当前会话上下文：{json.dumps(key_context, ensure_ascii=False, indent=2)}"
+            context_text, context_truncated = self.context_builder.build(key_context)
+            if context_text:
+                context_info = f"\n\n当前会话上下文：{context_text}"
 
         targets_info = "\n".join([f"- {target}" for target in available_targets])
 
-        system_prompt = f"""你是一个对话流程路由系统。
-你的任务是根据用户输入和当前状态，判断应该转换到哪个目标状态。
-
-当前状态：{condition_description}
-
-可选的目标状态：
-{targets_info}
-
-请以JSON格式返回结果：
-{{
-    "target": "目标状态名称",
-    "confidence": 0.0-1.0的置信度,
-    "reasoning": "选择理由"
-}}
-
-如果没有合适的目标，返回：
-{{
-    "target": null,
-    "confidence": 0.0,
-    "reasoning": "无匹配目标"
-}}
-"""
-
-        user_prompt = f"用户输入：{user_input}{context_info}\n\n请判断应该转换到哪个目标状态。"
+        system_prompt = self.CONDITION_MATCH_SYSTEM_PROMPT
+        # 当前状态与目标列表随状态固定，放在会话上下文和用户输入之前
+        user_prompt = (f"当前状态：{condition_description}\n\n可选的目标状态：\n{targets_info}"
+                       f"{context_info}\n\n用户输入：{user_input}\n\n请判断应该转换到哪个目标状态。")
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        self.prompt_metrics.record("match_condition_with_llm", messages, context_text, context_truncated)
 
         try:
-            response = self.client.chat.completions.create(
+            response = self._create_json_completion(
                 model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.2,
                 max_tokens=200,
                 timeout=self.timeout
             )
 
             content = response.choices[0].message.content.strip()
-            result = self._extract_json(content)
+            result = self._extract_json(content, ("target",))
 
             if result:
                 return result
@@ -472,30 +519,28 @@ class LLMResponder:
                 "reasoning": f"API调用失败: {str(e)}"
             }
 
-    def generate_response(self, context: str, user_input: str) -> str:
+    def generate_response(self, context: str, user_input: str,
+                          stream: bool = False) -> Union[str, Iterator[str]]:
         """
         生成智能回复
 
         Args:
             context: 对话上下文
             user_input: 用户输入
+            stream: 为True时以流式方式请求，返回逐段产出文本的迭代器，
+                    首段文本到达即可展示给用户
 
         Returns:
-            生成的回复文本
+            生成的回复文本；stream=True 时为文本片段迭代器
         """
-        system_prompt = """你是一个智能客服机器人。
-请根据对话上下文和用户输入，生成友好、专业的回复。
-回复要求：
-- 简洁明了，不超过100字
-- 语气友好、礼貌
-- 针对用户问题给出具体建议
-"""
+        system_prompt = self.RESPONSE_SYSTEM_PROMPT
 
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "assistant", "content": context},
             {"role": "user", "content": user_input}
         ]
+        self.prompt_metrics.record("generate_response", messages)
 
         try:
             response = self.client.chat.completions.create(
@@ -503,14 +548,53 @@ class LLMResponder:
                 messages=messages,
                 temperature=0.7,
                 max_tokens=150,
-                timeout=self.timeout
+                timeout=self.timeout,
+                stream=stream
             )
 
+            if stream:
+                return self._iter_stream(response)
             return response.choices[0].message.content.strip()
 
         except Exception as e:
             print(f"[回复生成失败] {str(e)}")
-            return "抱歉，我暂时无法理解您的问题，请您稍后再试或联系人工客服。"
+            if stream:
+                return iter([self.RESPONSE_FAILED_MESSAGE])
+            return self.RESPONSE_FAILED_MESSAGE
+
+    def get_prompt_stats(self) -> Dict[str, Dict[str, Any]]:
+        """按方法统计的提示词体积（估算 token 数）"""
+        return self.prompt_metrics.stats()
+
+    def _iter_stream(self, response) -> Iterator[str]:
+        """
+        逐段产出流式响应中的文本
+
+        去掉回复开头的空白（与非流式的 strip 一致）；尚未产出任何文本就出错时
+        产出失败提示，已产出部分文本后出错则就此结束
+        """
+        started = False
+        try:
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if not started:
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                    started = True
+                yield delta
+        except Exception as e:
+            print(f"[流式回复中断] {str(e)}")
+            if not started:
+                yield self.RESPONSE_FAILED_MESSAGE
+        finally:
+            close = getattr(response, "close", None)
+            if close:
+                close()
 
 
 if __name__ == '__main__':
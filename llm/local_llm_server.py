@@ -0,0 +1,219 @@
+"""
+本地替身 LLM 服务器
+
+实现 OpenAI 兼容的 POST /v1/chat/completions（含 stream=True 的 SSE 响应），记录收到的每次请求。
+用于在没有 API Key 的环境下联调，以及在测试中检查提示词的前缀是否稳定（服务端前缀缓存
+只对逐字节相同的开头部分生效）。
+
+用法：
+    python -m llm.local_llm_server --port 8001
+    然后在 config.yaml 中设置 llm.base_url: http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+from llm.prompt_context import estimate_tokens
+
+# 要求返回JSON的调用（意图识别、语义匹配等）使用的默认回复：各字段均表示"未识别"
+DEFAULT_JSON_REPLY = json.dumps({
+    "intent": "未知",
+    "confidence": 0.0,
+    "matched": False,
+    "target": None,
+    "entities": {},
+    "reasoning": "本地替身LLM",
+}, ensure_ascii=False)
+DEFAULT_TEXT_REPLY = "您好，这是本地测试回复。"
+
+
+def default_reply(messages: List[Dict[str, str]]) -> str:
+    """系统提示词要求JSON时返回 DEFAULT_JSON_REPLY，否则返回固定文本"""
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    return DEFAULT_JSON_REPLY if "JSON" in system else DEFAULT_TEXT_REPLY
+
+
+def render_prompt(messages: List[Dict[str, str]]) -> str:
+    """按消息顺序拼接成服务端看到的提示词文本，用于比较前缀"""
+    return "".join(f"<|{m.get('role')}|>{m.get('content', '')}" for m in messages)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    """两段文本相同开头的字符数"""
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+class LocalLLMServer:
+    """
+    在后台线程运行的 OpenAI 兼容替身服务器
+
+    Args:
+        reply: 根据请求消息生成回复文本的函数，默认 default_reply
+        host/port: 监听地址，port=0 时由系统分配空闲端口
+    """
+
+    def __init__(self, reply: Optional[Callable[[List[Dict[str, str]]], str]] = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.reply = reply or default_reply
+        self._lock = threading.Lock()
+        self._requests: List[Dict[str, Any]] = []
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self) -> List[Dict[str, Any]]:
+        """收到的请求体（按到达顺序）"""
+        with self._lock:
+            return list(self._requests)
+
+    @property
+    def prompts(self) -> List[str]:
+        """每次请求拼接后的提示词文本"""
+        return [render_prompt(request.get("messages", [])) for request in self.requests]
+
+    def clear(self):
+        with self._lock:
+            self._requests.clear()
+
+    def serve_forever(self):
+        """在当前线程运行，直到 KeyboardInterrupt"""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def start(self) -> "LocalLLMServer":
+        """在后台线程运行"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "LocalLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _record(self, body: Dict[str, Any]):
+        with self._lock:
+            self._requests.append(body)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except (ValueError, json.JSONDecodeError):
+                    self._send_json(400, {"error": {"message": "请求体不是合法JSON"}})
+                    return
+
+                server._record(body)
+                messages = body.get("messages", [])
+                content = server.reply(messages)
+                model = body.get("model", "local")
+                if body.get("stream"):
+                    self._send_stream(model, content)
+                    return
+                prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+                completion_tokens = estimate_tokens(content)
+                self._send_json(200, {
+                    "id": f"chatcmpl-local-{len(server.requests)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                })
+
+            def _send_json(self, status: int, payload: Dict[str, Any]):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, model: str, content: str):
+                """以 SSE 逐字发送回复，最后发送 [DONE]"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                created = int(time.time())
+                deltas = [{"role": "assistant", "content": ""}] + [{"content": ch} for ch in content]
+                for i, delta in enumerate(deltas):
+                    chunk = {
+                        "id": "chatcmpl-local-stream",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": delta,
+                            "finish_reason": "stop" if i == len(deltas) - 1 else None,
+                        }],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地替身 LLM 服务器（OpenAI 兼容）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    def logging_reply(messages):
+        print(f"[本地LLM] 收到请求:\n{render_prompt(messages)}\n")
+        return default_reply(messages)
+
+    server = LocalLLMServer(reply=logging_reply, host=args.host, port=args.port)
+    print(f"[本地LLM] 监听 {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[本地LLM] 已停止")
+
+
+if __name__ == "__main__":
+    main()
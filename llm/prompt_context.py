@@ -0,0 +1,146 @@
+"""
+LLM 提示词上下文构建与体积统计
+
+会话变量中可能保存完整的 search_results、user_orders 列表，原样 json.dumps(indent=2)
+写进提示词会让 token 数、费用和延迟随会话变长而增长。这里把上下文压缩为紧凑 JSON：
+截断列表与长字符串，并按本地估算的 token 数控制在预算之内。
+"""
+
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# 中日韩文字与全角标点：常见中文分词器下大约 1 个字 1 个 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    本地估算文本的 token 数（不依赖具体模型的分词器）
+
+    中文按每字 1 个 token、其余字符按每 4 个字符 1 个 token 估算，偏保守
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class PromptContextBuilder:
+    """
+    把会话上下文压缩为不超过 token 预算的紧凑 JSON
+
+    依次尝试：
+    1. 列表保留前 max_list_items 项、字符串截断到 max_string_chars
+    2. 更严格的截断（列表只留 1 项，再到只留条数）
+    3. 从体积最大的字段开始逐个丢弃
+    全部丢弃后仍超出预算时返回空字符串（不附带上下文）
+    """
+
+    # 嵌套超过该深度的值替换为占位符
+    MAX_DEPTH = 4
+
+    def __init__(self, max_tokens: int = 300, max_list_items: int = 3, max_string_chars: int = 120):
+        self.max_tokens = max_tokens
+        self.max_list_items = max_list_items
+        self.max_string_chars = max_string_chars
+
+    def build(self, context: Optional[Dict[str, Any]]) -> Tuple[str, bool]:
+        """
+        Returns:
+            (压缩后的上下文 JSON, 是否截断或丢弃了内容)；context 为空时返回 ("", False)
+        """
+        if not context:
+            return "", False
+        for list_items, string_chars in ((self.max_list_items, self.max_string_chars),
+                                         (1, self.max_string_chars // 2),
+                                         (0, self.max_string_chars // 4)):
+            cut: List[bool] = []
+            data = self._shrink(context, list_items, string_chars, 0, cut)
+            text = _dumps(data)
+            if estimate_tokens(text) <= self.max_tokens:
+                return text, bool(cut)
+
+        while estimate_tokens(text) > self.max_tokens and self._drop_largest(data):
+            text = _dumps(data)
+        return (text if data and estimate_tokens(text) <= self.max_tokens else ""), True
+
+    def _shrink(self, value: Any, list_items: int, string_chars: int, depth: int, cut: List[bool]) -> Any:
+        """按限制复制 value，发生截断时向 cut 追加标记"""
+        if isinstance(value, dict):
+            if depth >= self.MAX_DEPTH:
+                cut.append(True)
+                return "{…}"
+            return {str(k): self._shrink(v, list_items, string_chars, depth + 1, cut) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            if depth >= self.MAX_DEPTH:
+                cut.append(True)
+                return "[…]"
+            items = [self._shrink(v, list_items, string_chars, depth + 1, cut) for v in value[:list_items]]
+            if len(value) > list_items:
+                cut.append(True)
+                items.append(f"…(共{len(value)}项)")
+            return items
+        if isinstance(value, str) and len(value) > string_chars:
+            cut.append(True)
+            return value[:string_chars] + "…"
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        return self._shrink(str(value), list_items, string_chars, depth, cut)
+
+    @staticmethod
+    def _drop_largest(data: Dict[str, Any]) -> bool:
+        """
+        丢弃体积最大的字段，没有可丢弃的字段时返回False
+
+        variables 等嵌套字典按其中的字段逐个丢弃，字典清空后再丢弃字典本身
+        """
+        candidates = []
+        for key, value in data.items():
+            if isinstance(value, dict) and value:
+                candidates.extend((value, sub_key) for sub_key in value)
+            else:
+                candidates.append((data, key))
+        if not candidates:
+            return False
+        container, key = max(candidates, key=lambda item: len(_dumps(item[0][item[1]])))
+        del container[key]
+        return True
+
+
+class PromptMetrics:
+    """按 LLM 方法统计每次调用的提示词体积（估算 token 数），线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, method: str, messages: List[Dict[str, str]], context_text: str = "",
+               context_truncated: bool = False) -> int:
+        """记录一次调用，返回提示词估算 token 数"""
+        tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        context_tokens = estimate_tokens(context_text)
+        with self._lock:
+            stats = self._stats.setdefault(method, {
+                "calls": 0, "total_tokens": 0, "max_tokens": 0,
+                "context_tokens": 0, "context_truncated": 0,
+            })
+            stats["calls"] += 1
+            stats["total_tokens"] += tokens
+            stats["max_tokens"] = max(stats["max_tokens"], tokens)
+            stats["context_tokens"] += context_tokens
+            stats["context_truncated"] += int(context_truncated)
+            stats["last_tokens"] = tokens
+        return tokens
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                method: dict(stats, avg_tokens=round(stats["total_tokens"] / stats["calls"], 1))
+                for method, stats in self._stats.items()
+            }
@@ -0,0 +1,218 @@
+"""
+准入控制与过载降级
+
+服务器为每个连接分配一个线程，过载时新连接照常被接受，随后与所有会话一起争抢
+CPU 和 LLM 配额，已有对话的延迟随之失控。这里跟踪两个负载指标：
+
+- in_flight_requests：正在处理中的消息数（各连接线程中的 handle_message）
+- in_flight_llm：正在进行的 LLM 调用数
+
+任一指标达到阈值即逐级降级：
+1. RULE_ONLY：关闭 LLM 意图识别与语义匹配，只按规则路由
+2. TEMPLATE_ONLY：兜底回复也不再调用 LLM，使用固定模板
+3. REJECT_LOGINS：拒绝新的登录/注册，并在响应中给出 retry_after
+
+已登录用户的对话在各级别下都继续服务，只是不再等待 LLM，因此延迟有上界。
+"""
+
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Optional
+
+NORMAL = 0
+RULE_ONLY = 1
+TEMPLATE_ONLY = 2
+REJECT_LOGINS = 3
+
+LEVEL_NAMES = {
+    NORMAL: "normal",
+    RULE_ONLY: "rule_only",
+    TEMPLATE_ONLY: "template_only",
+    REJECT_LOGINS: "reject_logins",
+}
+
+# 各级别的默认阈值：(in_flight_requests, in_flight_llm)，None 表示不按该指标判断
+DEFAULT_THRESHOLDS = {
+    RULE_ONLY: (32, 8),
+    TEMPLATE_ONLY: (64, 16),
+    REJECT_LOGINS: (96, None),
+}
+
+
+class Overloaded(Exception):
+    """服务器过载，当前请求被降级或拒绝"""
+
+    def __init__(self, level: int, retry_after: float = 0.0):
+        super().__init__(f"服务器过载（{LEVEL_NAMES[level]}）")
+        self.level = level
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    根据实时负载计算降级级别（线程安全）
+
+    级别不做缓存：每次判断都取当前计数，负载回落后立即恢复。
+    """
+
+    def __init__(self, thresholds: Optional[Dict[int, tuple]] = None, retry_after: float = 5.0):
+        """
+        Args:
+            thresholds: {级别: (in_flight_requests 阈值, in_flight_llm 阈值)}
+            retry_after: 拒绝登录时建议客户端等待的秒数
+        """
+        self.thresholds = dict(DEFAULT_THRESHOLDS)
+        self.thresholds.update(thresholds or {})
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self.in_flight_requests = 0
+        self.in_flight_llm = 0
+        # 各级别触发的降级/拒绝次数
+        self.shed = {level: 0 for level in (RULE_ONLY, TEMPLATE_ONLY, REJECT_LOGINS)}
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional["AdmissionController"]:
+        """
+        从 config.yaml 的 admission 配置创建，enabled 为 false 时返回None
+
+        配置示例：
+            admission:
+              rule_only: {in_flight_requests: 32, in_flight_llm: 8}
+              template_only: {in_flight_requests: 64, in_flight_llm: 16}
+              reject_logins: {in_flight_requests: 96}
+              retry_after: 5
+        """
+        config = config or {}
+        if config.get("enabled") is False:
+            return None
+        thresholds = {}
+        for level in (RULE_ONLY, TEMPLATE_ONLY, REJECT_LOGINS):
+            level_cfg = config.get(LEVEL_NAMES[level])
+            if isinstance(level_cfg, dict):
+                thresholds[level] = (level_cfg.get("in_flight_requests"), level_cfg.get("in_flight_llm"))
+        return cls(thresholds, retry_after=float(config.get("retry_after", 5)))
+
+    def level(self) -> int:
+        """当前降级级别"""
+        with self._lock:
+            requests, llm = self.in_flight_requests, self.in_flight_llm
+        for level in (REJECT_LOGINS, TEMPLATE_ONLY, RULE_ONLY):
+            max_requests, max_llm = self.thresholds[level]
+            if (max_requests is not None and requests >= max_requests) or \
+                    (max_llm is not None and llm >= max_llm):
+                return level
+        return NORMAL
+
+    def check(self, required_below: int):
+        """当前级别达到 required_below 时抛出 Overloaded 并计数"""
+        level = self.level()
+        if level >= required_below:
+            with self._lock:
+                self.shed[required_below] += 1
+            raise Overloaded(level, self.retry_after)
+
+    @contextmanager
+    def track_request(self):
+        """统计处理中的消息"""
+        with self._lock:
+            self.in_flight_requests += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight_requests -= 1
+
+    @contextmanager
+    def track_llm_call(self):
+        """统计进行中的 LLM 调用"""
+        with self._lock:
+            self.in_flight_llm += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight_llm -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        level = self.level()
+        with self._lock:
+            return {
+                "level": LEVEL_NAMES[level],
+                "in_flight_requests": self.in_flight_requests,
+                "in_flight_llm": self.in_flight_llm,
+                "shed": {LEVEL_NAMES[lvl]: count for lvl, count in self.shed.items()},
+            }
+
+
+class AdmissionLLMResponder:
+    """
+    按降级级别放行 LLM 调用的代理
+
+    RULE_ONLY 起拒绝路由类调用（意图识别、语义匹配等），TEMPLATE_ONLY 起拒绝兜底回复生成；
+    被拒绝时抛出 Overloaded，由 Chatbot/Interpreter 已有的异常处理退回规则路由或固定模板。
+    放行的调用计入 in_flight_llm；流式调用（stream=True）在迭代结束（或被关闭）前都计入。
+    流式调用本身也是立即执行的：限流、连接错误等异常在调用处抛出，调用方的降级逻辑照常生效。
+    """
+
+    # 方法 -> 从哪个级别开始拒绝
+    LLM_METHODS = {
+        "recognize_intent": RULE_ONLY,
+        "extract_entities": RULE_ONLY,
+        "check_semantic_match": RULE_ONLY,
+        "match_condition_with_llm": RULE_ONLY,
+        "generate_response": TEMPLATE_ONLY,
+    }
+
+    def __init__(self, responder, controller: AdmissionController):
+        self._responder = responder
+        self._controller = controller
+
+    def __getattr__(self, name):
+        attr = getattr(self._responder, name)
+        shed_level = self.LLM_METHODS.get(name)
+        if shed_level is None:
+            return attr
+
+        def admitted_call(*args, **kwargs):
+            self._controller.check(shed_level)
+            with ExitStack() as tracking:
+                tracking.enter_context(self._controller.track_llm_call())
+                result = attr(*args, **kwargs)
+                if not kwargs.get("stream"):
+                    return result
+                # 流式结果交给迭代器包装，计数持续到迭代结束
+                return _TrackedStream(result, tracking.pop_all())
+
+        return admitted_call
+
+
+class _TrackedStream:
+    """流式 LLM 回复的迭代器包装：迭代结束、被关闭或被回收时结束 in_flight_llm 计数"""
+
+    def __init__(self, stream, tracking: ExitStack):
+        self._stream = iter(stream)
+        self._tracking: Optional[ExitStack] = tracking
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        tracking, self._tracking = self._tracking, None
+        if tracking is None:
+            return
+        try:
+            close = getattr(self._stream, "close", None)
+            if close:
+                close()
+        finally:
+            tracking.close()
+
+    def __del__(self):
+        self.close()
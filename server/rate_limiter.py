@@ -0,0 +1,178 @@
+"""
+令牌桶限流
+
+服务器按三个维度限流：
+- connection：每个 TCP 连接，防止单个客户端刷请求
+- user：每个 user_id，同一用户开多个连接也共享额度
+- llm：全局一个桶，保护 LLM 调用配额（超出时本轮退回规则匹配/固定模板）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class RateLimitExceeded(Exception):
+    """超出限流额度"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"{scope} 限流，{retry_after:.2f} 秒后重试")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    令牌桶：容量 burst，每秒补充 rate 个令牌
+
+    非线程安全，由 RateLimiter 加锁访问
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def try_acquire(self, now: float, cost: float = 1.0) -> float:
+        """
+        尝试取出 cost 个令牌
+
+        Returns:
+            0 表示放行；否则为需要等待的秒数
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    按键分桶的令牌桶限流器（线程安全）
+
+    桶按最近使用顺序保存，超过 max_keys 时淘汰最久未使用的桶，
+    避免大量一次性连接使内存无限增长。
+    """
+
+    def __init__(self, scope: str, rate: float, burst: float, max_keys: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            scope: 限流维度名称，用于错误响应与统计
+            rate: 每秒补充的令牌数
+            burst: 桶容量（允许的突发请求数）
+            max_keys: 最多保留的桶数量
+            clock: 单调时钟，测试时可替换
+        """
+        self.scope = scope
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    @classmethod
+    def from_config(cls, scope: str, config: Optional[Dict[str, Any]],
+                    default_rate: float, default_burst: float) -> Optional["RateLimiter"]:
+        """
+        从 config.yaml 的 rate_limit.<scope> 配置创建限流器
+
+        配置为 false 或 rate 不大于 0 时返回None（不限流）
+        """
+        if config is False:
+            return None
+        config = config or {}
+        rate = float(config.get("rate", default_rate))
+        if rate <= 0:
+            return None
+        return cls(scope, rate, float(config.get("burst", default_burst)),
+                   max_keys=int(config.get("max_keys", 10000)))
+
+    def acquire(self, key: str = "", cost: float = 1.0) -> float:
+        """
+        为 key 取出 cost 个令牌
+
+        Returns:
+            0 表示放行；否则为建议的重试等待秒数
+        """
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst, now)
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            retry_after = bucket.try_acquire(now, cost)
+            if retry_after:
+                self.limited += 1
+            else:
+                self.allowed += 1
+            return retry_after
+
+    def check(self, key: str = "", cost: float = 1.0):
+        """同 acquire，超出额度时抛出 RateLimitExceeded"""
+        retry_after = self.acquire(key, cost)
+        if retry_after:
+            raise RateLimitExceeded(self.scope, retry_after)
+
+    def discard(self, key: str):
+        """连接关闭时删除其桶"""
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "keys": len(self._buckets),
+            }
+
+
+class RateLimitedLLMResponder:
+    """
+    LLM 响应器的限流代理
+
+    每次调用 LLM 方法前先从全局 llm 桶取令牌，超出时抛出 RateLimitExceeded，
+    由调用方（Chatbot/Interpreter 中已有的异常处理）退回规则匹配或固定模板回复。
+    其他属性原样转发给被代理的响应器。
+    """
+
+    LLM_METHODS = frozenset({
+        "recognize_intent",
+        "extract_entities",
+        "check_semantic_match",
+        "match_condition_with_llm",
+        "generate_response",
+    })
+
+    def __init__(self, responder, limiter: RateLimiter):
+        self._responder = responder
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._responder, name)
+        if name not in self.LLM_METHODS:
+            return attr
+
+        def limited_call(*args, **kwargs):
+            self._limiter.check()
+            return attr(*args, **kwargs)
+
+        return limited_call
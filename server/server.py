@@ -4,6 +4,8 @@ ChatFlow DSL 服务器端
 支持多个客户端同时连接，每个客户端独立会话
 """
 
+import atexit
+import contextlib
 import socket
 import threading
 import json
@@ -18,6 +20,11 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.chatbot import Chatbot
 from core.database_manager import DatabaseManager
+from core.id_generator import generate_id, set_worker_id
+from core.password_hasher import configure_password_verifier
+from server.admission import REJECT_LOGINS, AdmissionController, AdmissionLLMResponder, Overloaded
+from server.rate_limiter import RateLimitedLLMResponder, RateLimiter
+from server.token_cache import VerifiedTokenCache
 from llm.llm_responder import LLMResponder
 
 
@@ -44,20 +51,45 @@ class ChatServer:
         self.port = port
         self.server_socket = None
 
+        # 限流器：按连接、按用户、全局 LLM 调用三个维度
+        self.rate_limiters = self._init_rate_limiters()
+
         # 从配置文件加载LLM配置
         llm_responder = self._init_llm_responder()
+        if llm_responder and self.rate_limiters.get("llm"):
+            llm_responder = RateLimitedLLMResponder(llm_responder, self.rate_limiters["llm"])
+
+        # 准入控制：过载时逐级关闭 LLM 路由、LLM 兜底回复，最后拒绝新登录
+        self.admission = AdmissionController.from_config(self._load_config().get("admission"))
+        if llm_responder and self.admission:
+            llm_responder = AdmissionLLMResponder(llm_responder, self.admission)
 
         # 初始化聊天机器人（传入LLM响应器）
-        self.chatbot = Chatbot(llm_responder=llm_responder)
+        self.chatbot = Chatbot(
+            llm_responder=llm_responder,
+            speculative_intent=bool(self._load_config().get("speculative_intent", False)),
+            flow_table=(self._load_config().get("flows") or {}).get("table"),
+        )
+        self._init_password_verifier()
         self.db = DatabaseManager()  # 数据库管理器，用于用户认证
+        self._init_id_worker()
+        plaintext = self.db.count_plaintext_passwords()
+        if plaintext:
+            print(f"[服务器] 警告: {plaintext} 个用户的密码仍为明文存储，请运行 python -m core.migrate_passwords")
         self.running = False
         self.clients = {}  # 存储活跃的客户端连接 {session_id: (conn, addr)}
         self.authenticated_users = {}  # 存储已认证的用户 {session_id: user_id}
+        # 连接 -> 对话会话ID。对话会话ID写在 JWT 的 sid 字段中，与连接地址无关，
+        # 客户端断线重连后凭 Token 恢复同一个对话会话
+        self.conversations = {}  # {session_id: conversation_id}
         self.clients_lock = threading.Lock()  # 保护客户端字典的线程锁
 
         # 初始化 JWT 配置
         self.jwt_secret, self.jwt_exp_hours = self._init_jwt_config()
         self.jwt_algorithm = "HS256"
+        # 已验证 Token 缓存：同一 Token 重复出现时只需一次查表
+        auth_cfg = self._load_config().get("auth", {}) or {}
+        self.token_cache = VerifiedTokenCache(max_size=int(auth_cfg.get("token_cache_size") or 10000))
 
         print(f"[服务器] 初始化完成")
         print(f"[服务器] 已加载 {len(self.chatbot.flows)} 个业务流程")
@@ -105,7 +137,9 @@ class ChatServer:
                 api_key=api_key,
                 model_name=llm_config.get("model_name", "gpt-3.5-turbo"),
                 base_url=llm_config.get("base_url"),
-                timeout=llm_config.get("timeout", 30)
+                timeout=llm_config.get("timeout", 30),
+                context_token_budget=llm_config.get("context_token_budget", 300),
+                json_mode=llm_config.get("json_mode", True)
             )
 
             print(f"[服务器] 运行模式: {mode}")
@@ -149,14 +183,117 @@ class ChatServer:
         print(f"[服务器] JWT 已启用，有效期 {exp_hours} 小时")
         return secret, exp_hours
 
-    def _generate_jwt(self, user_id: str, username: str) -> str | None:
-        """为已认证用户生成 JWT Token。"""
+    def _load_config(self) -> dict:
+        """读取 config/config.yaml，文件不存在或解析失败时返回空字典"""
+        config_path = os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "config",
+            "config.yaml",
+        )
+        try:
+            if os.path.exists(config_path):
+                with open(config_path, "r", encoding="utf-8") as f:
+                    return yaml.safe_load(f) or {}
+        except Exception as e:
+            print(f"[服务器] 读取配置文件出错: {e}")
+        return {}
+
+    def _init_rate_limiters(self) -> dict:
+        """
+        根据 rate_limit 配置创建限流器，返回 {维度: RateLimiter}
+
+        未配置的维度使用默认值；rate_limit.enabled 为 false 时不限流
+        """
+        config = self._load_config().get("rate_limit", {}) or {}
+        if config.get("enabled") is False:
+            print("[服务器] 限流已关闭")
+            return {}
+        limiters = {}
+        for scope, (rate, burst) in (("connection", (2, 10)), ("user", (5, 20)), ("llm", (5, 10))):
+            limiter = RateLimiter.from_config(scope, config.get(scope), rate, burst)
+            if limiter:
+                limiters[scope] = limiter
+                print(f"[服务器] 限流 {scope}: {limiter.rate:g} 次/秒，突发 {limiter.burst:g}")
+        return limiters
+
+    def _check_rate_limit(self, scope: str, key: str):
+        """
+        从指定维度的令牌桶取令牌
+
+        Returns:
+            放行时返回None；超出额度时返回 rate_limited 错误响应
+        """
+        limiter = self.rate_limiters.get(scope)
+        if limiter is None:
+            return None
+        retry_after = limiter.acquire(key)
+        if not retry_after:
+            return None
+        retry_after = round(retry_after, 2)
+        return {
+            "type": "error",
+            "code": "rate_limited",
+            "scope": scope,
+            "retry_after": retry_after,
+            "message": f"请求过于频繁，请 {retry_after} 秒后再试。",
+        }
+
+    def _track_request(self):
+        """统计处理中的消息；未启用准入控制时为空操作"""
+        return self.admission.track_request() if self.admission else contextlib.nullcontext()
+
+    def _check_login_admission(self, response_type: str):
+        """
+        过载到 REJECT_LOGINS 级别时拒绝新的登录/注册
+
+        Returns:
+            放行时返回None；否则返回带 retry_after 的失败响应
+        """
+        if self.admission is None:
+            return None
+        try:
+            self.admission.check(REJECT_LOGINS)
+        except Overloaded as e:
+            return {
+                "type": response_type,
+                "success": False,
+                "code": "overloaded",
+                "retry_after": e.retry_after,
+                "message": f"当前访问人数过多，请 {e.retry_after:g} 秒后再试。",
+            }
+        return None
+
+    def _init_password_verifier(self):
+        """根据 auth.password_workers 配置密码校验进程池"""
+        auth_cfg = self._load_config().get("auth", {}) or {}
+        workers = auth_cfg.get("password_workers")
+        verifier = configure_password_verifier(
+            max_workers=int(workers) if workers else None,
+            max_pending=auth_cfg.get("password_max_pending"),
+        )
+        print(f"[服务器] 密码校验进程池: {verifier.max_workers} 个进程")
+
+    def _init_id_worker(self):
+        """
+        从数据库租用业务ID的 worker 号，共用同一数据库的多个服务器进程生成的
+        订单/退款/发票号不会重复；配置了 ids.worker_id 时检查是否与其他进程冲突
+        """
+        configured = (self._load_config().get("ids") or {}).get("worker_id")
+        worker_id = self.db.claim_id_worker(None if configured in (None, "") else int(configured))
+        set_worker_id(worker_id)
+        atexit.register(self.db.release_id_worker, worker_id)
+        print(f"[服务器] 业务ID worker 号: {worker_id}")
+
+    def _generate_jwt(self, user_id: str, username: str, conversation_id: str | None = None) -> str | None:
+        """为已认证用户生成 JWT Token，conversation_id 写入 sid 字段用于断线重连后恢复会话。"""
         try:
             payload = {
                 "user_id": user_id,
                 "username": username,
                 "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=self.jwt_exp_hours),
             }
+            if conversation_id:
+                payload["sid"] = conversation_id
             token = jwt.encode(payload, self.jwt_secret, algorithm=self.jwt_algorithm)
             return token
         except Exception as e:
@@ -164,9 +301,20 @@ class ChatServer:
             return None
 
     def _verify_jwt(self, token: str):
-        """验证客户端提交的 JWT Token，返回(user_id, payload) 或 (None, None)。"""
+        """
+        验证客户端提交的 JWT Token，返回(user_id, payload) 或 (None, None)。
+
+        完整校验通过的 Token 进入缓存，直到其 exp 之前重复验证只需一次查表。
+        """
+        payload = self.token_cache.get(token)
+        if payload is not None:
+            return payload.get("user_id"), payload
+        if self.token_cache.is_revoked(token):
+            print("[服务器] JWT 已被吊销")
+            return None, None
         try:
             payload = jwt.decode(token, self.jwt_secret, algorithms=[self.jwt_algorithm])
+            self.token_cache.put(token, payload)
             user_id = payload.get("user_id")
             return user_id, payload
         except jwt.ExpiredSignatureError:
@@ -177,6 +325,67 @@ class ChatServer:
             print(f"[服务器] 验证 JWT 时出错: {e}")
         return None, None
 
+    def _start_conversation(self, session_id: str, user_id: str) -> str:
+        """登录/注册成功后为连接分配新的对话会话ID"""
+        conversation_id = generate_id("S")
+        with self.clients_lock:
+            self.authenticated_users[session_id] = user_id
+            self.conversations[session_id] = conversation_id
+        return conversation_id
+
+    def _resume_conversation(self, session_id: str, user_id: str, conversation_id: str) -> dict:
+        """
+        将连接绑定到已有的对话会话，并立即回收被这次恢复替换的资源
+
+        - 仍绑定在该对话会话上的旧连接（半开连接）被关闭
+        - 该连接此前绑定的另一个对话会话（如重连后先登录再恢复）若已没有其他连接绑定则被删除，
+          不必等到超时；同一用户其他设备的会话不受影响，它们断线后仍可各自恢复
+        """
+        stale_conns = []
+        replaced = []
+        with self.clients_lock:
+            previous = self.conversations.get(session_id)
+            for other_id, other_conversation in list(self.conversations.items()):
+                if other_id != session_id and other_conversation == conversation_id:
+                    del self.conversations[other_id]
+                    self.authenticated_users.pop(other_id, None)
+                    if other_id in self.clients:
+                        stale_conns.append(self.clients[other_id][0])
+            self.authenticated_users[session_id] = user_id
+            self.conversations[session_id] = conversation_id
+            if previous and previous != conversation_id and previous not in self.conversations.values():
+                replaced.append(previous)
+
+        for stale_conn in stale_conns:
+            # 先 shutdown 才能唤醒阻塞在 recv 上的旧连接线程，由其自行清理
+            try:
+                stale_conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        session_manager = self.chatbot.session_manager
+        removed = session_manager.clear_user_sessions(user_id, replaced)
+        session = session_manager.find_session(conversation_id)
+        if session is not None and session.user_id != user_id:
+            session = None
+        return {
+            "resumed": session is not None,
+            "current_state_id": session.current_state_id if session else None,
+            "active_flow_name": session.get("active_flow_name") if session else None,
+            "removed_sessions": removed,
+        }
+
+    def revoke_jwt(self, token: str):
+        """吊销 Token（如用户修改密码或被封禁），在其过期之前都不再被接受。"""
+        exp = None
+        try:
+            payload = jwt.decode(token, self.jwt_secret, algorithms=[self.jwt_algorithm],
+                                 options={"verify_exp": False})
+            exp = payload.get("exp")
+        except jwt.InvalidTokenError:
+            pass
+        self.token_cache.revoke(token, exp=exp)
+
     def start(self):
         """启动服务器，开始监听客户端连接"""
         try:
@@ -270,6 +479,24 @@ class ChatServer:
 
                     print(f"[线程-{session_id}] 收到消息: {request.get('content', request)}")
 
+                    # 按连接限流（心跳与退出不计入）
+                    if request.get("type") not in ("ping", "exit"):
+                        limited = self._check_rate_limit("connection", session_id)
+                        if limited:
+                            print(f"[线程-{session_id}] 连接请求过于频繁，已限流")
+                            self._send_message(conn, limited)
+                            continue
+
+                    # 过载时拒绝新的登录/注册，优先保证已有对话
+                    if request.get("type") in ("login", "register"):
+                        rejected = self._check_login_admission(
+                            "auth_result" if request.get("type") == "login" else "register_result"
+                        )
+                        if rejected:
+                            print(f"[线程-{session_id}] 服务器过载，拒绝{request.get('type')}请求")
+                            self._send_message(conn, rejected)
+                            continue
+
                     # 处理不同类型的请求
                     if request.get("type") == "login":
                         # 处理登录请求
@@ -284,16 +511,16 @@ class ChatServer:
                         if user_data:
                             # 认证成功
                             user_id = user_data["user_id"]
-                            with self.clients_lock:
-                                self.authenticated_users[session_id] = user_id
+                            conversation_id = self._start_conversation(session_id, user_id)
 
-                            token = self._generate_jwt(user_id, user_data["username"])
+                            token = self._generate_jwt(user_id, user_data["username"], conversation_id)
 
                             response = {
                                 "type": "auth_result",
                                 "success": True,
                                 "user_id": user_id,
                                 "username": user_data["username"],
+                                "session_id": conversation_id,
                                 "message": f"登录成功！欢迎您，{user_data['username']}！",
                             }
                             if token:
@@ -326,16 +553,16 @@ class ChatServer:
                         if result["success"]:
                             # 注册成功，自动登录
                             user_id = result["user_id"]
-                            with self.clients_lock:
-                                self.authenticated_users[session_id] = user_id
+                            conversation_id = self._start_conversation(session_id, user_id)
 
-                            token = self._generate_jwt(user_id, username)
+                            token = self._generate_jwt(user_id, username, conversation_id)
 
                             response = {
                                 "type": "register_result",
                                 "success": True,
                                 "user_id": user_id,
                                 "username": username,
+                                "session_id": conversation_id,
                                 "message": result["message"],
                             }
                             if token:
@@ -352,14 +579,44 @@ class ChatServer:
 
                         self._send_message(conn, response)
 
+                    elif request.get("type") == "resume":
+                        # 断线重连：凭登录时下发的 JWT 恢复对话会话，无需重新登录或重放对话
+                        user_id, payload = self._verify_jwt(request.get("token", ""))
+                        conversation_id = payload.get("sid") if payload else None
+                        if not user_id or not conversation_id:
+                            response = {
+                                "type": "resume_result",
+                                "success": False,
+                                "message": "会话凭证无效或已过期，请重新登录。"
+                            }
+                        else:
+                            response = {
+                                "type": "resume_result",
+                                "success": True,
+                                "user_id": user_id,
+                                "username": payload.get("username"),
+                                "session_id": conversation_id,
+                            }
+                            response.update(self._resume_conversation(session_id, user_id, conversation_id))
+                            print(f"[线程-{session_id}] 用户 {user_id} 恢复会话 {conversation_id}，"
+                                  f"当前状态: {response['current_state_id']}")
+                        self._send_message(conn, response)
+
                     elif request.get("type") == "message":
                         # 普通对话消息 - 需要先认证
                         user_id = None
+                        conversation_id = None
 
-                        # 1) 尝试从 JWT 中获取 user_id
+                        # 1) 尝试从 JWT 中获取 user_id 与对话会话ID
                         token = request.get("token")
                         if token:
-                            user_id, _ = self._verify_jwt(token)
+                            user_id, payload = self._verify_jwt(token)
+                            if user_id:
+                                conversation_id = payload.get("sid")
+                            if conversation_id:
+                                # 只发送带 Token 消息的连接也记录其对话会话，断线前可被识别为仍在使用
+                                with self.clients_lock:
+                                    self.conversations[session_id] = conversation_id
 
                         # 2) 若无有效 JWT，则退回到基于 session_id 的认证表
                         if not user_id:
@@ -374,17 +631,38 @@ class ChatServer:
                             self._send_message(conn, response)
                             continue
 
-                        user_input = request.get("content", "")
+                        # 按用户限流：同一用户的多个连接共享额度
+                        limited = self._check_rate_limit("user", user_id)
+                        if limited:
+                            print(f"[线程-{session_id}] 用户 {user_id} 请求过于频繁，已限流")
+                            self._send_message(conn, limited)
+                            continue
 
-                        # 调用聊天机器人处理消息，传入user_id
-                        response_text = self.chatbot.handle_message(session_id, user_input, user_id=user_id)
+                        user_input = request.get("content", "")
 
-                        # 构造响应消息
+                        if not conversation_id:
+                            with self.clients_lock:
+                                conversation_id = self.conversations.get(session_id, session_id)
+
+                        # 调用聊天机器人处理消息，传入user_id；处理中的消息数计入准入控制
+                        # stream 为 true 时，LLM 生成的回复边生成边以 response_chunk 帧发送
+                        stream = bool(request.get("stream"))
+                        with self._track_request():
+                            response_text = self.chatbot.handle_message(
+                                conversation_id, user_input, user_id=user_id,
+                                request_id=request.get("request_id"), stream=stream
+                            )
+                            if stream:
+                                response_text = self._send_response_chunks(conn, response_text, conversation_id)
+
+                        # 构造响应消息（流式请求时为完整内容，标志本轮结束）
                         response = {
                             "type": "response",
                             "content": response_text,
-                            "session_id": session_id
+                            "session_id": conversation_id
                         }
+                        if stream:
+                            response["streamed"] = True
 
                         # 发送响应
                         self._send_message(conn, response)
@@ -426,6 +704,10 @@ class ChatServer:
             with self.clients_lock:
                 if session_id in self.clients:
                     del self.clients[session_id]
+                # 对话会话保留在 SessionManager 中，客户端可凭 Token 重连恢复
+                self.conversations.pop(session_id, None)
+                if "connection" in self.rate_limiters:
+                    self.rate_limiters["connection"].discard(session_id)
                 # 清理认证信息
                 if session_id in self.authenticated_users:
                     user_id = self.authenticated_users[session_id]
@@ -440,16 +722,49 @@ class ChatServer:
 
             print(f"[线程-{session_id}] 连接已关闭，剩余活跃客户端: {len(self.clients)}")
 
+    def _send_response_chunks(self, conn, replies, conversation_id):
+        """
+        逐段发送回复：每个文本片段一个 response_chunk 帧
+
+        Args:
+            replies: Chatbot.handle_message 的返回值，元素为字符串或文本片段迭代器
+
+        Returns:
+            拼接完成的回复列表，用于最后的 response 帧
+        """
+        contents = []
+        for index, reply in enumerate(replies):
+            parts = [reply] if isinstance(reply, str) else reply
+            text = []
+            try:
+                for delta in parts:
+                    text.append(delta)
+                    self._send_message(conn, {
+                        "type": "response_chunk",
+                        "index": index,
+                        "delta": delta,
+                        "session_id": conversation_id,
+                    })
+            finally:
+                # 客户端断开时及时结束 LLM 流式请求
+                close = getattr(parts, "close", None)
+                if close:
+                    close()
+            contents.append("".join(text))
+        return contents
+
     def _send_message(self, conn, message):
         """
         发送JSON消息到客户端
 
+        每条消息以换行结尾，流式回复时连续发送的多帧可被客户端逐条拆分
+
         Args:
             conn: 客户端连接
             message: 消息字典
         """
         try:
-            data = json.dumps(message, ensure_ascii=False).encode('utf-8')
+            data = json.dumps(message, ensure_ascii=False).encode('utf-8') + b"\n"
             conn.sendall(data)
         except Exception as e:
             print(f"[服务器] 发送消息失败: {e}")
@@ -483,9 +798,20 @@ class ChatServer:
         with self.clients_lock:
             return {
                 "active_clients": len(self.clients),
-                "clients": list(self.clients.keys())
+                "clients": list(self.clients.keys()),
+                "token_cache": self.token_cache.stats(),
+                "rate_limits": {scope: limiter.stats() for scope, limiter in self.rate_limiters.items()},
+                "admission": self.admission.stats() if self.admission else None,
+                "llm_prompt": self._get_prompt_stats(),
             }
 
+    def _get_prompt_stats(self):
+        """LLM 提示词体积统计，未配置 LLM 时返回None"""
+        llm_responder = self.chatbot.llm_responder
+        if llm_responder is None:
+            return None
+        return llm_responder.get_prompt_stats()
+
 
 def main():
     """服务器主函数"""
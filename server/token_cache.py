@@ -0,0 +1,103 @@
+"""
+已验证 JWT 缓存
+
+客户端在一个会话中会反复携带同一个 Token，完整的 jwt.decode（HMAC 校验 + exp 检查）
+只需在第一次出现时执行，之后凭 Token 摘要查表即可。
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class VerifiedTokenCache:
+    """
+    已验证 Token 缓存（LRU，容量有限）
+
+    - 以 Token 的 SHA-256 摘要为键，不在内存中保存原始 Token；
+      被篡改的 Token 摘要不同，必然重新完整校验
+    - 条目在 Token 的 exp 时刻过期
+    - 支持吊销：被吊销的 Token 在其 exp 之前始终视为无效
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        # 摘要 -> (exp 时间戳, payload)
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # 摘要 -> exp 时间戳，过期后自动清理
+        self._revoked: Dict[bytes, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        """返回已验证且未过期的 payload，未命中时返回None"""
+        key = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, payload: Dict[str, Any]):
+        """缓存完整校验通过的 Token；没有 exp 的 Token 不缓存"""
+        exp = payload.get("exp")
+        if not isinstance(exp, (int, float)):
+            return
+        key = self._digest(token)
+        with self._lock:
+            if key in self._revoked:
+                return
+            self._entries[key] = (float(exp), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def revoke(self, token: str, exp: Optional[float] = None):
+        """
+        吊销 Token
+
+        Args:
+            token: 要吊销的 Token
+            exp: Token 的过期时间，为None时取缓存中的值；都没有时保留 24 小时
+        """
+        key = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if exp is None:
+                exp = entry[0] if entry else now + 24 * 3600
+            self._revoked[key] = float(exp)
+            # 顺带清理已过期的吊销记录，吊销列表只保留仍可能被使用的 Token
+            for revoked_key in [k for k, e in self._revoked.items() if e <= now]:
+                del self._revoked[revoked_key]
+
+    def is_revoked(self, token: str) -> bool:
+        with self._lock:
+            exp = self._revoked.get(self._digest(token))
+        return exp is not None and exp > time.time()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "revoked": len(self._revoked),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
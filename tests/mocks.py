@@ -56,17 +56,25 @@ class MockLLMResponder:
 
     # -------- 基础 Mock 能力 --------
 
-    def recognize_intent(self, text: str, context: Optional[Dict] = None) -> str:
+    def recognize_intent(self, text: Optional[str] = None, context: Optional[Dict] = None, *,
+                         user_input: Optional[str] = None, available_intents=None,
+                         session_context: Optional[Dict] = None):
         """
         识别用户意图（简单关键词匹配版本）
 
         Args:
             text: 用户输入
             context: 上下文信息（未使用，保持接口兼容）
+            user_input / available_intents / session_context: 与 LLMResponder.recognize_intent
+                一致的关键字参数（Chatbot 的调用方式）
 
         Returns:
-            意图名称
+            意图名称；以 user_input= 调用时返回 {"intent", "confidence", "reasoning"}
         """
+        if user_input is not None:
+            intent = self.recognize_intent(user_input)
+            return {"intent": intent, "confidence": 0.8, "reasoning": "Mock关键词匹配"}
+
         text_lower = text.lower()
 
         # 按关键词匹配意图
@@ -0,0 +1,392 @@
+"""
+ActionExecutor 单元测试
+
+使用Mock数据库，覆盖模板渲染等不依赖真实数据的逻辑
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.mocks import MockDatabaseManager
+from core.action_executor import ActionExecutor
+from core.session_manager import Session
+from dsl.dsl_parser import ChatFlow
+from dsl.template import TemplateVariable, compile_template
+from core.product_index import ProductSelectionIndex
+from core.vocabulary import KeywordTrie
+from core.database_manager import DatabaseManager
+
+
+class TestTemplateCompilation(unittest.TestCase):
+    """测试回复模板预编译"""
+
+    def test_compile_splits_literals_and_variables(self):
+        template = compile_template("订单号：{{ session.current_order.order_id }}，状态：{{session.order_status_text}}")
+        self.assertEqual(len(template.segments), 4)
+        self.assertEqual(template.segments[0], "订单号：")
+        self.assertIsInstance(template.segments[1], TemplateVariable)
+        self.assertEqual(template.segments[1].parts, ("current_order", "order_id"))
+        self.assertEqual([v.path for v in template.variables],
+                         ["session.current_order.order_id", "session.order_status_text"])
+
+    def test_compile_plain_text(self):
+        template = compile_template("感谢咨询")
+        self.assertEqual(template.segments, ["感谢咨询"])
+        self.assertEqual(template.render(lambda v: "x"), "感谢咨询")
+
+    def test_expression_is_not_valid_path(self):
+        template = compile_template("{{session.a.b if session.a else '无'}}")
+        self.assertFalse(template.variables[0].is_valid)
+
+
+class TestRespondRendering(unittest.TestCase):
+    """测试 respond 动作的渲染结果"""
+
+    def setUp(self):
+        self.mock_db = MockDatabaseManager(use_memory=True)
+        self.executor = ActionExecutor(db_manager=self.mock_db)
+
+    def tearDown(self):
+        self.mock_db.close()
+
+    def test_render_nested_and_missing_variables(self):
+        session = Session("render-test")
+        session.variables["current_order"] = {"order_id": "A1234567890", "quantity": 2}
+        action = {"type": "respond", "text": "{{session.current_order.order_id}} x{{ session.current_order.quantity }}{{session.missing.value}}"}
+        self.assertEqual(self.executor._handle_respond(action, session), "A1234567890 x2")
+
+    def test_render_display_variable(self):
+        session = {"variables": {"current_order": {"status": "shipped", "tracking_number": "SF1"}}}
+        action = {"type": "respond", "text": "{{session.order_status_text}} {{session.tracking_info}}"}
+        self.assertEqual(self.executor._handle_respond(action, session), "已发货 物流单号：SF1")
+
+    def test_non_session_placeholder_kept(self):
+        session = Session("render-test")
+        action = {"type": "respond", "text": "{{'成功' if session.ok else '失败'}}"}
+        self.assertEqual(self.executor._handle_respond(action, session), "{{'成功' if session.ok else '失败'}}")
+
+    def test_compile_flow_reports_unknown_variables(self):
+        flow = ChatFlow({
+            "name": "测试流程",
+            "entry_point": "s1",
+            "states": [
+                {
+                    "id": "s1",
+                    "actions": [
+                        {"type": "api_call", "endpoint": "database://orders/get", "save_to": "session.current_order"},
+                        {"type": "respond", "text": "{{session.current_order.order_id}} {{session.order_status_text}}"},
+                        {"type": "respond", "text": "{{session.not_defined}}"},
+                    ],
+                }
+            ],
+        })
+        warnings = self.executor.compile_flow(flow)
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("session.not_defined", warnings[0])
+        self.assertIn("{{session.not_defined}}", self.executor._templates)
+
+
+class TestLazyDisplayVariables(unittest.TestCase):
+    """测试显示变量的惰性计算与按版本缓存"""
+
+    def setUp(self):
+        self.mock_db = MockDatabaseManager(use_memory=True)
+        self.executor = ActionExecutor(db_manager=self.mock_db)
+        self.calls = []
+        source, formatter = self.executor._display_providers["session.order_list_text"]
+
+        def counting_formatter(value):
+            self.calls.append(value)
+            return formatter(value)
+
+        self.executor._display_providers["session.order_list_text"] = (source, counting_formatter)
+
+    def tearDown(self):
+        self.mock_db.close()
+
+    def test_unreferenced_display_variable_not_computed(self):
+        session = Session("lazy-test")
+        session.variables["user_orders"] = [{"order_id": "A1", "product_name": "耳机", "status": "paid"}]
+        self.executor._handle_respond({"type": "respond", "text": "你好 {{session.order_id}}"}, session)
+        self.assertEqual(self.calls, [])
+
+    def test_display_variable_memoized_until_source_changes(self):
+        session = Session("lazy-test")
+        session.variables["user_orders"] = [{"order_id": "A1", "product_name": "耳机", "status": "paid"}]
+        action = {"type": "respond", "text": "{{session.order_list_text}}"}
+
+        first = self.executor._handle_respond(action, session)
+        second = self.executor._handle_respond(action, session)
+        self.assertEqual(first, "• A1 - 耳机 [已付款]")
+        self.assertEqual(second, first)
+        self.assertEqual(len(self.calls), 1)
+
+        session.variables["user_orders"] = []
+        self.assertEqual(self.executor._handle_respond(action, session), "暂无订单记录")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_search_results_derived_variables_set_on_store(self):
+        session = Session("lazy-test")
+        session.last_user_input = "蓝牙耳机"
+        action = {
+            "type": "api_call",
+            "endpoint": "database://products/search",
+            "params": {"keyword": "蓝牙耳机"},
+            "save_to": "session.search_results",
+        }
+        self.executor._handle_api_call(action, session)
+        self.assertEqual(session.variables["search_result_count"], 1)
+        self.assertEqual(session.variables["current_product"]["product_id"], "P001")
+
+
+class TestProductSelectionIndex(unittest.TestCase):
+    """测试搜索结果选择索引"""
+
+    def setUp(self):
+        self.results = [
+            {"product_id": "P011", "name": "平板电脑 11", "price": 2409.0},
+            {"product_id": "P012", "name": "平板电脑 12", "price": 2419.0},
+            {"product_id": "P013", "name": "平板电脑 Pro", "price": 2399.0},
+        ]
+        self.index = ProductSelectionIndex(self.results)
+
+    def test_price_match_takes_precedence(self):
+        self.assertEqual(self.index.select("价格是2419.0的这一款")["product_id"], "P012")
+
+    def test_number_in_name(self):
+        self.assertEqual(self.index.select("平板电脑12")["product_id"], "P012")
+
+    def test_number_as_position(self):
+        self.assertEqual(self.index.select("第3个")["product_id"], "P013")
+
+    def test_keyword_score_and_tie_break(self):
+        self.assertEqual(self.index.select("PRO 那款")["product_id"], "P013")
+        # 所有商品得分相同，取排在最前面的
+        self.assertEqual(self.index.select("平板")["product_id"], "P011")
+        self.assertIsNone(self.index.select("键盘"))
+
+    def test_index_built_when_results_stored(self):
+        mock_db = MockDatabaseManager(use_memory=True)
+        executor = ActionExecutor(db_manager=mock_db)
+        session = Session("select-test")
+        session.last_user_input = "充电宝"
+        executor._handle_api_call({
+            "type": "api_call",
+            "endpoint": "database://products/search",
+            "params": {"keyword": "充电宝"},
+            "save_to": "session.search_results",
+        }, session)
+        index = session._search_index
+        self.assertIs(index.results, session.variables["search_results"])
+
+        session.last_user_input = "第1个"
+        executor._handle_select_product_from_results({"type": "select_product_from_results"}, session)
+        self.assertTrue(session.variables["product_selected"])
+        self.assertIs(session._search_index, index)
+        mock_db.close()
+
+
+class TestProductVocabulary(unittest.TestCase):
+    """测试商品词表与搜索关键词提取"""
+
+    def test_trie_longest_match(self):
+        trie = KeywordTrie(["耳机", "蓝牙耳机", "无线蓝牙耳机", "USB-C"])
+        self.assertEqual(trie.longest_match("我想买个无线蓝牙耳机"), "无线蓝牙耳机")
+        self.assertEqual(trie.longest_match("有usb-c的扩展坞吗"), "USB-C")
+        self.assertIsNone(trie.longest_match("随便看看"))
+
+    def test_vocabulary_follows_catalog_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = DatabaseManager(db_path=os.path.join(tmp_dir, "vocab.db"))
+            executor = ActionExecutor(db_manager=db)
+
+            # 商品表中的名称与分类也会进入词表
+            self.assertEqual(executor._extract_product_search_keyword("有扫地机器人吗"), "扫地机器人")
+            self.assertEqual(executor._extract_product_search_keyword("看看智能家居"), "智能家居")
+            self.assertEqual(executor._extract_product_search_keyword("随便"), "随便")
+
+            db.add_product({
+                "product_id": "P900",
+                "name": "空气净化器 1",
+                "category": "家用电器",
+                "price": 999.0,
+                "stock": 10,
+            })
+            self.assertEqual(executor._extract_product_search_keyword("我想买空气净化器"), "空气净化器")
+
+    def test_vocabulary_follows_writes_from_other_processes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "vocab.db")
+            executor = ActionExecutor(db_manager=DatabaseManager(db_path=db_path))
+            self.assertNotEqual(executor._extract_product_search_keyword("有筋膜枪吗"), "筋膜枪")
+            version = executor.db.catalog_version
+
+            # 其他服务器进程或导入工具直接写入商品表
+            conn = sqlite3.connect(db_path)
+            with conn:
+                conn.execute("INSERT INTO products (product_id, name, category, price, stock) "
+                             "VALUES ('P901', '筋膜枪 2', '运动健康', 299.0, 5)")
+            conn.close()
+
+            self.assertGreater(executor.db.catalog_version, version)
+            self.assertEqual(executor._extract_product_search_keyword("有筋膜枪吗"), "筋膜枪")
+
+
+class TestActionPipeline(unittest.TestCase):
+    """测试动作注册表与编译后的动作流水线"""
+
+    def setUp(self):
+        self.mock_db = MockDatabaseManager(use_memory=True)
+        self.executor = ActionExecutor(db_manager=self.mock_db)
+        self.actions = [
+            {"type": "respond", "text": "订单：{{session.current_order.order_id}}"},
+            {"type": "api_call", "endpoint": "database://orders/get",
+             "params": {"order_id": "{{session.order_id}}"}, "save_to": "session.current_order"},
+            {"type": "wait_for_input"},
+        ]
+        self.flow = ChatFlow({
+            "name": "流水线测试",
+            "entry_point": "s1",
+            "states": [{"id": "s1", "actions": self.actions}],
+        })
+
+    def tearDown(self):
+        self.mock_db.close()
+
+    def test_pipeline_compiled_at_flow_load(self):
+        self.executor.compile_flow(self.flow)
+        pipeline = self.executor._get_pipeline(self.actions, ("流水线测试", "s1"))
+        self.assertIs(pipeline, self.executor._pipelines[("流水线测试", "s1")])
+        self.assertEqual(len(pipeline.data_steps), 1)
+        self.assertEqual(len(pipeline.respond_steps), 1)
+
+        session = Session("pipeline-test")
+        session.variables["order_id"] = "A1234567890"
+        # 数据动作先于回复动作执行
+        self.assertEqual(self.executor.execute(self.actions, session), ["订单：A1234567890"])
+
+    def test_register_custom_action_and_endpoint(self):
+        self.executor.compile_flow(self.flow)
+        compiled = self.executor._pipelines[("流水线测试", "s1")]
+        calls = []
+        self.executor.register_database_endpoint("coupons/list", lambda params, session: [params["limit"]])
+        self.executor.register_action("log_event", lambda action, session: calls.append(action["event"]))
+        self.executor.register_action("say_hi", lambda action, session: "你好", produces_response=True)
+
+        actions = [
+            {"type": "say_hi"},
+            {"type": "log_event", "event": "opened"},
+            {"type": "api_call", "endpoint": "database://coupons/list",
+             "params": {"limit": 3}, "save_to": "session.coupons"},
+        ]
+        session = Session("plugin-test")
+        self.assertEqual(self.executor.execute(actions, session), ["你好"])
+        self.assertEqual(calls, ["opened"])
+        self.assertEqual(session.variables["coupons"], [3])
+        # 已缓存的流水线在注册表变化后被重新编译
+        recompiled = self.executor._pipelines[("流水线测试", "s1")]
+        self.assertIsNot(recompiled, compiled)
+        self.assertIs(recompiled.actions, self.actions)
+
+    def test_pipeline_cache_keyed_by_state(self):
+        session = Session("cache-test")
+        session.variables["order_id"] = "A1234567890"
+        # 未预编译的状态在首次执行时编译并缓存，之后复用
+        self.assertEqual(self.executor.execute(self.actions, session, ("流水线测试", "s1")), ["订单：A1234567890"])
+        pipeline = self.executor._pipelines[("流水线测试", "s1")]
+        self.executor.execute(self.actions, session, ("流水线测试", "s1"))
+        self.assertIs(self.executor._pipelines[("流水线测试", "s1")], pipeline)
+
+        # 流程重新加载后同一状态的动作列表被替换，缓存随之更新
+        reloaded = [dict(action) for action in self.actions]
+        self.executor.execute(reloaded, session, ("流水线测试", "s1"))
+        self.assertIs(self.executor._pipelines[("流水线测试", "s1")].actions, reloaded)
+
+        # 临时构造的动作列表不进入缓存
+        self.executor.execute([{"type": "respond", "text": "临时"}], session)
+        self.assertEqual(list(self.executor._pipelines), [("流水线测试", "s1")])
+
+    def test_compile_flow_reports_unknown_action_and_endpoint(self):
+        flow = ChatFlow({
+            "name": "未知动作",
+            "entry_point": "s1",
+            "states": [{"id": "s1", "actions": [
+                {"type": "teleport"},
+                {"type": "api_call", "endpoint": "database://nowhere/get", "save_to": "session.x"},
+            ]}],
+        })
+        warnings = self.executor.compile_flow(flow)
+        self.assertEqual(len(warnings), 2)
+        self.assertIn("teleport", warnings[0])
+        self.assertIn("database://nowhere/get", warnings[1])
+
+
+class TestParallelApiCalls(unittest.TestCase):
+    """测试同一状态内互不依赖的 api_call 并行执行"""
+
+    def setUp(self):
+        self.mock_db = MockDatabaseManager(use_memory=True)
+        self.executor = ActionExecutor(db_manager=self.mock_db)
+        # 两个调用必须同时进入处理函数才能通过屏障，串行执行会超时
+        self.barrier = threading.Barrier(2, timeout=5)
+
+        def slow_endpoint(name):
+            def handler(params, session):
+                self.barrier.wait()
+                return {"name": name, "params": params}
+            return handler
+
+        self.executor.register_database_endpoint("demo/a", slow_endpoint("a"), reads=())
+        self.executor.register_database_endpoint("demo/b", slow_endpoint("b"), reads=())
+
+    def tearDown(self):
+        self.mock_db.close()
+
+    def test_independent_calls_run_concurrently(self):
+        actions = [
+            {"type": "api_call", "endpoint": "database://demo/a",
+             "params": {"id": "{{session.order_id}}"}, "save_to": "session.a"},
+            {"type": "api_call", "endpoint": "database://demo/b", "save_to": "session.b"},
+            {"type": "respond", "text": "{{session.a.name}}{{session.b.name}}"},
+        ]
+        pipeline = self.executor.compile_actions(actions)
+        self.assertEqual(len(pipeline.data_steps), 1)
+
+        session = Session("parallel-test")
+        session.variables["order_id"] = "A1"
+        self.assertEqual(self.executor.execute(actions, session), ["ab"])
+        self.assertEqual(session.variables["a"]["params"], {"id": "A1"})
+        # 结果按声明顺序写回
+        self.assertEqual(list(session.variables), ["order_id", "a", "b"])
+
+    def test_dependent_and_write_calls_stay_sequential(self):
+        self.executor.register_database_endpoint("demo/a", lambda params, session: {"id": "A1"}, reads=())
+        actions = [
+            {"type": "api_call", "endpoint": "database://demo/a", "save_to": "session.a"},
+            {"type": "api_call", "endpoint": "database://orders/get",
+             "params": {"order_id": "{{session.a.id}}"}, "save_to": "session.current_order"},
+            {"type": "api_call", "endpoint": "database://orders/update_status",
+             "params": {"order_id": "A1", "status": "cancelled"}, "save_to": "session.update_result"},
+            {"type": "api_call", "endpoint": "database://orders/list", "save_to": "session.user_orders"},
+        ]
+        pipeline = self.executor.compile_actions(actions)
+        self.assertEqual(len(pipeline.data_steps), 4)
+
+    def test_single_worker_disables_batching(self):
+        executor = ActionExecutor(db_manager=self.mock_db, max_parallel_calls=1)
+        actions = [
+            {"type": "api_call", "endpoint": "database://orders/list", "save_to": "session.user_orders"},
+            {"type": "api_call", "endpoint": "database://products/list", "save_to": "session.featured_products"},
+        ]
+        self.assertEqual(len(executor.compile_actions(actions).data_steps), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
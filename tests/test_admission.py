@@ -0,0 +1,189 @@
+"""
+准入控制与过载降级测试
+"""
+
+import os
+import sys
+import unittest
+from contextlib import ExitStack
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chatbot import Chatbot
+from server.admission import (
+    NORMAL, REJECT_LOGINS, RULE_ONLY, TEMPLATE_ONLY,
+    AdmissionController, AdmissionLLMResponder, Overloaded,
+)
+from server.rate_limiter import RateLimitedLLMResponder, RateLimiter
+from server.server import ChatServer
+
+
+class RecordingLLM:
+    """记录被调用方法的 LLM 桩，意图识别总是指向售前流程"""
+
+    def __init__(self):
+        self.calls = []
+
+    def recognize_intent(self, user_input, available_intents=None, session_context=None):
+        self.calls.append("recognize_intent")
+        return {"intent": "售前产品咨询流程", "confidence": 0.9, "reasoning": ""}
+
+    def generate_response(self, context, user_input):
+        self.calls.append("generate_response")
+        return "LLM回复"
+
+
+class TestAdmissionController(unittest.TestCase):
+    """测试按负载计算降级级别"""
+
+    def setUp(self):
+        self.controller = AdmissionController({
+            RULE_ONLY: (2, 1),
+            TEMPLATE_ONLY: (3, None),
+            REJECT_LOGINS: (4, None),
+        }, retry_after=3)
+
+    def _hold_requests(self, count):
+        stack = ExitStack()
+        for _ in range(count):
+            stack.enter_context(self.controller.track_request())
+        self.addCleanup(stack.close)
+
+    def test_levels_follow_in_flight_requests(self):
+        self.assertEqual(self.controller.level(), NORMAL)
+        for count, expected in ((2, RULE_ONLY), (1, TEMPLATE_ONLY), (1, REJECT_LOGINS)):
+            self._hold_requests(count)
+            self.assertEqual(self.controller.level(), expected)
+
+    def test_in_flight_llm_and_recovery(self):
+        with self.controller.track_llm_call():
+            self.assertEqual(self.controller.level(), RULE_ONLY)
+        self.assertEqual(self.controller.level(), NORMAL)
+        self.assertEqual(self.controller.stats()["in_flight_llm"], 0)
+
+    def test_check_raises_and_counts(self):
+        self._hold_requests(4)
+        with self.assertRaises(Overloaded) as ctx:
+            self.controller.check(REJECT_LOGINS)
+        self.assertEqual(ctx.exception.retry_after, 3)
+        self.assertEqual(self.controller.stats()["shed"]["reject_logins"], 1)
+
+    def test_from_config(self):
+        self.assertIsNone(AdmissionController.from_config({"enabled": False}))
+        controller = AdmissionController.from_config({"rule_only": {"in_flight_requests": 1}})
+        self.assertEqual(controller.thresholds[RULE_ONLY], (1, None))
+        self.assertEqual(controller.thresholds[REJECT_LOGINS], (96, None))
+
+
+class TestLoadShedding(unittest.TestCase):
+    """测试各降级级别下 Chatbot 的表现"""
+
+    def setUp(self):
+        self.controller = AdmissionController({
+            RULE_ONLY: (1, None),
+            TEMPLATE_ONLY: (2, None),
+            REJECT_LOGINS: (3, None),
+        })
+        self.llm = RecordingLLM()
+        self.chatbot = Chatbot(llm_responder=AdmissionLLMResponder(self.llm, self.controller))
+
+    def test_normal_uses_llm(self):
+        self.chatbot.handle_message("s1", "@@@", user_id="U001")
+        self.assertEqual(self.llm.calls, ["recognize_intent"])
+
+    def test_rule_only_skips_llm_routing(self):
+        with self.controller.track_request():
+            replies = self.chatbot.handle_message("s1", "@@@", user_id="U001")
+        self.assertEqual(self.llm.calls, ["generate_response"])
+        self.assertEqual(replies, ["LLM回复"])
+
+        # 规则可以匹配的输入照常路由
+        with self.controller.track_request():
+            self.chatbot.handle_message("s2", "我想查询物流信息", user_id="U001")
+        self.assertEqual(self.chatbot.session_manager.find_session("s2").get("active_flow_name"),
+                         "售中订单管理流程")
+
+    def test_template_only_skips_all_llm_calls(self):
+        with self.controller.track_request(), self.controller.track_request():
+            replies = self.chatbot.handle_message("s1", "@@@", user_id="U001")
+        self.assertEqual(self.llm.calls, [])
+        self.assertIn("抱歉，我暂时无法理解您的意思", replies[0])
+        self.assertEqual(self.controller.stats()["shed"], {
+            "rule_only": 1, "template_only": 1, "reject_logins": 0,
+        })
+
+    def test_reject_logins(self):
+        server = ChatServer.__new__(ChatServer)
+        server.admission = self.controller
+        self.assertIsNone(server._check_login_admission("auth_result"))
+        with server._track_request(), server._track_request(), server._track_request():
+            response = server._check_login_admission("register_result")
+        self.assertEqual(response["type"], "register_result")
+        self.assertFalse(response["success"])
+        self.assertEqual(response["code"], "overloaded")
+        self.assertEqual(response["retry_after"], 5)
+
+
+class StreamingLLM:
+    """流式兜底回复的 LLM 桩，意图识别不给出流程"""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight_seen = []
+
+    def recognize_intent(self, user_input, available_intents=None, session_context=None):
+        return {"intent": None, "confidence": 0.0, "reasoning": ""}
+
+    def generate_response(self, context, user_input, stream=False):
+        def pieces():
+            for piece in ("您好，", "我是智能客服。"):
+                self.in_flight_seen.append(self.controller.stats()["in_flight_llm"])
+                yield piece
+        return pieces() if stream else "您好，我是智能客服。"
+
+
+class TestStreamingAdmission(unittest.TestCase):
+    """测试流式 LLM 调用与限流、准入控制的组合"""
+
+    def setUp(self):
+        self.controller = AdmissionController({
+            RULE_ONLY: (10, 10),
+            TEMPLATE_ONLY: (20, 20),
+            REJECT_LOGINS: (30, None),
+        })
+        self.llm = StreamingLLM(self.controller)
+
+    def _chatbot(self, limiter):
+        responder = AdmissionLLMResponder(RateLimitedLLMResponder(self.llm, limiter), self.controller)
+        return Chatbot(llm_responder=responder)
+
+    def test_rate_limited_stream_falls_back_to_template(self):
+        # 令牌耗尽：流式兜底回复在调用处被拒绝，而不是在服务器发送时才抛出
+        chatbot = self._chatbot(RateLimiter("llm", rate=0.001, burst=0))
+        replies = chatbot.handle_message("s1", "@@@", user_id="U001", stream=True)
+        self.assertIsInstance(replies[0], str)
+        self.assertIn("抱歉，我暂时无法理解您的意思", replies[0])
+
+        server = ChatServer.__new__(ChatServer)
+        server._send_message = lambda conn, message: None
+        self.assertEqual(server._send_response_chunks(None, replies, "S1"), replies)
+        self.assertEqual(self.controller.stats()["in_flight_llm"], 0)
+
+    def test_stream_counted_until_consumed_or_closed(self):
+        chatbot = self._chatbot(RateLimiter("llm", rate=100, burst=100))
+        replies = chatbot.handle_message("s1", "@@@", user_id="U001", stream=True)
+        self.assertEqual(self.controller.stats()["in_flight_llm"], 1)
+        self.assertEqual("".join(replies[0]), "您好，我是智能客服。")
+        self.assertEqual(self.llm.in_flight_seen, [1, 1])
+        self.assertEqual(self.controller.stats()["in_flight_llm"], 0)
+
+        # 客户端断开时服务器关闭迭代器，计数同样归零
+        stream = chatbot.handle_message("s2", "@@@", user_id="U001", stream=True)[0]
+        next(stream)
+        stream.close()
+        self.assertEqual(self.controller.stats()["in_flight_llm"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
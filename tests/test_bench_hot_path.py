@@ -0,0 +1,74 @@
+"""
+热路径微基准脚本测试（极小数据量、极短计时，只验证脚本可用与基线比较逻辑）
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_hot_path import compare, main, measure
+from tests.mocks import MockLLMResponder
+
+
+class TestHotPathBenchmark(unittest.TestCase):
+    """测试计时、结果输出与基线比较"""
+
+    def test_measure(self):
+        calls = []
+        stats = measure(lambda: calls.append(1), min_time=0.01, rounds=3)
+        self.assertEqual(stats["rounds"], 3)
+        self.assertGreaterEqual(stats["iterations"], 1)
+        self.assertLessEqual(stats["min_us"], stats["median_us"])
+        # 预热一次 + 校准 + 3 批
+        self.assertGreater(len(calls), stats["iterations"] * 3)
+
+    def test_compare(self):
+        baseline = {"a": {"median_us": 100.0}, "b": {"median_us": 100.0}, "c": {"median_us": 100.0}}
+        current = {"a": {"median_us": 130.0}, "b": {"median_us": 70.0}, "c": {"median_us": 110.0},
+                   "d": {"median_us": 5.0}}
+        rows = {row["name"]: row for row in compare(current, baseline, threshold=0.25)}
+        self.assertEqual({name: row["status"] for name, row in rows.items()},
+                         {"a": "regression", "b": "improved", "c": "ok", "d": "new"})
+        self.assertEqual(rows["a"]["change"], 0.3)
+        self.assertIsNone(rows["d"]["baseline_us"])
+
+    def test_run_and_compare_with_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, "results", "hot_path.json")
+            args = ["--products", "50", "--orders", "100", "--min-time", "0.001", "--rounds", "1",
+                    "--filter", "^(trigger|interpreter|executor|e2e)\\.|db\\.get_order$"]
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(main(args + ["--output", output]), 0)
+            with open(output, "r", encoding="utf-8") as f:
+                report = json.load(f)
+            self.assertEqual(report["meta"]["products"], 50)
+            groups = {name.split(".")[0] for name in report["benchmarks"]}
+            self.assertEqual(groups, {"trigger", "interpreter", "executor", "db", "e2e"})
+
+            # 基线快得不现实时判定为回退
+            for stats in report["benchmarks"].values():
+                stats["median_us"] = 1e-6
+            baseline = os.path.join(tmp_dir, "baseline.json")
+            with open(baseline, "w", encoding="utf-8") as f:
+                json.dump(report, f)
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                self.assertEqual(main(args + ["--output", output, "--baseline", baseline]), 1)
+            self.assertIn("← 回退", out.getvalue())
+
+    def test_mock_llm_matches_chatbot_call(self):
+        # Chatbot 以关键字参数调用 recognize_intent 并读取结果字典
+        result = MockLLMResponder().recognize_intent(
+            user_input="我想退款", available_intents=["退款退货"], session_context={})
+        self.assertEqual(result["intent"], "退款退货")
+        self.assertIn("confidence", result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
 import os
 import sys
+import tempfile
+import threading
 import unittest
 
 # Ensure project root is on path
@@ -25,6 +27,115 @@ class _QueueLLMResponder:
         }
 
 
+class _SpeculativeLLMStub:
+    """LLM stub whose intent and semantic calls can be forced to run concurrently."""
+
+    def __init__(self, intent=None, barrier=None):
+        self.intent = intent
+        self.barrier = barrier
+        self.calls = []
+
+    def recognize_intent(self, user_input: str, available_intents=None, session_context=None):
+        self.calls.append("intent")
+        if self.barrier:
+            self.barrier.wait()
+        return {"intent": self.intent or "未知", "confidence": 0.9 if self.intent else 0.0, "reasoning": "mock"}
+
+    def check_semantic_match(self, user_input: str, semantic_meaning: str, session_context=None):
+        self.calls.append("semantic")
+        if self.barrier:
+            self.barrier.wait()
+        return {"matched": True, "confidence": 0.9, "reasoning": "mock"}
+
+    def generate_response(self, context: str, user_input: str):
+        return "mock reply"
+
+
+SPECULATIVE_FLOW = """
+name: "确认流程"
+entry_point: "state_start"
+states:
+  - id: "state_start"
+    triggers:
+      - type: regex
+        value: "开始确认"
+    actions:
+      - type: respond
+        text: "请确认或取消"
+    transitions:
+      - condition:
+          type: regex
+          value: "^确认$"
+        target: "state_confirmed"
+      - condition:
+          type: llm_semantic
+          semantic_meaning: "用户想取消"
+        target: "state_cancelled"
+  - id: "state_confirmed"
+    actions:
+      - type: respond
+        text: "已确认"
+  - id: "state_cancelled"
+    actions:
+      - type: respond
+        text: "已取消"
+"""
+
+OTHER_FLOW = """
+name: "其他流程"
+entry_point: "state_other"
+states:
+  - id: "state_other"
+    triggers:
+      - type: regex
+        value: "其他业务"
+    actions:
+      - type: respond
+        text: "进入其他流程"
+"""
+
+
+class TestSpeculativeIntentDetection(unittest.TestCase):
+    def setUp(self):
+        flows_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(flows_dir.cleanup)
+        for name, content in (("confirm.yaml", SPECULATIVE_FLOW), ("other.yaml", OTHER_FLOW)):
+            with open(os.path.join(flows_dir.name, name), "w", encoding="utf-8") as f:
+                f.write(content)
+        self.flows_dir = flows_dir.name
+
+    def _start(self, llm):
+        chatbot = Chatbot(flows_dir=self.flows_dir, llm_responder=llm, speculative_intent=True)
+        chatbot.handle_message("s1", "开始确认")
+        llm.calls.clear()
+        return chatbot
+
+    def test_deterministic_in_flow_match_skips_llm(self):
+        llm = _SpeculativeLLMStub()
+        chatbot = self._start(llm)
+        self.assertEqual(chatbot.handle_message("s1", "确认"), ["已确认"])
+        self.assertEqual(llm.calls, [])
+
+    def test_rule_trigger_skips_llm(self):
+        llm = _SpeculativeLLMStub()
+        chatbot = self._start(llm)
+        self.assertEqual(chatbot.handle_message("s1", "办理其他业务"), ["进入其他流程"])
+        self.assertEqual(llm.calls, [])
+
+    def test_ambiguous_input_runs_llm_calls_concurrently(self):
+        # Both calls wait on the same barrier: a serial implementation would time out
+        llm = _SpeculativeLLMStub(barrier=threading.Barrier(2, timeout=5))
+        chatbot = self._start(llm)
+        self.assertEqual(chatbot.handle_message("s1", "算了不要了"), ["已取消"])
+        self.assertEqual(sorted(llm.calls), ["intent", "semantic"])
+
+    def test_llm_intent_still_takes_precedence(self):
+        llm = _SpeculativeLLMStub(intent="其他流程")
+        chatbot = self._start(llm)
+        self.assertEqual(chatbot.handle_message("s1", "换个事情办"), ["进入其他流程"])
+        self.assertEqual(chatbot.session_manager.find_session("s1").get("active_flow_name"), "其他流程")
+
+
 class TestSessionPersistence(unittest.TestCase):
     def test_order_flow_preserves_session_state(self):
         chatbot = Chatbot()
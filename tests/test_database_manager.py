@@ -0,0 +1,371 @@
+"""
+DatabaseManager 测试
+
+使用临时数据库文件，覆盖事务、并发写入与批量操作
+"""
+
+import contextlib
+import io
+import json
+import sqlite3
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from collections import OrderedDict
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import migrate_passwords
+from core.database_manager import DatabaseManager
+from core.id_generator import generate_id
+from core.password_hasher import (
+    DUMMY_PASSWORD_HASH, PasswordVerifier, hash_password, is_password_hash, needs_rehash, verify_password,
+)
+
+
+class TestCreateOrder(unittest.TestCase):
+    """测试库存预留与订单写入的原子性"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(db_path=os.path.join(self.tmp_dir.name, "orders.db"))
+        self.db.add_product({
+            "product_id": "P900",
+            "name": "限量款机械键盘",
+            "category": "电脑外设",
+            "price": 499.0,
+            "stock": 10,
+        })
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _order(self, quantity=1, **extra):
+        order = {"order_id": generate_id("A"), "user_id": "U001", "product_id": "P900", "quantity": quantity}
+        order.update(extra)
+        return order
+
+    def _order_count(self, product_id="P900"):
+        conn = self.db._get_connection()
+        count = conn.execute("SELECT COUNT(*) FROM orders WHERE product_id = ?", (product_id,)).fetchone()[0]
+        conn.close()
+        return count
+
+    def test_create_order_reserves_stock(self):
+        result = self.db.create_order(self._order(quantity=3))
+        self.assertTrue(result["success"])
+        self.assertEqual(result["order"]["total_price"], 1497.0)
+        self.assertEqual(self.db.get_product("P900")["stock"], 7)
+        self.assertEqual(self.db.get_order(result["order"]["order_id"])["product_name"], "限量款机械键盘")
+
+    def test_insufficient_stock_rolls_back(self):
+        result = self.db.create_order(self._order(quantity=11))
+        self.assertFalse(result["success"])
+        self.assertEqual(result["reason"], "out_of_stock")
+        self.assertEqual(self.db.get_product("P900")["stock"], 10)
+        self.assertEqual(self._order_count(), 0)
+
+    def test_failed_insert_restores_stock(self):
+        first = self.db.create_order(self._order())
+        # 订单号冲突导致插入失败，库存扣减一并回滚
+        duplicate = self.db.create_order(self._order(order_id=first["order"]["order_id"]))
+        self.assertFalse(duplicate["success"])
+        self.assertEqual(self.db.get_product("P900")["stock"], 9)
+
+    def test_unknown_product(self):
+        result = self.db.create_order(self._order(product_id="P404"))
+        self.assertEqual(result["reason"], "not_found")
+
+    def test_concurrent_orders_never_oversell(self):
+        results = []
+        lock = threading.Lock()
+
+        def buyer():
+            result = self.db.create_order(self._order())
+            with lock:
+                results.append(result)
+
+        threads = [threading.Thread(target=buyer) for _ in range(30)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        succeeded = [r for r in results if r["success"]]
+        self.assertEqual(len(succeeded), 10)
+        self.assertTrue(all(r["reason"] == "out_of_stock" for r in results if not r["success"]))
+        self.assertEqual(self.db.get_product("P900")["stock"], 0)
+        self.assertEqual(self._order_count(), 10)
+
+    def test_concurrent_retries_with_same_request_key(self):
+        results = []
+
+        def retry():
+            results.append(self.db.create_order(self._order(request_key="same-request")))
+
+        threads = [threading.Thread(target=retry) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertTrue(all(r["success"] for r in results))
+        self.assertEqual(len({r["order"]["order_id"] for r in results}), 1)
+        self.assertEqual(self.db.get_product("P900")["stock"], 9)
+
+
+class TestBulkOperations(unittest.TestCase):
+    """测试批量写入、批量查询与商品目录导入"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(db_path=os.path.join(self.tmp_dir.name, "bulk.db"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_seed_data_loaded(self):
+        self.assertEqual(self.db.get_product_count(), 50)
+        self.assertEqual(self.db.get_user("U002")["username"], "李四")
+        self.assertEqual(self.db.get_order("A1234567890")["tracking_number"], "SF1234567890")
+
+    def test_bulk_insert_skips_existing_and_upsert_updates(self):
+        products = [
+            {"product_id": f"X{i:04d}", "name": f"测试商品 {i}", "price": 10 + i, "stock": 5, "features": ["轻便"]}
+            for i in range(1200)
+        ]
+        version = self.db.catalog_version
+        self.assertEqual(self.db.bulk_add_products(products), 1200)
+        self.assertGreater(self.db.catalog_version, version)
+        version = self.db.catalog_version
+        self.assertEqual(self.db.bulk_add_products(products[:10]), 0)
+        self.assertEqual(self.db.catalog_version, version)
+
+        changed = [dict(products[0], price=1.0, stock=99)]
+        self.assertEqual(self.db.bulk_add_products(changed, upsert=True), 1)
+        product = self.db.get_product("X0000")
+        self.assertEqual((product["price"], product["stock"]), (1.0, 99))
+        self.assertEqual(product["features"], ["轻便"])
+
+    def test_get_many(self):
+        ids = [f"P{i:03d}" for i in range(1, 51)] + ["P404", "P001"]
+        products = self.db.get_products(ids)
+        self.assertEqual(len(products), 50)
+        self.assertIsInstance(products["P010"]["features"], list)
+
+        orders = self.db.get_orders(["A1234567890", "C1122334455", "Z0"])
+        self.assertEqual(set(orders), {"A1234567890", "C1122334455"})
+        self.assertEqual(self.db.get_orders([]), {})
+
+    def test_bulk_add_users_and_orders(self):
+        self.assertEqual(self.db.bulk_add_users([
+            {"user_id": "U100", "username": "赵六", "password": "pw"},
+            {"user_id": "U101", "username": "钱七", "password": "pw"},
+        ]), 2)
+        self.assertEqual(self.db.bulk_add_orders([
+            {"order_id": "D0000000001", "user_id": "U100", "product_id": "P001",
+             "product_name": "无线蓝牙耳机 1", "quantity": 1, "total_price": 279.0},
+        ]), 1)
+        self.assertEqual(self.db.get_user_orders("U100")[0]["status"], "pending")
+
+    def test_import_catalog_csv_and_jsonl(self):
+        csv_path = os.path.join(self.tmp_dir.name, "catalog.csv")
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("product_id,name,category,price,stock,features\n")
+            for i in range(25):
+                f.write(f"C{i:03d},导入商品 {i},导入分类,{99 + i},{i},防水|轻薄\n")
+        self.assertEqual(self.db.import_catalog(csv_path, chunk_size=10), 25)
+        product = self.db.get_product("C003")
+        self.assertEqual((product["price"], product["stock"]), (102.0, 3))
+        self.assertEqual(product["features"], ["防水", "轻薄"])
+
+        jsonl_path = os.path.join(self.tmp_dir.name, "catalog.jsonl")
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"product_id": "C003", "name": "导入商品 3 新款", "price": 88, "stock": 7},
+                               ensure_ascii=False) + "\n\n")
+        self.assertEqual(self.db.import_catalog(jsonl_path), 1)
+        self.assertEqual(self.db.get_product("C003")["name"], "导入商品 3 新款")
+
+        with self.assertRaises(ValueError):
+            self.db.import_catalog(os.path.join(self.tmp_dir.name, "catalog.xml"))
+
+
+
+class TestEligibility(unittest.TestCase):
+    """测试退款/开票资格的单次查询与缓存失效"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(db_path=os.path.join(self.tmp_dir.name, "eligibility.db"))
+        self.statements = []
+        original = self.db._get_connection
+
+        def tracing_connection():
+            conn = original()
+            conn.set_trace_callback(self.statements.append)
+            return conn
+
+        self.db._get_connection = tracing_connection
+
+    @property
+    def queries(self):
+        """已执行的资格事实查询次数（缓存命中时只读取版本号）"""
+        return sum(1 for sql in self.statements if "latest_refund_status" in sql)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_facts_cached_until_refund_written(self):
+        first = self.db.check_refund_eligibility("A1234567890")
+        self.assertTrue(first["eligible"])
+        self.assertEqual(self.queries, 1)
+        self.assertTrue(self.db.check_order_invoice_eligibility("A1234567890")["eligible"])
+        self.assertEqual(self.queries, 1)
+
+        self.db.create_refund({"refund_id": generate_id("R"), "order_id": "A1234567890",
+                               "user_id": "U001", "amount": 299.0})
+        result = self.db.check_refund_eligibility("A1234567890")
+        self.assertFalse(result["eligible"])
+        self.assertEqual(result["reason"], "已有退款记录")
+
+    def test_invoice_and_status_writes_invalidate(self):
+        self.assertTrue(self.db.check_order_invoice_eligibility("B9876543210")["eligible"])
+        self.db.create_invoice({"invoice_id": generate_id("I"), "order_id": "B9876543210", "user_id": "U002",
+                                "invoice_title": "个人", "amount": 398.0})
+        self.assertEqual(self.db.check_order_invoice_eligibility("B9876543210")["reason"], "该订单已开具发票")
+
+        self.assertTrue(self.db.check_refund_eligibility("C1122334455")["eligible"])
+        self.db.update_order_status("C1122334455", "cancelled")
+        self.assertEqual(self.db.check_refund_eligibility("C1122334455")["reason"], "订单未支付或已取消")
+
+    def test_cached_order_not_mutated_by_callers(self):
+        self.db.check_refund_eligibility("A1234567890")["order"]["status"] = "cancelled"
+        self.assertTrue(self.db.check_refund_eligibility("A1234567890")["eligible"])
+
+    def test_cache_shared_across_managers_for_same_file(self):
+        other = DatabaseManager(db_path=self.db.db_path)
+        self.assertTrue(self.db.check_refund_eligibility("A1234567890")["eligible"])
+        other.update_order_status("A1234567890", "cancelled")
+        self.assertFalse(self.db.check_refund_eligibility("A1234567890")["eligible"])
+
+    def test_writes_from_other_process_invalidate(self):
+        # 独立的缓存模拟另一个工作进程：它的写入不会调用本进程的任何失效逻辑
+        other_process = type("OtherProcessManager", (DatabaseManager,), {"_eligibility_cache": OrderedDict()})
+        other = other_process(db_path=self.db.db_path)
+        self.assertTrue(self.db.check_refund_eligibility("A1234567890")["eligible"])
+        self.assertTrue(other.check_refund_eligibility("A1234567890")["eligible"])
+
+        self.assertTrue(other.create_refund({"refund_id": generate_id("R"), "order_id": "A1234567890",
+                                             "user_id": "U001", "amount": 299.0}))
+        self.assertEqual(self.db.check_refund_eligibility("A1234567890")["reason"], "已有退款记录")
+
+        # 不经过 DatabaseManager 的写入同样使缓存失效
+        self.assertTrue(self.db.check_order_invoice_eligibility("B9876543210")["eligible"])
+        conn = sqlite3.connect(self.db.db_path)
+        with conn:
+            conn.execute("INSERT INTO invoices (invoice_id, order_id, user_id, invoice_title, amount) "
+                         "VALUES ('I-EXT', 'B9876543210', 'U002', '个人', 398.0)")
+        conn.close()
+        self.assertEqual(other.check_order_invoice_eligibility("B9876543210")["reason"], "该订单已开具发票")
+        self.assertEqual(self.db.check_order_invoice_eligibility("B9876543210")["reason"], "该订单已开具发票")
+
+    def test_missing_order(self):
+        self.assertEqual(self.db.check_refund_eligibility("Z000")["reason"], "订单不存在")
+        self.assertIsNone(self.db.get_order_eligibility_facts(""))
+
+
+
+class TestPasswordStorage(unittest.TestCase):
+    """测试密码哈希存储与明文密码迁移"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "users.db")
+        self.db = DatabaseManager(db_path=self.db_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _stored_password(self, user_id):
+        return self.db.get_user(user_id)["password"]
+
+    def test_passwords_stored_as_salted_hashes(self):
+        result = self.db.register_user("赵六", "secret-1")
+        stored = self._stored_password(result["user_id"])
+        self.assertTrue(is_password_hash(stored))
+        self.assertNotIn("secret-1", stored)
+        # 相同密码使用不同的盐
+        self.db.register_user("钱七", "secret-1")
+        self.assertNotEqual(self.db.get_user_by_username("钱七")["password"], stored)
+
+        self.assertEqual(self.db.authenticate_user("赵六", "secret-1")["user_id"], result["user_id"])
+        self.assertIsNone(self.db.authenticate_user("赵六", "secret-2"))
+        self.assertTrue(self.db.authenticate_user("张三", "password123"))
+
+    def test_unknown_user_costs_a_full_verification(self):
+        verified = []
+
+        class RecordingVerifier(PasswordVerifier):
+            def verify(self, password, stored):
+                verified.append(stored)
+                return super().verify(password, stored)
+
+        db = DatabaseManager(db_path=self.db_path, password_verifier=RecordingVerifier(max_workers=1))
+        self.addCleanup(db.password_verifier.shutdown)
+        self.assertIsNone(db.authenticate_user("不存在的用户", "password123"))
+        self.assertIsNone(db.authenticate_user("张三", "wrong"))
+        # 用户不存在时校验占位哈希，迭代次数与真实哈希相同
+        self.assertEqual(verified[0], DUMMY_PASSWORD_HASH)
+        self.assertEqual(verified[0].split("$")[1], verified[1].split("$")[1])
+        self.assertFalse(verify_password("", DUMMY_PASSWORD_HASH))
+
+    def test_plaintext_rows_migrated_explicitly(self):
+        conn = self.db._get_connection()
+        conn.execute("UPDATE users SET password = 'password456' WHERE user_id = 'U002'")
+        conn.execute("UPDATE users SET password = 'password789' WHERE user_id = 'U003'")
+        conn.commit()
+        conn.close()
+
+        # 打开数据库不再逐行计算哈希
+        DatabaseManager(db_path=self.db_path)
+        self.assertEqual(self.db.count_plaintext_passwords(), 2)
+
+        # 未迁移的明文密码可以登录，并在登录成功时升级
+        self.assertIsNotNone(self.db.authenticate_user("王五", "password789"))
+        self.assertTrue(is_password_hash(self._stored_password("U003")))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(migrate_passwords.main(["--db", self.db_path]), 0)
+        self.assertEqual(self.db.count_plaintext_passwords(), 0)
+        self.assertTrue(is_password_hash(self._stored_password("U002")))
+        self.assertIsNotNone(self.db.authenticate_user("李四", "password456"))
+
+    def test_weak_hash_upgraded_on_login(self):
+        conn = self.db._get_connection()
+        conn.execute("UPDATE users SET password = ? WHERE user_id = 'U003'", (hash_password("password789", iterations=1000),))
+        conn.commit()
+        conn.close()
+
+        self.assertIsNotNone(self.db.authenticate_user("王五", "password789"))
+        self.assertFalse(needs_rehash(self._stored_password("U003")))
+
+    def test_verifier_pool(self):
+        verifier = PasswordVerifier(max_workers=2, max_pending=2)
+        stored = hash_password("pool-secret", iterations=1000)
+        try:
+            # 多线程的服务器进程中不能 fork 工作进程
+            self.assertNotEqual(verifier._get_pool()._mp_context.get_start_method(), "fork")
+            self.assertTrue(verifier.verify("pool-secret", stored))
+            self.assertFalse(verifier.verify("wrong", stored))
+            self.assertTrue(verify_password("pool-secret", verifier.hash("pool-secret")))
+        finally:
+            verifier.shutdown()
+        self.assertTrue(verify_password("legacy", "legacy"))
+        self.assertFalse(verify_password("legacy", None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+DSL 流程静态检查测试
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dsl.check import ERROR, WARNING, check_flow, check_paths, main, reachable_states
+from core.chatbot import Chatbot
+from dsl.dsl_parser import ChatFlow
+
+FLOWS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dsl", "flows")
+
+BROKEN_FLOW = """
+name: "测试流程"
+entry_point: "start"
+states:
+  - id: "start"
+    triggers:
+      - type: regex
+        value: ".*(退款|退货.*"
+    transitions:
+      - condition:
+          any:
+            - type: regex
+              value: "[A-Z0-9]{8,12}"
+            - type: intent_equals
+              value: "退款"
+        target: "collect"
+      - target: "missing_state"
+  - id: "collect"
+    actions:
+      - type: extract_variable
+        regex: "(?P<order_id>[A-Z0-9]{8,12}"
+        target: "session.order_id"
+    transitions:
+      - condition:
+          type: regex
+          value: "是|好"
+        target: "start"
+  - id: "orphan"
+"""
+
+
+def _flow(states, entry_point="start"):
+    return ChatFlow({"name": "测试流程", "entry_point": entry_point, "states": states})
+
+
+def _messages(issues, severity):
+    return sorted((issue.state_id or "", issue.message) for issue in issues if issue.severity == severity)
+
+
+class TestFlowCheck(unittest.TestCase):
+    """测试状态图构建与各类问题的检测"""
+
+    def test_shipped_flows_clean(self):
+        self.assertEqual([str(issue) for issue in check_paths([FLOWS_DIR])], [])
+
+    def test_detects_errors_and_warnings(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "broken.yaml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(BROKEN_FLOW)
+            issues = check_paths([tmp_dir])
+
+        self.assertTrue(all(issue.source == path for issue in issues))
+        errors = _messages(issues, ERROR)
+        self.assertEqual([state_id for state_id, _ in errors], ["collect", "start", "start", "start"])
+        self.assertIn("正则 '(?P<order_id>[A-Z0-9]{8,12}' 语法错误", errors[0][1])
+        self.assertTrue(any("未知条件类型 'intent_equals'" in message for _, message in errors))
+        self.assertTrue(any("目标状态 'missing_state' 不存在" in message for _, message in errors))
+        self.assertTrue(any(message.startswith("触发器正则") for _, message in errors))
+        self.assertEqual(_messages(issues, WARNING), [
+            ("collect", "没有兜底转换，条件都不满足时无法回应"),
+            ("orphan", "从入口状态不可达"),
+        ])
+        # 错误排在警告前面
+        self.assertEqual([issue.severity for issue in issues], [ERROR] * 4 + [WARNING] * 2)
+
+    def test_structure_errors(self):
+        flow = _flow([{"id": "a"}, {"id": "a"}, {"actions": []}], entry_point="b")
+        self.assertEqual(_messages(check_flow(flow), ERROR), [
+            ("", "入口状态 'b' 不存在"),
+            ("", "第 3 个状态缺少 'id'"),
+            ("a", "状态ID重复，后定义的状态会覆盖前面的"),
+        ])
+
+    def test_non_mapping_entries(self):
+        flow = _flow([
+            {"id": "start", "triggers": ["退款"], "actions": ["respond", {"type": "respond", "text": "好"}],
+             "transitions": ["b", {"target": "b"}]},
+            {"id": "b", "actions": "respond", "transitions": "start"},
+        ])
+        self.assertEqual(_messages(check_flow(flow), ERROR), [
+            ("b", "'actions' 必须是列表，实际为 str"),
+            ("b", "'transitions' 必须是列表，实际为 str"),
+            ("start", "动作 #1 必须是映射，实际为 str 'respond'"),
+            ("start", "触发器 #1 必须是映射，实际为 str '退款'"),
+            ("start", "转换 #1 必须是映射，实际为 str 'b'"),
+        ])
+        # 格式正确的转换照常编译，写错的条目不参与匹配
+        self.assertEqual(flow.get_transitions("start"), [{"target": "b"}])
+        self.assertEqual(flow.get_transitions("b"), [])
+
+    def test_malformed_flow_does_not_abort_loading(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "bad.yaml"), "w", encoding="utf-8") as f:
+                f.write('name: "坏流程"\nentry_point: "s"\nstates:\n  - id: "s"\n'
+                        '    triggers: ["坏"]\n    actions: ["respond"]\n    transitions: ["s"]\n')
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(main([tmp_dir]), 1)
+                chatbot = Chatbot(flows_dir=tmp_dir)
+        self.assertIn("转换 #1 必须是映射", output.getvalue())
+        self.assertIn("坏流程", chatbot.flows)
+
+    def test_reachability(self):
+        flow = _flow([
+            {"id": "start", "transitions": [{"target": "b"}]},
+            {"id": "b", "transitions": [{"condition": {"type": "regex", "value": "x"}, "target": "c"},
+                                        {"target": "start"}]},
+            {"id": "c"},
+            {"id": "d", "transitions": [{"target": "c"}]},
+        ])
+        self.assertEqual(reachable_states(flow), {"start", "b", "c"})
+
+    def test_duplicate_flow_names_across_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ("a.yaml", "b.yaml"):
+                with open(os.path.join(tmp_dir, name), "w", encoding="utf-8") as f:
+                    f.write('name: "同名"\nentry_point: "s"\nstates:\n  - id: "s"\n')
+            issues = check_paths([tmp_dir])
+        self.assertEqual(len(issues), 1)
+        self.assertTrue(issues[0].source.endswith("b.yaml"))
+        self.assertIn("流程名 '同名'", issues[0].message)
+
+    def test_cli_exit_code(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "warn.yaml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write('name: "仅警告"\nentry_point: "s"\nstates:\n  - id: "s"\n  - id: "t"\n')
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(main([FLOWS_DIR]), 0)
+                self.assertEqual(main([path]), 0)
+                self.assertEqual(main([path, "--strict"]), 1)
+                self.assertEqual(main([os.path.join(tmp_dir, "missing.yaml")]), 1)
+        self.assertIn("[流程检查] 1 个文件，0 个错误，1 个警告", output.getvalue())
+
+
+class TestTransitionTable(unittest.TestCase):
+    """测试 ChatFlow 预先计算的转换表"""
+
+    def test_fallback_is_first_unconditioned(self):
+        conditional = {"condition": {"type": "regex", "value": "x"}, "target": "b"}
+        explicit_none = {"condition": None, "target": "c"}
+        fallback = {"target": "d"}
+        flow = _flow([{"id": "start", "transitions": [conditional, explicit_none, fallback, {"target": "e"}]},
+                      {"id": "b"}])
+        self.assertEqual(flow.get_transitions("start")[:3], [conditional, explicit_none, fallback])
+        self.assertIs(flow.get_fallback_transition("start"), fallback)
+        self.assertEqual(flow.get_transitions("b"), [])
+        self.assertIsNone(flow.get_fallback_transition("b"))
+        self.assertIsNone(flow.get_fallback_transition("unknown"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+预编译流程表（mmap 共享）测试
+"""
+
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chatbot import Chatbot
+from dsl.dsl_parser import ChatFlow
+from dsl.flow_table import (FlowTable, build_flow_table, compile_flow_table, flows_fingerprint,
+                             load_flow_table)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLOWS_DIR = os.path.join(PROJECT_ROOT, "dsl", "flows")
+
+
+def _quiet(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+class TestFlowTable(unittest.TestCase):
+    """测试流程表与 YAML 加载结果一致、过期自动重新编译"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.table_path = os.path.join(self.tmp_dir, "flows.cft")
+
+    def _load(self, flows_dir=FLOWS_DIR):
+        table, flows = _quiet(load_flow_table, flows_dir, self.table_path)
+        self.addCleanup(table.close)
+        return table, flows
+
+    def test_matches_yaml_flows(self):
+        expected = _quiet(Chatbot._load_flows, FLOWS_DIR)
+        _, flows = self._load()
+        self.assertEqual(list(flows), list(expected))
+        for name, flow in expected.items():
+            loaded = flows[name]
+            self.assertEqual(loaded.entry_point, flow.entry_point)
+            self.assertEqual(loaded.states, flow.states)
+            self.assertEqual(loaded.entry_index, flow.entry_index)
+            for state_id in flow.state_ids():
+                index = flow.state_index(state_id)
+                self.assertEqual(loaded.state_index(state_id), index)
+                self.assertEqual(loaded.transitions_at(index), flow.transitions_at(index))
+                self.assertEqual(loaded.get_fallback_transition(state_id), flow.get_fallback_transition(state_id))
+                # 同一状态始终返回同一个字典，ActionExecutor 据此判断缓存的流水线是否有效
+                self.assertIs(loaded.get_state(state_id), loaded.get_state(state_id))
+
+    def test_records_and_string_interning(self):
+        flow = ChatFlow({"name": "测试流程", "entry_point": "a", "states": [
+            {"id": "a", "transitions": [{"condition": {"type": "regex", "value": "x"}, "target": "b"},
+                                        {"target": "missing"}, {"target": "b"}]},
+            {"id": "b", "transitions": [{"target": "b"}]},
+        ]})
+        path = os.path.join(self.tmp_dir, "manual.cft")
+        with open(path, "wb") as f:
+            f.write(build_flow_table([("manual.yaml", flow)]))
+        with FlowTable(path) as table:
+            self.assertEqual((table.flow_count, table.state_count, table.transition_count), (1, 2, 4))
+            self.assertEqual([table.transition_record(i)[0] for i in range(4)], [1, -1, 1, 1])
+            # {"target": "b"} 在两个状态中出现，只存一份
+            self.assertEqual(table.transition_record(2)[1], table.transition_record(3)[1])
+            loaded = table.load_flows()["测试流程"]
+            self.assertEqual(loaded.source, "manual.yaml")
+            self.assertEqual(loaded.get_fallback_transition("a"), {"target": "missing"})
+            self.assertEqual(loaded.unresolved_targets, [("a", "missing")])
+            self.assertEqual([t.target_index for t in loaded.transitions_at(1)], [1])
+            self.assertIsNone(loaded.get_state("missing"))
+
+    def test_recompiles_when_flows_change(self):
+        flows_dir = os.path.join(self.tmp_dir, "flows")
+        shutil.copytree(FLOWS_DIR, flows_dir)
+        table, _ = self._load(flows_dir)
+        fingerprint = table.fingerprint
+
+        # 指纹一致时直接复用
+        reopened, _ = self._load(flows_dir)
+        self.assertEqual(reopened.fingerprint, fingerprint)
+
+        chitchat = os.path.join(flows_dir, "common", "chitchat.yaml")
+        with open(chitchat, "a", encoding="utf-8") as f:
+            f.write("\n# 修改\n")
+        changed, _ = self._load(flows_dir)
+        self.assertNotEqual(changed.fingerprint, fingerprint)
+        # 已打开的旧映射不受原子替换影响
+        self.assertEqual(table.load_flows().keys(), changed.load_flows().keys())
+
+    def test_freshness_checked_by_stat(self):
+        flows_dir = os.path.join(self.tmp_dir, "flows")
+        shutil.copytree(FLOWS_DIR, flows_dir)
+        fingerprint = flows_fingerprint(flows_dir)
+
+        # 启动时只 stat 流程文件，不读取内容
+        with mock.patch("builtins.open", side_effect=AssertionError("不应读取流程文件")):
+            self.assertEqual(flows_fingerprint(flows_dir), fingerprint)
+
+        # 内容不变但修改时间变化也视为过期
+        chitchat = os.path.join(flows_dir, "common", "chitchat.yaml")
+        stat = os.stat(chitchat)
+        os.utime(chitchat, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertNotEqual(flows_fingerprint(flows_dir), fingerprint)
+
+    def test_corrupt_table_recompiled(self):
+        with open(self.table_path, "wb") as f:
+            f.write(b"not a table")
+        with self.assertRaises(ValueError):
+            FlowTable(self.table_path)
+        _, flows = self._load()
+        self.assertEqual(len(flows), 6)
+
+    def test_shared_by_worker_processes(self):
+        _quiet(compile_flow_table, FLOWS_DIR, self.table_path)
+        script = (
+            "import sys; from dsl.flow_table import load_flow_table;"
+            f"table, flows = load_flow_table({FLOWS_DIR!r}, {self.table_path!r});"
+            "flow = flows['标准退款流程'];"
+            "print(flow.get_fallback_transition(flow.entry_point)['target'])"
+        )
+        before = os.path.getmtime(self.table_path)
+        outputs = [subprocess.run([sys.executable, "-c", script], cwd=PROJECT_ROOT, capture_output=True,
+                                  text=True, check=True).stdout for _ in range(2)]
+        self.assertEqual(outputs, ["state_collect_reason\n"] * 2)
+        # 工作进程只打开流程表，不重新编译
+        self.assertEqual(os.path.getmtime(self.table_path), before)
+
+    def test_chatbot_with_flow_table(self):
+        chatbot = _quiet(Chatbot, flows_dir=FLOWS_DIR, flow_table=self.table_path)
+        self.addCleanup(chatbot.flow_table.close)
+        # 初始化后不解码任何状态、不编译任何流水线
+        self.assertEqual(self._decoded_states(chatbot), set())
+        self.assertEqual(chatbot.action_executor._pipelines, {})
+
+        baseline = _quiet(Chatbot, flows_dir=FLOWS_DIR)
+        for user_input in ("我要退款", "商品有损坏"):
+            self.assertEqual(_quiet(chatbot.handle_message, "s1", user_input),
+                             _quiet(baseline.handle_message, "s1", user_input))
+
+        # 只有触发器检查过的入口状态和实际执行过的状态被解码
+        decoded = self._decoded_states(chatbot)
+        entry_states = {(name, flow.entry_point) for name, flow in chatbot.flows.items()}
+        executed = set(chatbot.action_executor._pipelines)
+        self.assertTrue(executed)
+        self.assertLessEqual(executed, decoded)
+        self.assertEqual(decoded, entry_states | executed)
+        self.assertLess(len(decoded), chatbot.flow_table.state_count)
+
+    @staticmethod
+    def _decoded_states(chatbot):
+        return {(name, flow.state_id_at(index))
+                for name, flow in chatbot.flows.items()
+                for index, state in enumerate(flow._decoded) if state is not None}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+"""
+业务ID生成与写动作幂等测试
+"""
+
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.client import ChatClient
+from core.id_generator import IdGenerator, generate_id
+from core.action_executor import ActionExecutor
+from core.database_manager import DatabaseManager
+from core.session_manager import Session
+
+
+class TestIdGenerator(unittest.TestCase):
+    """测试单调递增ID生成器"""
+
+    def test_ids_unique_and_monotonic_across_threads(self):
+        generator = IdGenerator(worker_id=3)
+        results = []
+
+        def worker():
+            results.append([generator.next_int() for _ in range(5000)])
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        all_ids = [i for chunk in results for i in chunk]
+        self.assertEqual(len(set(all_ids)), len(all_ids))
+        for chunk in results:
+            self.assertEqual(chunk, sorted(chunk))
+
+    def test_string_ids_sortable_and_match_order_id_pattern(self):
+        ids = [generate_id("A") for _ in range(2000)]
+        self.assertEqual(ids, sorted(ids))
+        # 与 DSL 中订单号提取正则保持兼容
+        for order_id in ids[:10]:
+            self.assertRegex(order_id, r"^[A-Z0-9]{8,12}$")
+
+    def test_sequence_overflow_borrows_next_millisecond(self):
+        generator = IdGenerator(worker_id=0)
+        values = [generator.next_int() for _ in range(3000)]
+        self.assertEqual(values, sorted(set(values)))
+
+    def test_set_worker_id(self):
+        generator = IdGenerator()
+        before = generator.next_int()
+        generator.set_worker_id(17)
+        after = generator.next_int()
+        self.assertGreater(after, before)
+        self.assertEqual((after >> 10) & 31, 17)
+        with self.assertRaises(ValueError):
+            generator.set_worker_id(32)
+        with self.assertRaises(ValueError):
+            IdGenerator(worker_id=-1)
+
+
+class TestIdWorkerLease(unittest.TestCase):
+    """测试共用数据库的进程之间分配互不重复的 worker 号"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "lease.db")
+        self.db = DatabaseManager(db_path=self.db_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _add_lease(self, worker_id, pid):
+        conn = self.db._get_connection()
+        conn.execute("INSERT INTO id_workers (worker_id, host, pid) VALUES (?, ?, ?)",
+                     (worker_id, socket.gethostname(), pid))
+        conn.commit()
+        conn.close()
+
+    def test_live_process_keeps_its_worker_id(self):
+        # 父进程（测试运行器）仍在运行，其租约不能被回收
+        self._add_lease(0, os.getppid())
+        worker_id = self.db.claim_id_worker()
+        self.assertEqual(worker_id, 1)
+        # 同一进程重复租用返回同一个号，与是否新建 DatabaseManager 无关
+        self.assertEqual(DatabaseManager(db_path=self.db_path).claim_id_worker(), worker_id)
+        with self.assertRaises(ValueError):
+            self.db.claim_id_worker(0)
+
+    def test_exited_process_lease_reclaimed(self):
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        self._add_lease(5, exited.pid)
+        self.assertEqual(self.db.claim_id_worker(5), 5)
+
+    def test_release_and_exhaustion(self):
+        for worker_id in range(32):
+            self._add_lease(worker_id, os.getppid())
+        with self.assertRaises(RuntimeError):
+            self.db.claim_id_worker()
+
+        conn = self.db._get_connection()
+        conn.execute("DELETE FROM id_workers WHERE worker_id = 9")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.db.claim_id_worker(), 9)
+        self.db.release_id_worker(9)
+        self.assertEqual(self.db.claim_id_worker(), 9)
+
+
+class TestIdempotentWrites(unittest.TestCase):
+    """测试写动作的幂等键"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(db_path=os.path.join(self.tmp_dir.name, "idem.db"))
+        self.executor = ActionExecutor(db_manager=self.db)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _count(self, table):
+        conn = self.db._get_connection()
+        count = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_retried_refund_not_written_twice(self):
+        session = Session("idem-test", user_id="U001")
+        session.request_id = "req-1"
+        params = {"order_id": "A1234567890", "reason": "quality_issue", "amount": 299.0, "user_id": "U001"}
+        before = self._count("refunds")
+
+        first = self.executor._query_refunds_create(params, session)
+        retry = self.executor._query_refunds_create(dict(params), session)
+        self.assertTrue(first["success"])
+        self.assertEqual(retry["refund_id"], first["refund_id"])
+        self.assertEqual(self._count("refunds"), before + 1)
+
+        # 新的消息ID视为新请求
+        session.request_id = "req-2"
+        self.executor._query_refunds_create(params, session)
+        self.assertEqual(self._count("refunds"), before + 2)
+
+    def test_retried_order_returns_original_order(self):
+        session = Session("idem-test", user_id="U001")
+        session.request_id = "req-order"
+        params = {"product_id": "P001", "quantity": 1}
+        stock_before = self.db.get_product("P001")["stock"]
+
+        first = self.executor._query_orders_create(params, session)
+        retry = self.executor._query_orders_create(dict(params), session)
+        self.assertEqual(retry["order"]["order_id"], first["order"]["order_id"])
+        self.assertEqual(self.db.get_product("P001")["stock"], stock_before - 1)
+
+    def test_database_ignores_duplicate_request_key(self):
+        refund = {"refund_id": generate_id("R"), "order_id": "A1234567890", "user_id": "U001",
+                  "amount": 10.0, "request_key": "k1"}
+        self.assertTrue(self.db.create_refund(refund))
+        self.assertTrue(self.db.create_refund(dict(refund, refund_id=generate_id("R"))))
+        self.assertEqual(self.db.get_by_request_key("refunds", "k1")["refund_id"], refund["refund_id"])
+
+
+class TestClientRetry(unittest.TestCase):
+    """测试客户端在等待回复时断线后以同一个 request_id 重发"""
+
+    def test_resends_with_same_request_id_after_reconnect(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(2)
+        self.addCleanup(listener.close)
+        received = []
+
+        def send(conn, message):
+            conn.sendall((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+
+        def fake_server():
+            # 第一个连接：收到消息（已执行写操作）后、回复前断开
+            conn, _ = listener.accept()
+            send(conn, {"type": "welcome", "require_auth": True, "session_id": "c1"})
+            received.append(json.loads(conn.recv(65536)))
+            conn.close()
+            # 第二个连接：凭 Token 恢复会话后回复重发的消息
+            conn, _ = listener.accept()
+            send(conn, {"type": "welcome", "require_auth": True, "session_id": "c2"})
+            resume = json.loads(conn.recv(65536))
+            send(conn, {"type": "resume_result", "success": resume["token"] == "t", "resumed": True,
+                        "user_id": "U001", "session_id": "S1"})
+            received.append(json.loads(conn.recv(65536)))
+            send(conn, {"type": "response", "content": ["退款申请已提交"]})
+            conn.close()
+
+        thread = threading.Thread(target=fake_server, daemon=True)
+        thread.start()
+        client = ChatClient(port=listener.getsockname()[1], client_name="RetryTest")
+        self.assertTrue(client.connect(auto_auth=False))
+        # 登录后持有的 Token，重连时用于恢复会话
+        client.token = "t"
+        client.authenticated = True
+
+        self.assertEqual(client.send_message("确认退款"), ["退款申请已提交"])
+        thread.join(timeout=5)
+        client.disconnect()
+        self.assertEqual([message["content"] for message in received], ["确认退款"] * 2)
+        self.assertEqual(received[0]["request_id"], received[1]["request_id"])
+        self.assertEqual(received[1]["request_id"], client.last_request_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+离线批量意图标注测试
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.intent_labeler import (
+    UNLABELED, TopUtterances, cluster_utterances, extract_utterances, label_corpus,
+)
+
+FLOWS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dsl", "flows")
+
+CORPUS = (
+    [{"type": "message", "content": "我想查询物流信息"}] * 5
+    + [{"user_input": "能便宜点吗"}] * 4
+    + [{"messages": [{"role": "user", "content": "便宜点行不行"}, {"role": "assistant", "content": "..."}]}] * 3
+    + [{"text": "这个产品多少钱"}] * 2
+    + [{"type": "ping"}]
+)
+
+
+class TestIntentLabeler(unittest.TestCase):
+    """测试语料标注、聚类与触发器建议"""
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.corpus_path = os.path.join(tmp_dir.name, "corpus.jsonl")
+        with open(self.corpus_path, "w", encoding="utf-8") as f:
+            for record in CORPUS:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.write("not json\n")
+
+    def test_extract_utterances(self):
+        self.assertEqual(extract_utterances({"content": "  你好\n 在吗 "}), ["你好 在吗"])
+        self.assertEqual(extract_utterances({"messages": [
+            {"role": "assistant", "content": "欢迎"}, {"role": "user", "content": "退款"},
+        ]}), ["退款"])
+        self.assertEqual(extract_utterances({"type": "login", "username": "张三"}), [])
+
+    def test_label_corpus(self):
+        report = label_corpus(self.corpus_path, flows_dir=FLOWS_DIR, workers=0, batch_size=4).to_dict()
+        self.assertEqual(report["utterances"], 14)
+        self.assertEqual(report["invalid_lines"], 1)
+        self.assertEqual(report["rule_matched_by_flow"], {"售中订单管理流程": 5})
+        self.assertEqual(report["flows"]["售前产品咨询流程"]["unmatched"], 2)
+
+        cluster = report["flows"][UNLABELED]["clusters"][0]
+        self.assertEqual(cluster["size"], 7)
+        self.assertEqual(cluster["examples"], ["能便宜点吗", "便宜点行不行"])
+        trigger = cluster["suggested_trigger"]
+        self.assertEqual(trigger["coverage"], 1.0)
+        self.assertEqual(trigger["conflicts"], 0)
+        for example in cluster["examples"]:
+            self.assertRegex(example, re.compile(trigger["value"]))
+
+    def test_process_pool_matches_inline(self):
+        inline = label_corpus(self.corpus_path, flows_dir=FLOWS_DIR, workers=0, batch_size=3).to_dict()
+        pooled = label_corpus(self.corpus_path, flows_dir=FLOWS_DIR, workers=2, batch_size=3).to_dict()
+        self.assertEqual(pooled, inline)
+
+    def test_top_utterances_bounded(self):
+        top = TopUtterances(capacity=3)
+        for _ in range(10):
+            top.add("高频")
+        for i in range(100):
+            top.add(f"低频{i}")
+        self.assertLessEqual(len(top.counts), 6)
+        self.assertEqual(top.total, 110)
+        self.assertEqual(top.most_common()[0], ("高频", 10))
+
+    def test_cluster_utterances(self):
+        clusters = cluster_utterances([("你们几点下班", 3), ("你们客服几点下班", 1), ("开发票", 2)])
+        self.assertEqual([[text for text, _ in members] for members in clusters],
+                         [["你们几点下班", "你们客服几点下班"], ["开发票"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
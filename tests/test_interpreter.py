@@ -1,4 +1,10 @@
+import os
+import tempfile
+
 import pytest
+
+from core.session_manager import Session
+from dsl.dsl_parser import NO_STATE, ChatFlow, DslParser
 from dsl.interpreter import Interpreter
 
 def test_placeholder():
@@ -15,3 +21,87 @@ def test_placeholder():
 #     interpreter = Interpreter(rules)
 #     response = interpreter.get_response("greeting", "Hi")
 #     assert response == "Hello!"
+
+
+ORDER_FLOW = {
+    "name": "测试流程",
+    "entry_point": "start",
+    "states": [
+        {"id": "start", "transitions": [
+            {"condition": {"type": "regex", "value": "[A-Z][0-9]{4}"}, "target": "found"},
+            {"target": "retry"},
+        ]},
+        {"id": "retry", "actions": [{"type": "respond", "text": "请重新输入"}],
+         "transitions": [{"target": "start"}]},
+        {"id": "found", "actions": [{"type": "respond", "text": "已找到"}]},
+    ],
+}
+
+
+def test_compiled_state_indices():
+    flow = ChatFlow(ORDER_FLOW)
+    assert flow.entry_index == 0
+    assert [flow.state_index(state_id) for state_id in ("start", "retry", "found", "missing")] == [0, 1, 2, NO_STATE]
+    records = flow.transitions_at(0)
+    assert [(t.target_index, t.has_condition) for t in records] == [(2, True), (1, False)]
+    assert flow.fallback_at(0) is records[1]
+    assert flow.fallback_at(2) is None
+    assert flow.get_transitions("start") == ORDER_FLOW["states"][0]["transitions"]
+    assert flow.unresolved_targets == []
+
+
+def test_parser_rejects_unresolved_target(capsys):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "broken.yaml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('name: "坏流程"\nentry_point: "a"\nstates:\n'
+                    '  - id: "a"\n    transitions:\n      - target: "nowhere"\n')
+        assert DslParser(path).get_flow() is None
+    assert "状态 'a' 的转换目标 'nowhere' 不存在" in capsys.readouterr().out
+
+
+def test_session_state_index_follows_external_id():
+    flow = ChatFlow(ORDER_FLOW)
+    interpreter = Interpreter(flow)
+    session = Session("s1")
+
+    actions, matched = interpreter.process_with_match(session, "随便说说")
+    assert (actions, matched) == (ORDER_FLOW["states"][1]["actions"], True)
+    assert session.current_state_id == "retry"
+    assert session.get_state_index(flow) == 1
+
+    # 外部按ID设置状态（如恢复会话）后，编号重新解析
+    session.current_state_id = "start"
+    assert session.get_state_index(flow) == 0
+    actions, _ = interpreter.process_with_match(session, "订单 A1234")
+    assert actions == ORDER_FLOW["states"][2]["actions"]
+    assert session.current_state_id == "found"
+
+    session.current_state_id = "missing"
+    actions, matched = interpreter.process_with_match(session, "你好")
+    assert not matched and actions[0]["text"] == "错误：找不到状态 missing。"
+
+
+def test_session_get_reads_state_property():
+    flow = ChatFlow(ORDER_FLOW)
+    session = Session("s1")
+    assert session.get("current_state_id") is None
+    assert session.get("current_state_id", "默认") is None
+
+    session.set("current_state_id", "retry")
+    assert session.get("current_state_id") == session.current_state_id == "retry"
+    assert session.get_state_index(flow) == 1
+    session.set_state_index(flow, 2)
+    assert session.get("current_state_id") == "found"
+    # 不存在的键仍返回默认值
+    assert session.get("active_flow_name", "无") == "无"
+
+
+def test_unresolved_target_in_direct_flow():
+    flow = ChatFlow({"name": "测试流程", "entry_point": "a",
+                     "states": [{"id": "a", "transitions": [{"target": "nowhere"}]}]})
+    assert flow.unresolved_targets == [("a", "nowhere")]
+    session = Session("s1")
+    actions, matched = Interpreter(flow).process_with_match(session, "你好")
+    assert not matched and actions[0]["text"] == "错误：找不到目标状态 nowhere。"
+    assert session.current_state_id == "nowhere"
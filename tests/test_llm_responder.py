@@ -0,0 +1,174 @@
+"""
+LLMResponder 测试：JSON 提取与 JSON 模式
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm.json_extract import extract_json_object, iter_json_objects, validate_fields
+from llm.llm_responder import LLMResponder
+
+
+class TestExtractJson(unittest.TestCase):
+    """测试从模型输出中提取 JSON 对象"""
+
+    def test_plain_and_fenced(self):
+        expected = {"intent": "订单查询", "confidence": 0.9}
+        self.assertEqual(extract_json_object('{"intent": "订单查询", "confidence": 0.9}'), expected)
+        self.assertEqual(extract_json_object(
+            '好的，结果如下：\n```json\n{"intent": "订单查询", "confidence": 0.9}\n```\n以上。'), expected)
+
+    def test_braces_and_quotes_inside_strings(self):
+        text = '说明 {"reasoning": "用户说\\"{退款}\\"", "matched": true, "confidence": 0.8} 完'
+        result = extract_json_object(text, ("matched",))
+        self.assertEqual(result["reasoning"], '用户说"{退款}"')
+        self.assertTrue(result["matched"])
+
+    def test_required_keys_skip_other_objects(self):
+        text = '示例 {"intent": "x"} 实际结果 {"target": "state_refund", "confidence": 0.7}'
+        self.assertEqual(extract_json_object(text, ("target",))["target"], "state_refund")
+        self.assertIsNone(extract_json_object('{"intent": "x"}', ("matched",)))
+
+    def test_nested_wrapper(self):
+        text = '{"result": {"matched": false, "confidence": 0.2}}'
+        self.assertEqual(extract_json_object(text, ("matched",)), {"matched": False, "confidence": 0.2})
+
+    def test_stray_brace_before_object(self):
+        text = '注意 { 这里不是JSON {"intent": "退款退货", "confidence": 0.95}'
+        self.assertEqual(extract_json_object(text, ("intent",))["intent"], "退款退货")
+        # 孤立的 "{" 再多也不影响找到内部的对象
+        for count in (4, 5, 50):
+            text = "{ " * count + '{"intent": "订单查询", "confidence": 0.9}'
+            self.assertEqual(extract_json_object(text, ("intent",)), {"intent": "订单查询", "confidence": 0.9})
+
+    def test_objects_inside_invalid_outer_candidate(self):
+        text = '{伪JSON {"intent": "a"} 中间 {"bad" {"intent": "b"}} 还有 {"intent": "c"}}'
+        self.assertEqual(list(iter_json_objects(text)), [{"intent": "a"}, {"intent": "b"}, {"intent": "c"}])
+
+    def test_field_normalization(self):
+        self.assertEqual(validate_fields({"confidence": "85%", "matched": "True", "target": "null"}),
+                         {"confidence": 0.85, "matched": True, "target": None})
+        self.assertEqual(validate_fields({"confidence": 3})["confidence"], 1.0)
+        self.assertIsNone(validate_fields({"confidence": "high"}))
+        self.assertIsNone(validate_fields({"matched": "maybe"}))
+        self.assertIsNone(validate_fields({"intent": ""}))
+        self.assertIsNone(validate_fields({"target": 3}))
+
+    def test_no_object(self):
+        for text in (None, "", "抱歉，我无法判断", "{未闭合", "}{"):
+            self.assertIsNone(extract_json_object(text))
+
+    def test_fuzz_noise_around_object(self):
+        """随机噪声（含花括号、引号、反斜杠）包裹的对象：不抛异常；噪声中没有 "{" 时一定能找到"""
+        rng = random.Random(20240501)
+        alphabet = ['{', '}', '"', '\\', ':', ',', ' ', '\n', '`', '订', '单', 'a', '1']
+        for _ in range(500):
+            payload = {"intent": rng.choice(["订单查询", "退款退货", "闲聊 {问候}"]),
+                       "confidence": round(rng.random(), 3)}
+            noise = lambda: "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+            before, after = noise(), noise()
+            text = before + json.dumps(payload, ensure_ascii=False) + after
+            result = extract_json_object(text, ("intent",))
+            if result is not None:
+                self.assertIsNotNone(validate_fields(result, ("intent",)))
+            if "{" not in before:
+                self.assertEqual(result, payload)
+            # 前面只有孤立的 "{"（不含引号）时也一定能找到
+            stray = "{ " * rng.randint(1, 20)
+            self.assertEqual(extract_json_object(stray + json.dumps(payload, ensure_ascii=False) + after,
+                                                 ("intent",)), payload)
+
+    def test_fuzz_random_text_never_raises(self):
+        rng = random.Random(7)
+        alphabet = '{}[]":,\\ntrue0.5 意图'
+        for _ in range(2000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 80)))
+            result = extract_json_object(text, ("intent",))
+            self.assertTrue(result is None or isinstance(result["intent"], str))
+
+    def test_linear_worst_case(self):
+        """正则回溯的典型输入：大量不闭合/嵌套的花括号"""
+        size = 200_000
+        for text in ("{" * size, "{}" * (size // 2), '{"a":' * (size // 5), "{" + '"' * size,
+                     "{" * (size // 2) + "}" * (size // 2), '{"a":' * (size // 10) + "x" + "}" * (size // 10),
+                     "{ " * (size // 4) + '{"intent": "x"}'):
+            start = time.perf_counter()
+            list(iter_json_objects(text))
+            extract_json_object(text, ("intent",))
+            self.assertLess(time.perf_counter() - start, 2.0)
+
+
+class FlakyJsonCompletions:
+    """带 response_format 时按 status_code 返回错误的 chat.completions 桩"""
+
+    class StatusError(Exception):
+        def __init__(self, status_code):
+            super().__init__(f"Error code: {status_code}")
+            self.status_code = status_code
+
+    def __init__(self, reject_json_mode=None, reject_all=None, content='{"intent": "订单查询", "confidence": 0.9}'):
+        self.reject_json_mode = reject_json_mode
+        self.reject_all = reject_all
+        self.content = content
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.reject_all:
+            raise self.StatusError(self.reject_all)
+        if self.reject_json_mode and "response_format" in kwargs:
+            raise self.StatusError(self.reject_json_mode)
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class TestJsonMode(unittest.TestCase):
+    """测试 JSON 模式请求与服务端不支持时的自动关闭"""
+
+    def _responder(self, completions):
+        responder = LLMResponder(api_key="sk-test", model_name="test-model")
+        responder.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        return responder
+
+    def test_requests_json_mode(self):
+        completions = FlakyJsonCompletions()
+        result = self._responder(completions).recognize_intent("我的快递到哪了")
+        self.assertEqual(result["intent"], "订单查询")
+        self.assertEqual(completions.calls[0]["response_format"], {"type": "json_object"})
+
+    def test_unsupported_json_mode_disabled(self):
+        completions = FlakyJsonCompletions(reject_json_mode=400)
+        responder = self._responder(completions)
+        self.assertEqual(responder.recognize_intent("我的快递到哪了")["intent"], "订单查询")
+        self.assertFalse(responder.json_mode)
+        responder.check_semantic_match("东西坏了", "用户反馈故障")
+        self.assertNotIn("response_format", completions.calls[-1])
+        self.assertEqual(len(completions.calls), 3)
+
+    def test_other_errors_keep_json_mode(self):
+        responder = self._responder(FlakyJsonCompletions(reject_all=400))
+        with self.assertRaises(FlakyJsonCompletions.StatusError):
+            responder._create_json_completion(model="test-model", messages=[])
+        self.assertTrue(responder.json_mode)
+
+        responder = self._responder(FlakyJsonCompletions(reject_all=503))
+        with self.assertRaises(FlakyJsonCompletions.StatusError):
+            responder._create_json_completion(model="test-model", messages=[])
+        self.assertTrue(responder.json_mode)
+
+    def test_reply_generation_not_json_mode(self):
+        completions = FlakyJsonCompletions(content="您好")
+        self.assertEqual(self._responder(completions).generate_response("ctx", "你好"), "您好")
+        self.assertNotIn("response_format", completions.calls[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+LLM 提示词上下文压缩与体积统计测试
+"""
+
+import json
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dsl.dsl_parser import ChatFlow, DslParser
+from dsl.interpreter import Interpreter
+from llm.llm_responder import LLMResponder
+from llm.prompt_context import PromptContextBuilder, PromptMetrics, estimate_tokens
+
+FLOWS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dsl", "flows")
+
+
+class StubCompletions:
+    """记录请求消息并返回固定内容的 chat.completions 桩"""
+
+    def __init__(self, content):
+        self.content = content
+        self.messages = []
+
+    def create(self, **kwargs):
+        self.messages.append(kwargs["messages"])
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class RecordingSemanticLLM:
+    """记录 check_semantic_match 收到的会话上下文"""
+
+    def __init__(self):
+        self.contexts = []
+
+    def check_semantic_match(self, user_input, semantic_meaning, session_context=None):
+        self.contexts.append(session_context)
+        return {"matched": True, "confidence": 0.9, "reasoning": ""}
+
+
+def large_session_context():
+    return {
+        "current_state_id": "state_browse",
+        "variables": {
+            "order_id": "A1234567890",
+            "search_results": [{"sku": f"SKU{i:04d}", "title": "商品" * 20} for i in range(50)],
+            "note": "x" * 1000,
+        },
+    }
+
+
+class TestPromptContextBuilder(unittest.TestCase):
+    """测试上下文压缩与 token 预算"""
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("你好"), 2)
+        self.assertEqual(estimate_tokens("abcdefgh"), 2)
+
+    def test_small_context_is_compact_and_untruncated(self):
+        text, truncated = PromptContextBuilder().build({"current_state_id": "s1", "variables": {"a": [1, 2]}})
+        self.assertEqual(text, '{"current_state_id":"s1","variables":{"a":[1,2]}}')
+        self.assertFalse(truncated)
+        self.assertEqual(PromptContextBuilder().build(None), ("", False))
+
+    def test_truncates_lists_and_strings(self):
+        text, truncated = PromptContextBuilder(max_tokens=10000).build(large_session_context())
+        self.assertTrue(truncated)
+        variables = json.loads(text)["variables"]
+        self.assertEqual(len(variables["search_results"]), 4)
+        self.assertEqual(variables["search_results"][-1], "…(共50项)")
+        self.assertEqual(len(variables["note"]), 121)
+
+    def test_enforces_budget_by_dropping_largest_fields(self):
+        builder = PromptContextBuilder(max_tokens=30)
+        text, truncated = builder.build(large_session_context())
+        self.assertTrue(truncated)
+        self.assertLessEqual(estimate_tokens(text), 30)
+        data = json.loads(text)
+        self.assertEqual(data["current_state_id"], "state_browse")
+        self.assertEqual(data["variables"]["order_id"], "A1234567890")
+        self.assertNotIn("note", data["variables"])
+
+    def test_context_that_cannot_fit_is_omitted(self):
+        self.assertEqual(PromptContextBuilder(max_tokens=1).build({"current_state_id": "s" * 40}), ("", True))
+
+
+class TestPromptMetrics(unittest.TestCase):
+    """测试按方法统计提示词体积"""
+
+    def test_record_and_stats(self):
+        metrics = PromptMetrics()
+        metrics.record("check_semantic_match", [{"role": "user", "content": "a" * 40}], "b" * 8, True)
+        metrics.record("check_semantic_match", [{"role": "user", "content": "a" * 20}])
+        stats = metrics.stats()["check_semantic_match"]
+        self.assertEqual(stats["calls"], 2)
+        self.assertEqual(stats["total_tokens"], 15)
+        self.assertEqual(stats["max_tokens"], 10)
+        self.assertEqual(stats["last_tokens"], 5)
+        self.assertEqual(stats["avg_tokens"], 7.5)
+        self.assertEqual(stats["context_tokens"], 2)
+        self.assertEqual(stats["context_truncated"], 1)
+
+
+class TestResponderPromptSize(unittest.TestCase):
+    """测试 LLMResponder 写入提示词的上下文受预算约束并记录体积"""
+
+    def test_semantic_match_prompt_is_budgeted(self):
+        completions = StubCompletions('{"matched": true, "confidence": 0.9, "reasoning": ""}')
+        responder = LLMResponder(api_key="sk-test", model_name="test-model", context_token_budget=60)
+        responder.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        result = responder.check_semantic_match("这个不太好", "用户不满意", large_session_context())
+        self.assertTrue(result["matched"])
+
+        user_prompt = completions.messages[0][1]["content"]
+        self.assertNotIn("\n  ", user_prompt)
+        self.assertNotIn("SKU0049", user_prompt)
+        stats = responder.get_prompt_stats()["check_semantic_match"]
+        self.assertEqual(stats["calls"], 1)
+        self.assertLessEqual(stats["context_tokens"], 60)
+        self.assertEqual(stats["context_truncated"], 1)
+
+
+class TestInterpreterContextProjection(unittest.TestCase):
+    """测试 llm_semantic 条件默认带上会话变量，声明 context_variables 时只带声明的变量"""
+
+    def _check(self, rule):
+        llm = RecordingSemanticLLM()
+        interpreter = Interpreter(ChatFlow({"name": "测试流程"}), llm_responder=llm)
+        session = SimpleNamespace(current_state_id="state_browse",
+                                  variables=large_session_context()["variables"])
+        self.assertTrue(interpreter._check_single_rule(rule, "这个不太好", session))
+        return llm.contexts[0]
+
+    def test_only_declared_variables(self):
+        context = self._check({"type": "llm_semantic", "semantic_meaning": "用户不满意",
+                               "context_variables": ["order_id", "missing"]})
+        self.assertEqual(context, {"current_state_id": "state_browse",
+                                   "variables": {"order_id": "A1234567890"}})
+
+    def test_all_variables_by_default(self):
+        context = self._check({"type": "llm_semantic", "semantic_meaning": "用户不满意"})
+        self.assertEqual(context["variables"], large_session_context()["variables"])
+
+    def test_shipped_flow_variables_reach_prompt_within_budget(self):
+        # 已发布的退款流程收集的变量应进入语义匹配提示词，大字段由预算截断
+        flow = DslParser(os.path.join(FLOWS_DIR, "after_sales", "refund.yaml")).get_flow()
+        completions = StubCompletions('{"matched": true, "confidence": 0.9, "reasoning": ""}')
+        responder = LLMResponder(api_key="sk-test", model_name="test-model", context_token_budget=60)
+        responder.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        interpreter = Interpreter(flow, llm_responder=responder)
+        session = SimpleNamespace(current_state_id=flow.get_entry_state()["id"],
+                                  variables=large_session_context()["variables"])
+
+        rule = {"type": "llm_semantic", "semantic_meaning": "用户表达商品质量不满意"}
+        self.assertTrue(interpreter._check_single_rule(rule, "质量太差了", session))
+
+        user_prompt = completions.messages[0][1]["content"]
+        self.assertIn("A1234567890", user_prompt)
+        self.assertNotIn("SKU0049", user_prompt)
+        stats = responder.get_prompt_stats()["check_semantic_match"]
+        self.assertLessEqual(stats["context_tokens"], 60)
+        self.assertEqual(stats["context_truncated"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
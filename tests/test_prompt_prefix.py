@@ -0,0 +1,83 @@
+"""
+提示词前缀稳定性测试：通过本地替身 LLM 服务器记录真实发出的请求
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chatbot import Chatbot
+from llm.llm_responder import LLMResponder
+from llm.local_llm_server import LocalLLMServer, common_prefix_length, render_prompt
+
+
+class TestPromptPrefix(unittest.TestCase):
+    """测试每类 LLM 调用的提示词都以固定内容开头，变化部分在最后"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.llm_server = LocalLLMServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.llm_server.stop()
+
+    def setUp(self):
+        self.llm_server.clear()
+        self.responder = LLMResponder(api_key="sk-test", model_name="test-model",
+                                      base_url=self.llm_server.base_url, timeout=5)
+
+    def _assert_stable_prefix(self, stable_part):
+        """所有请求的提示词都以 stable_part 开头，且用户输入只出现在公共前缀之后"""
+        prompts = self.llm_server.prompts
+        self.assertGreaterEqual(len(prompts), 2)
+        for prompt in prompts:
+            self.assertTrue(prompt.startswith(stable_part))
+        self.assertGreaterEqual(common_prefix_length(prompts[0], prompts[1]), len(stable_part))
+
+    def test_intent_prompt_prefix_across_turns(self):
+        chatbot = Chatbot(llm_responder=self.responder)
+        chatbot.handle_message("s1", "@@@", user_id="U001")
+        chatbot.handle_message("s2", "随便聊聊别的", user_id="U002")
+
+        intent_requests = [r for r in self.llm_server.requests
+                           if r["messages"][0]["content"].startswith(LLMResponder.INTENT_SYSTEM_PROMPT)]
+        self.assertEqual(len(intent_requests), 2)
+        first, second = (request["messages"] for request in intent_requests)
+        self.assertEqual(first[0], second[0])
+        for description in chatbot.flow_descriptions:
+            self.assertIn(description, first[0]["content"])
+        self.assertTrue(first[-1]["content"].endswith("用户当前输入：@@@\n\n请分析用户意图。"))
+
+    def test_intent_system_prompt_built_once_per_flow_set(self):
+        chatbot = Chatbot(llm_responder=self.responder)
+        prompt = LLMResponder._intent_system_prompt(chatbot.flow_descriptions)
+        self.assertIs(LLMResponder._intent_system_prompt(tuple(chatbot.flow_descriptions)), prompt)
+
+    def test_semantic_match_prefix(self):
+        self.responder.check_semantic_match("东西不太好", "用户表达商品质量不满意",
+                                            {"current_state_id": "s1", "variables": {}})
+        self.responder.check_semantic_match("质量太差了", "用户表达商品质量不满意",
+                                            {"current_state_id": "s2", "variables": {"order_id": "A1"}})
+        self._assert_stable_prefix(render_prompt([
+            {"role": "system", "content": LLMResponder.SEMANTIC_MATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": "期望的语义含义：用户表达商品质量不满意"},
+        ]))
+
+    def test_condition_match_prefix(self):
+        targets = ["state_refund: 用户要退款", "state_exchange: 用户要换货"]
+        self.responder.match_condition_with_llm("我要退钱", "售后处理", targets)
+        self.responder.match_condition_with_llm("换个新的吧", "售后处理", targets,
+                                                {"current_state_id": "s1", "variables": {"order_id": "A1"}})
+        self._assert_stable_prefix(render_prompt([
+            {"role": "system", "content": LLMResponder.CONDITION_MATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": "当前状态：售后处理\n\n可选的目标状态：\n- state_refund: 用户要退款\n"
+                                        "- state_exchange: 用户要换货"},
+        ]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+令牌桶限流测试
+"""
+
+import os
+import sys
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chatbot import Chatbot
+from server.rate_limiter import RateLimitedLLMResponder, RateLimiter, RateLimitExceeded
+from server.server import ChatServer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingLLM:
+    """记录调用次数的 LLM 桩，意图识别总是返回低置信度"""
+
+    def __init__(self):
+        self.calls = 0
+        self.model_name = "fake"
+
+    def recognize_intent(self, user_input, available_intents=None, session_context=None):
+        self.calls += 1
+        return {"intent": "未知", "confidence": 0.0, "reasoning": ""}
+
+    def generate_response(self, context, user_input):
+        self.calls += 1
+        return "LLM回复"
+
+
+class TestRateLimiter(unittest.TestCase):
+    """测试令牌桶的突发、补充与分键"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter("user", rate=2, burst=3, clock=self.clock)
+
+    def test_burst_then_refill(self):
+        self.assertEqual([self.limiter.acquire("U001") for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(self.limiter.acquire("U001"), 0.5)
+
+        self.clock.now += 0.5
+        self.assertEqual(self.limiter.acquire("U001"), 0.0)
+        self.assertGreater(self.limiter.acquire("U001"), 0)
+
+        # 长时间空闲后最多只恢复到 burst
+        self.clock.now += 60
+        self.assertEqual(sum(1 for _ in range(5) if not self.limiter.acquire("U001")), 3)
+
+    def test_keys_are_independent(self):
+        for _ in range(3):
+            self.limiter.acquire("U001")
+        self.assertGreater(self.limiter.acquire("U001"), 0)
+        self.assertEqual(self.limiter.acquire("U002"), 0.0)
+        stats = self.limiter.stats()
+        self.assertEqual((stats["allowed"], stats["limited"], stats["keys"]), (4, 1, 2))
+
+    def test_key_eviction_and_discard(self):
+        limiter = RateLimiter("connection", rate=1, burst=1, max_keys=2, clock=self.clock)
+        for key in ("a", "b", "c"):
+            limiter.acquire(key)
+        self.assertEqual(limiter.stats()["keys"], 2)
+        limiter.discard("c")
+        self.assertEqual(limiter.stats()["keys"], 1)
+
+    def test_from_config(self):
+        self.assertIsNone(RateLimiter.from_config("llm", False, 5, 10))
+        self.assertIsNone(RateLimiter.from_config("llm", {"rate": 0}, 5, 10))
+        limiter = RateLimiter.from_config("llm", {"burst": 1}, 5, 10)
+        self.assertEqual((limiter.rate, limiter.burst), (5.0, 1.0))
+
+
+class TestLLMRateLimit(unittest.TestCase):
+    """测试全局 LLM 限流：超出额度时退回固定模板，不调用 LLM"""
+
+    def test_proxy_raises_when_exhausted(self):
+        llm = CountingLLM()
+        proxy = RateLimitedLLMResponder(llm, RateLimiter("llm", rate=1, burst=1, clock=FakeClock()))
+        self.assertEqual(proxy.model_name, "fake")
+        self.assertEqual(proxy.generate_response("", "hi"), "LLM回复")
+        with self.assertRaises(RateLimitExceeded) as ctx:
+            proxy.generate_response("", "hi")
+        self.assertEqual(ctx.exception.scope, "llm")
+        self.assertEqual(llm.calls, 1)
+
+    def test_chatbot_degrades_to_template(self):
+        llm = CountingLLM()
+        limiter = RateLimiter("llm", rate=1, burst=2, clock=FakeClock())
+        chatbot = Chatbot(llm_responder=RateLimitedLLMResponder(llm, limiter))
+
+        # 第一条无法规则匹配的消息消耗 2 个令牌（意图识别 + 兜底回复）
+        self.assertEqual(chatbot.handle_message("s1", "@@@", user_id="U001"), ["LLM回复"])
+        reply = chatbot.handle_message("s1", "###", user_id="U001")
+        self.assertIn("抱歉，我暂时无法理解您的意思", reply[0])
+        self.assertEqual(llm.calls, 2)
+        self.assertEqual(limiter.stats()["limited"], 2)
+
+
+class TestServerRateLimit(unittest.TestCase):
+    """测试服务器返回结构化的 rate_limited 错误"""
+
+    def test_rate_limited_response(self):
+        server = ChatServer.__new__(ChatServer)
+        server.rate_limiters = {"user": RateLimiter("user", rate=1, burst=1, clock=FakeClock())}
+        self.assertIsNone(server._check_rate_limit("user", "U001"))
+        response = server._check_rate_limit("user", "U001")
+        self.assertEqual(response["type"], "error")
+        self.assertEqual(response["code"], "rate_limited")
+        self.assertEqual(response["scope"], "user")
+        self.assertEqual(response["retry_after"], 1.0)
+        # 未配置的维度不限流
+        self.assertIsNone(server._check_rate_limit("connection", "127.0.0.1:50000"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+断线重连恢复会话测试
+
+通过 socketpair 直接驱动 ChatServer.handle_client，不监听真实端口
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.chatbot import Chatbot
+from server.server import ChatServer
+from server.token_cache import VerifiedTokenCache
+
+
+class TestSessionResume(unittest.TestCase):
+    """测试凭 JWT 恢复对话会话"""
+
+    def setUp(self):
+        # 只初始化会话相关属性，避免读取配置与连接LLM
+        self.server = ChatServer.__new__(ChatServer)
+        self.server.running = True
+        self.server.chatbot = Chatbot()
+        self.server.clients = {}
+        self.server.authenticated_users = {}
+        self.server.conversations = {}
+        self.server.clients_lock = threading.Lock()
+        self.server.jwt_secret = "test-secret-0123456789abcdef-0123"
+        self.server.jwt_exp_hours = 1
+        self.server.jwt_algorithm = "HS256"
+        self.server.token_cache = VerifiedTokenCache()
+        self.server.rate_limiters = {}
+        self.server.admission = None
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def _connect(self, connection_id):
+        client_sock, server_sock = socket.socketpair()
+        self.sockets.append(client_sock)
+        self.server.clients[connection_id] = (server_sock, None)
+        thread = threading.Thread(target=self.server.handle_client,
+                                  args=(server_sock, None, connection_id), daemon=True)
+        thread.start()
+        self.assertEqual(self._receive(client_sock)["type"], "welcome")
+        return client_sock, thread
+
+    @staticmethod
+    def _receive(sock):
+        sock.settimeout(10)
+        return json.loads(sock.recv(65536).decode("utf-8"))
+
+    def _request(self, sock, request):
+        sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8"))
+        return self._receive(sock)
+
+    def _login(self, connection_id, user_id="U001"):
+        conversation_id = self.server._start_conversation(connection_id, user_id)
+        return self.server._generate_jwt(user_id, "张三", conversation_id), conversation_id
+
+    def test_reconnect_resumes_flow_state(self):
+        first, first_thread = self._connect("127.0.0.1:50001")
+        token, conversation_id = self._login("127.0.0.1:50001")
+        self._request(first, {"type": "message", "content": "我想查询物流信息", "token": token})
+        reply = self._request(first, {"type": "message", "content": "订单号是A1234567890", "token": token})
+        self.assertEqual(reply["session_id"], conversation_id)
+        session = self.server.chatbot.session_manager.find_session(conversation_id)
+        state_before = session.current_state_id
+        first.close()
+        first_thread.join(timeout=5)
+
+        second, _ = self._connect("127.0.0.1:50002")
+        result = self._request(second, {"type": "resume", "token": token})
+        self.assertTrue(result["success"])
+        self.assertTrue(result["resumed"])
+        self.assertEqual(result["session_id"], conversation_id)
+        self.assertEqual(result["current_state_id"], state_before)
+        self.assertEqual(result["active_flow_name"], "售中订单管理流程")
+
+        # 新连接无需携带 Token 即可继续同一会话
+        self._request(second, {"type": "message", "content": "谢谢"})
+        self.assertIs(self.server.chatbot.session_manager.find_session(conversation_id), session)
+        self.assertEqual(session.variables.get("order_id"), "A1234567890")
+
+    def test_resume_collects_replaced_session_and_connection(self):
+        manager = self.server.chatbot.session_manager
+        stale, stale_thread = self._connect("127.0.0.1:50003")
+        token, conversation_id = self._login("127.0.0.1:50003")
+        self._request(stale, {"type": "message", "content": "你好", "token": token})
+
+        # 同一用户其他设备的会话（当前没有连接）与其他用户的会话
+        manager.get_session("S-other-device", user_id="U001")
+        manager.get_session("S-other-user", user_id="U002")
+
+        # 新连接先登录开始了新会话，再恢复旧 Token：被替换的新会话立即回收
+        fresh, _ = self._connect("127.0.0.1:50004")
+        fresh_token, fresh_conversation = self._login("127.0.0.1:50004")
+        self._request(fresh, {"type": "message", "content": "你好", "token": fresh_token})
+        self.assertIsNotNone(manager.find_session(fresh_conversation))
+        result = self._request(fresh, {"type": "resume", "token": token})
+        self.assertEqual(result["removed_sessions"], 1)
+        self.assertIsNone(manager.find_session(fresh_conversation))
+        self.assertIsNotNone(manager.find_session("S-other-device"))
+        self.assertIsNotNone(manager.find_session("S-other-user"))
+        self.assertIsNotNone(manager.find_session(conversation_id))
+
+        # 仍绑定在该会话上的旧连接被关闭
+        stale_thread.join(timeout=5)
+        self.assertFalse(stale_thread.is_alive())
+        self.assertEqual(self.server.conversations, {"127.0.0.1:50004": conversation_id})
+
+    def test_resume_keeps_other_devices_sessions(self):
+        manager = self.server.chatbot.session_manager
+        phone, phone_thread = self._connect("127.0.0.1:50006")
+        phone_token, phone_conversation = self._login("127.0.0.1:50006")
+        self._request(phone, {"type": "message", "content": "我想查询物流信息", "token": phone_token})
+        laptop, laptop_thread = self._connect("127.0.0.1:50007")
+        laptop_token, laptop_conversation = self._login("127.0.0.1:50007")
+        self._request(laptop, {"type": "message", "content": "我要退款", "token": laptop_token})
+
+        # 两台设备先后短暂断线，手机先重连不应删除笔记本的会话
+        laptop.close()
+        laptop_thread.join(timeout=5)
+        phone.close()
+        phone_thread.join(timeout=5)
+        phone, _ = self._connect("127.0.0.1:50008")
+        self.assertEqual(self._request(phone, {"type": "resume", "token": phone_token})["removed_sessions"], 0)
+        self.assertIsNotNone(manager.find_session(laptop_conversation))
+
+        laptop, _ = self._connect("127.0.0.1:50009")
+        result = self._request(laptop, {"type": "resume", "token": laptop_token})
+        self.assertTrue(result["resumed"])
+        self.assertEqual(result["active_flow_name"], "标准退款流程")
+        self.assertIsNotNone(manager.find_session(phone_conversation))
+
+    def test_token_message_binds_connection(self):
+        manager = self.server.chatbot.session_manager
+        # 只发送带 Token 消息、从未 resume 的连接
+        token_only, _ = self._connect("127.0.0.1:50010")
+        token = self.server._generate_jwt("U001", "张三", "S-token-only")
+        self._request(token_only, {"type": "message", "content": "我要退款", "token": token})
+        self.assertEqual(self.server.conversations["127.0.0.1:50010"], "S-token-only")
+
+        # 同一用户在另一连接上恢复其他会话，不影响使用中的会话
+        other, _ = self._connect("127.0.0.1:50011")
+        other_token, _ = self._login("127.0.0.1:50011")
+        self.assertEqual(self._request(other, {"type": "resume", "token": other_token})["removed_sessions"], 0)
+        session = manager.find_session("S-token-only")
+        self.assertIsNotNone(session)
+        self.assertEqual(session.get("active_flow_name"), "标准退款流程")
+
+    def test_invalid_token_rejected(self):
+        sock, _ = self._connect("127.0.0.1:50005")
+        result = self._request(sock, {"type": "resume", "token": "not-a-token"})
+        self.assertFalse(result["success"])
+        token_without_sid = self.server._generate_jwt("U001", "张三")
+        self.assertFalse(self._request(sock, {"type": "resume", "token": token_without_sid})["success"])
+
+
+if __name__ == "__main__":
+    unittest.main()
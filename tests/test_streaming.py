@@ -0,0 +1,138 @@
+"""
+流式回复测试：LLMResponder -> Chatbot -> ChatServer -> ChatClient
+"""
+
+import os
+import socket
+import sys
+import threading
+import unittest
+from types import SimpleNamespace
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client.client import ChatClient
+from core.chatbot import Chatbot
+from llm.llm_responder import LLMResponder
+from server.server import ChatServer
+from server.token_cache import VerifiedTokenCache
+
+
+def make_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class StubCompletions:
+    """按顺序产出预设片段的 chat.completions 桩"""
+
+    def __init__(self, pieces, fail_after=None):
+        self.pieces = pieces
+        self.fail_after = fail_after
+        self.kwargs = None
+
+    def create(self, **kwargs):
+        self.kwargs = kwargs
+        return self._iterate()
+
+    def _iterate(self):
+        for i, piece in enumerate(self.pieces):
+            if i == self.fail_after:
+                raise ConnectionError("stream reset")
+            yield make_chunk(piece)
+
+
+class StreamingLLM:
+    """只实现流式兜底回复的 LLM 桩，意图识别总是失败"""
+
+    def recognize_intent(self, user_input, available_intents=None, session_context=None):
+        return {"intent": "未知", "confidence": 0.0, "reasoning": ""}
+
+    def generate_response(self, context, user_input, stream=False):
+        pieces = ["您好，", "我是", "智能客服。"]
+        return iter(pieces) if stream else "".join(pieces)
+
+
+class TestLLMResponderStreaming(unittest.TestCase):
+    """测试 generate_response(stream=True) 逐段产出文本"""
+
+    def _responder(self, completions):
+        responder = LLMResponder(api_key="sk-test", model_name="test-model")
+        responder.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        return responder
+
+    def test_yields_deltas(self):
+        completions = StubCompletions(["\n  ", " 您好", None, "，请问", "有什么可以帮您？"])
+        parts = list(self._responder(completions).generate_response("ctx", "hi", stream=True))
+        self.assertTrue(completions.kwargs["stream"])
+        self.assertEqual(parts, ["您好", "，请问", "有什么可以帮您？"])
+
+    def test_error_before_first_token(self):
+        completions = StubCompletions(["您好"], fail_after=0)
+        parts = list(self._responder(completions).generate_response("ctx", "hi", stream=True))
+        self.assertEqual(parts, [LLMResponder.RESPONSE_FAILED_MESSAGE])
+
+    def test_error_after_first_token_truncates(self):
+        completions = StubCompletions(["您好", "，请问"], fail_after=1)
+        parts = list(self._responder(completions).generate_response("ctx", "hi", stream=True))
+        self.assertEqual(parts, ["您好"])
+
+
+class TestStreamingEndToEnd(unittest.TestCase):
+    """测试服务器以 response_chunk 帧发送，客户端逐段接收"""
+
+    def setUp(self):
+        self.server = ChatServer.__new__(ChatServer)
+        self.server.running = True
+        self.server.chatbot = Chatbot(llm_responder=StreamingLLM())
+        self.server.clients = {}
+        self.server.authenticated_users = {}
+        self.server.conversations = {}
+        self.server.clients_lock = threading.Lock()
+        self.server.jwt_secret = "test-secret-0123456789abcdef-0123"
+        self.server.jwt_exp_hours = 1
+        self.server.jwt_algorithm = "HS256"
+        self.server.token_cache = VerifiedTokenCache()
+        self.server.rate_limiters = {}
+        self.server.admission = None
+
+        client_sock, server_sock = socket.socketpair()
+        client_sock.settimeout(10)
+        self.addCleanup(client_sock.close)
+        connection_id = "127.0.0.1:50010"
+        self.server.clients[connection_id] = (server_sock, None)
+        threading.Thread(target=self.server.handle_client,
+                         args=(server_sock, None, connection_id), daemon=True).start()
+
+        self.client = ChatClient(client_name="StreamTest")
+        self.client.socket = client_sock
+        self.client.connected = True
+        self.assertEqual(self.client._receive_message()["type"], "welcome")
+        conversation_id = self.server._start_conversation(connection_id, "U001")
+        self.client.token = self.server._generate_jwt("U001", "张三", conversation_id)
+        self.client.authenticated = True
+
+    def test_chatbot_returns_iterator_only_when_streaming(self):
+        chatbot = self.server.chatbot
+        self.assertEqual(chatbot.handle_message("s1", "@@@", user_id="U001"), ["您好，我是智能客服。"])
+        reply = chatbot.handle_message("s1", "@@@", user_id="U001", stream=True)[0]
+        self.assertNotIsInstance(reply, str)
+        self.assertEqual("".join(reply), "您好，我是智能客服。")
+
+    def test_streamed_llm_reply(self):
+        # 不请求流式时只有一条完整 response
+        self.assertEqual(self.client.send_message("@@@"), ["您好，我是智能客服。"])
+
+        chunks = []
+        response = self.client.send_message("@@@", on_chunk=lambda index, delta: chunks.append((index, delta)))
+        self.assertEqual(chunks, [(0, "您好，"), (0, "我是"), (0, "智能客服。")])
+        self.assertEqual(response, ["您好，我是智能客服。"])
+
+    def test_flow_replies_sent_as_single_chunks(self):
+        chunks = []
+        response = self.client.send_message("我想查询物流信息", on_chunk=lambda index, delta: chunks.append(index))
+        self.assertEqual(chunks, list(range(len(response))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+已验证 JWT 缓存测试
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+import jwt
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.server import ChatServer
+from server.token_cache import VerifiedTokenCache
+
+
+class TestVerifiedTokenCache(unittest.TestCase):
+    """测试缓存的命中、过期、容量与吊销"""
+
+    def test_hit_and_expiry(self):
+        cache = VerifiedTokenCache()
+        cache.put("t1", {"user_id": "U001", "exp": time.time() + 60})
+        self.assertEqual(cache.get("t1")["user_id"], "U001")
+        self.assertIsNone(cache.get("t2"))
+
+        cache.put("t3", {"user_id": "U002", "exp": time.time() - 1})
+        self.assertIsNone(cache.get("t3"))
+        self.assertEqual(cache.stats()["size"], 1)
+
+    def test_bounded_lru(self):
+        cache = VerifiedTokenCache(max_size=2)
+        exp = time.time() + 60
+        cache.put("a", {"exp": exp})
+        cache.put("b", {"exp": exp})
+        cache.get("a")
+        cache.put("c", {"exp": exp})
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_token_without_exp_not_cached(self):
+        cache = VerifiedTokenCache()
+        cache.put("t", {"user_id": "U001"})
+        self.assertIsNone(cache.get("t"))
+
+    def test_revoke(self):
+        cache = VerifiedTokenCache()
+        cache.put("t", {"user_id": "U001", "exp": time.time() + 60})
+        cache.revoke("t")
+        self.assertIsNone(cache.get("t"))
+        self.assertTrue(cache.is_revoked("t"))
+        cache.put("t", {"user_id": "U001", "exp": time.time() + 60})
+        self.assertIsNone(cache.get("t"))
+
+
+class TestServerJwtVerification(unittest.TestCase):
+    """测试 ChatServer._verify_jwt 只对首次出现的 Token 做完整校验"""
+
+    def setUp(self):
+        # 只初始化 JWT 相关属性，避免加载流程与数据库
+        self.server = ChatServer.__new__(ChatServer)
+        self.server.jwt_secret = "test-secret-0123456789abcdef-0123"
+        self.server.jwt_exp_hours = 1
+        self.server.jwt_algorithm = "HS256"
+        self.server.token_cache = VerifiedTokenCache()
+
+    def test_repeat_verification_skips_decode(self):
+        token = self.server._generate_jwt("U001", "张三")
+        with mock.patch("server.server.jwt.decode", wraps=jwt.decode) as decode:
+            for _ in range(5):
+                self.assertEqual(self.server._verify_jwt(token)[0], "U001")
+        self.assertEqual(decode.call_count, 1)
+
+    def test_tampered_token_rejected(self):
+        token = self.server._generate_jwt("U001", "张三")
+        self.server._verify_jwt(token)
+        forged = jwt.encode({"user_id": "U002", "exp": time.time() + 60}, "other-secret-0123456789abcdef-01234", algorithm="HS256")
+        self.assertEqual(self.server._verify_jwt(forged), (None, None))
+
+    def test_revoked_token_rejected(self):
+        token = self.server._generate_jwt("U001", "张三")
+        self.assertEqual(self.server._verify_jwt(token)[0], "U001")
+        self.server.revoke_jwt(token)
+        self.assertEqual(self.server._verify_jwt(token), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
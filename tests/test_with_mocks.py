@@ -303,6 +303,17 @@ class TestSession(unittest.TestCase):
         self.assertEqual(session_dict["current_state_id"], "state_test")
         self.assertIn("key1", session_dict["variables"])
 
+    def test_session_variable_versions(self):
+        """测试会话变量版本号随写入递增"""
+        session = Session("test-session")
+        self.assertEqual(session.variables.version("key1"), 0)
+        session.variables["key1"] = "value1"
+        session.variables["key1"] = "value2"
+        self.assertEqual(session.variables.version("key1"), 2)
+        session.variables.pop("key1")
+        self.assertEqual(session.variables.version("key1"), 3)
+        self.assertEqual(session.variables.version("other"), 0)
+
     def test_session_update_activity(self):
         """测试会话活跃时间更新"""
         import time